@@ -4,15 +4,19 @@ This example runs the pipeline on four synthpop syntheses (using the input files
 difference of F1 scores) against a privacy score (disclosure risk).
 """
 
-import json
 import os
 import subprocess
 import shutil
+import sys
 import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
 import argparse
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir, "metrics", "report"))
+from dashboard import update_database, load_table, utility_metric, privacy_metric
+
 out_path = "../run-inputs/"
 synth_path = "../synth-output/"
 
@@ -62,20 +66,15 @@ def main():
     copy_parameter_files(indirectory)
     run_pipeline()
 
+    # the metrics of the runs are read from the dashboard database (see
+    # metrics/report/dashboard.py), which only reads the new outputs
     f_list = os.listdir(path=indirectory)
-    privacy_scores = []
-    utility_scores = []
-
-    for f in [os.path.splitext(name)[0] for name in f_list]:
-
-        with open(os.path.join(synth_path, f, "disclosure_risk.json")) as privacy_file:
-            privacy_dict = json.load(privacy_file)
-        privacy_scores.append(privacy_dict["EMRi_norm"])
-
-        with open(os.path.join(synth_path, f, "sklearn_classifiers.json")) as utility_file:
-            utility_dict = json.load(utility_file)
-            print(utility_file)
-        utility_scores.append(utility_dict["Overall"]["f1_diff"])
+    runs = [os.path.splitext(name)[0] for name in f_list]
+    path_db = os.path.join(synth_path, "metrics.sqlite")
+    update_database(path_db, synth_path)
+    table = load_table(path_db, prefixes=[utility_metric, privacy_metric]).loc[runs]
+    privacy_scores = table[privacy_metric].to_numpy()
+    utility_scores = table[utility_metric].to_numpy()
 
     print(f"Privacy scores: {1-np.array(privacy_scores)}")
     print(f"Utility scores: {1-np.array(utility_scores)}")
@@ -0,0 +1,33 @@
+import json
+import os
+import pytest
+
+
+@pytest.fixture
+def write_datasets(tmp_path):
+    """Returns a function writing an original dataset and released
+    datasets in tmp_path, as read by the metric scripts"""
+
+    def write(columns, make_dataset, num_releases=2, path_released=None):
+        """
+        Writes original.csv (make_dataset(0)) with its metadata
+        original.json (with the given columns) in tmp_path, unless they
+        already exist, and synthetic_data_<i>.csv (make_dataset(i)) for
+        i = 1..num_releases in path_released (tmp_path by default).
+        Returns the paths of the original dataset, its metadata and the
+        directory of the released datasets.
+        """
+        path_original = str(tmp_path / "original.csv")
+        path_meta = str(tmp_path / "original.json")
+        if not os.path.isfile(path_original):
+            make_dataset(0).to_csv(path_original, index=False)
+            with open(path_meta, "w") as f:
+                json.dump({"columns": columns}, f)
+        path_released = str(path_released or tmp_path)
+        os.makedirs(path_released, exist_ok=True)
+        for i in range(1, num_releases + 1):
+            make_dataset(i).to_csv(os.path.join(path_released, f"synthetic_data_{i}.csv"),
+                                   index=False)
+        return path_original, path_meta, path_released
+
+    return write
@@ -7,19 +7,29 @@ import json
 import os
 import pickle
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from glob import glob
+from scipy import sparse
 
 sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, "utilities"))
-from utils import handle_cmdline_args
+from utils import create_cmdline_parser, released_paths
+from data_loader import read_original
+import cache
 
 
 # constants
-path_save_max_values = "./dict_max_matches.pkl"
+# output files, saved in the synth-output directory
+path_save_metrics = "privacy_disclosure_risk.json"
+path_save_max_values = "dict_max_matches.pkl"
 # if output_mode = 3, save the pdfs (see below for more info)
-path_save_p_dist_all = "./p_dist_all.pkl"
+# as a scipy.sparse CSR matrix
+path_save_p_dist_all = "p_dist_all.npz"
+# hashes of the inputs used to create the outputs above,
+# if they have not changed the computation is skipped
+path_save_manifest = "privacy_disclosure_risk.manifest.json"
 # column that contains indices of the original (not synthesized) dataset
 # when matching rows between two datasets, ignore indx_column 
 indx_column = "idx"
@@ -29,8 +39,12 @@ indx_column = "idx"
 # mode 3: return full probability distribution for each intruder row 
 #    output probability distribution over each row of the released data, 
 #    e.g., if the released data has 9000 rows and the intruder's data has 1000 rows, 
-#    a numpy array with 1000 x 9000 dimensions will be created.
+#    a sparse matrix with 1000 x 9000 dimensions will be created
+#    (only the non-zero probabilities are stored).
 output_mode = 1
+# matches of each released dataset are cached in this directory (relative to
+# the synth-output directory), so that reruns only process new or changed files
+matches_cache_dir = ".disclosure_risk_cache"
 # the following value will be used to extract "found" rows from the released data:
 # np.max(p.d.f of one intruder row)*threshold_max
 # this should help with floating point comparisons of numbers that are very close
@@ -46,9 +60,466 @@ def compare_rows(row_check, dataframe_check, drop_column="idx"):
     return dataframe_matched
 
 
-def main():
+def find_matches_reference(df_itdr, df_rlsd, columns):
+    """
+    Reference implementation of find_matches. Every intruder row is
+    compared against the whole released dataset with compare_rows, so
+    the cost is O(intruder rows x released rows x columns). This is
+    kept to check the results of find_matches in tests.
+
+    Returns the same (indptr, indices) arrays as find_matches.
+    """
+    df_itdr = df_itdr[columns].copy()
+    df_itdr[indx_column] = np.arange(len(df_itdr))
+    df_rlsd = df_rlsd[columns].copy()
+    df_rlsd[indx_column] = np.arange(len(df_rlsd))
+
+    list_indices = []
+    for i_itdr, one_intruder_row in df_itdr.iterrows():
+        row_matches = compare_rows(one_intruder_row, df_rlsd,
+                                   drop_column=indx_column)
+        list_indices.append(row_matches[indx_column].to_numpy(dtype=np.int64))
+
+    indptr = np.zeros(len(list_indices) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(one_indices) for one_indices in list_indices])
+    indices = np.concatenate(list_indices) if list_indices else np.array([], dtype=np.int64)
+    return indptr, indices
+
+
+def factorize_intruder(df_itdr, columns):
+    """
+    Factorize the intruder's columns into integer key tuples.
+
+    Each column is factorized separately and the resulting code tuples
+    are factorized again, so that every distinct intruder row gets a
+    single integer key. Rows that contain a missing value get the
+    key -1 (NaN never compares equal, so these rows cannot be matched).
+
+    Returns
+    -------
+    itdr_keys : numpy.array
+        The key of each intruder row.
+    col_uniques : list
+        The distinct values (pandas.Index) of each column, used to
+        translate released values into the same codes.
+    key_index : pandas.MultiIndex
+        The distinct code tuples, position in key_index is the key.
+    """
+    col_codes = []
+    col_uniques = []
+    for col in columns:
+        codes, uniques = pd.factorize(df_itdr[col])
+        col_codes.append(codes)
+        col_uniques.append(uniques)
+
+    itdr_keys, key_index = pd.MultiIndex.from_arrays(col_codes).factorize()
+    itdr_keys = itdr_keys.astype(np.int64)
+    itdr_keys[np.any(np.column_stack(col_codes) < 0, axis=1)] = -1
+    return itdr_keys, col_uniques, key_index
+
+
+def column_codes(uniques, values):
+    """
+    Position of each value in uniques (-1 if not found). Categorical
+    columns are translated through their categories, so each distinct
+    value is only looked up once.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories_codes = uniques.get_indexer(values.cat.categories)
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, categories_codes[codes], -1)
+    return uniques.get_indexer(values)
+
+
+def released_keys(df_rlsd, columns, col_uniques, key_index):
+    """
+    Translate the rows of df_rlsd into the keys created by
+    factorize_intruder. Rows whose values do not occur in the intruder's
+    dataset get the key -1.
+    """
+    col_codes = [column_codes(uniques, df_rlsd[col])
+                 for col, uniques in zip(columns, col_uniques)]
+    rlsd_keys = key_index.get_indexer(pd.MultiIndex.from_arrays(col_codes)).astype(np.int64)
+    rlsd_keys[np.any(np.column_stack(col_codes) < 0, axis=1)] = -1
+    return rlsd_keys
+
+
+def build_match_index(keys_valid, rows_valid, num_keys):
+    """
+    Build the index key -> released row ids from the keys of the
+    released rows that can be matched (key >= 0) and their row ids,
+    given in increasing row order. The row ids of key k are
+    order[offsets[k]:offsets[k + 1]], in increasing order.
+    """
+    order = rows_valid[np.argsort(keys_valid, kind="stable")]
+    offsets = np.zeros(num_keys + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(keys_valid, minlength=num_keys))
+    return offsets, order
+
+
+def lookup_matches(itdr_keys, offsets, order):
+    """
+    Resolve all intruder keys against a match index in one step.
+
+    Returns (indptr, indices) in compressed sparse row layout: the
+    released rows matching intruder row i are
+    indices[indptr[i]:indptr[i + 1]].
+    """
+    found = itdr_keys >= 0
+    starts = np.where(found, offsets[:-1][np.where(found, itdr_keys, 0)], 0)
+    counts = np.where(found, offsets[1:][np.where(found, itdr_keys, 0)], 0) - starts
+
+    indptr = np.zeros(len(itdr_keys) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(counts)
+    positions = np.repeat(starts - indptr[:-1], counts) + np.arange(indptr[-1])
+    return indptr, order[positions]
+
+
+def find_matches(df_itdr, df_rlsd, columns):
+    """
+    Find, for every row of the intruder's dataset, all rows of the
+    released dataset that are equal to it in the given columns.
+
+    The intruder's columns are factorized into integer keys, an index
+    key -> released row ids is built once and all intruder rows are
+    looked up together. The output is identical to
+    find_matches_reference.
+
+    Parameters
+    ----------
+    df_itdr : pandas.DataFrame
+        The intruder's dataset.
+    df_rlsd : pandas.DataFrame
+        The released dataset.
+    columns : list
+        Names of the columns the intruder has access to.
+
+    Returns
+    -------
+    indptr, indices : numpy.array
+        The matches in compressed sparse row layout, the (positional)
+        released row ids matching intruder row i are
+        indices[indptr[i]:indptr[i + 1]].
+    """
+    intruder_factors = factorize_intruder(df_itdr, columns)
+    return match_released(df_rlsd, columns, intruder_factors)
+
+
+def match_released(df_rlsd, columns, intruder_factors):
+    """
+    Same as find_matches, but uses the output of factorize_intruder
+    so that the intruder's dataset is only factorized once.
+    """
+    return match_released_chunks([df_rlsd], columns, intruder_factors)[1:]
+
+
+def match_released_chunks(chunks_rlsd, columns, intruder_factors):
+    """
+    Same as match_released, but the released dataset is given as an
+    iterable of consecutive chunks of rows. Only the keys and global
+    row ids of the released rows that can be matched are kept between
+    chunks, so memory is bounded by the chunk size.
+
+    Returns
+    -------
+    num_rows : integer
+        Total number of rows in the released dataset.
+    indptr, indices : numpy.array
+        The matches, see find_matches.
+    """
+    itdr_keys, col_uniques, key_index = intruder_factors
+    list_keys = []
+    list_rows = []
+    num_rows = 0
+    for df_chunk in chunks_rlsd:
+        rlsd_keys = released_keys(df_chunk, columns, col_uniques, key_index)
+        rows_valid = np.flatnonzero(rlsd_keys >= 0)
+        list_keys.append(rlsd_keys[rows_valid])
+        # convert to row ids of the full released dataset
+        list_rows.append(rows_valid + num_rows)
+        num_rows += len(df_chunk)
+
+    offsets, order = build_match_index(np.concatenate(list_keys),
+                                       np.concatenate(list_rows),
+                                       len(key_index))
+    indptr, indices = lookup_matches(itdr_keys, offsets, order)
+    return num_rows, indptr, indices
+
+
+def released_dtypes(df_itdr, columns):
+    """
+    Compact dtypes used to read the released datasets: text columns
+    are read as categoricals, numerical columns are left to pandas.
+    The categories are read as text, see numeric_categories.
+    """
+    return {col: "category" for col in columns
+            if df_itdr[col].dtype == object}
+
+
+def numeric_categories(df_rlsd):
+    """
+    Convert the categoricals read with released_dtypes back to numbers
+    when all their categories are numbers, as pandas would have read
+    these columns without a dtype. Otherwise a released column of
+    integers would match the text values of an intruder column with
+    mixed types (e.g. "1" in ["1", "x", "3"]), which compare_rows does
+    not do. As with pandas' own chunked reads, the type is inferred
+    separately for each chunk when the released dataset is streamed.
+    """
+    for col in df_rlsd.columns:
+        if not isinstance(df_rlsd[col].dtype, pd.CategoricalDtype):
+            continue
+        numeric = pd.to_numeric(df_rlsd[col].cat.categories, errors="coerce")
+        if len(numeric) == 0 or numeric.isna().any():
+            continue
+        if numeric.is_unique:
+            df_rlsd[col] = df_rlsd[col].cat.rename_categories(numeric)
+        else:
+            # e.g. "1" and "1.0" are the same number
+            codes = df_rlsd[col].cat.codes.to_numpy()
+            df_rlsd[col] = np.where(codes >= 0, numeric.to_numpy(dtype=float)[codes], np.nan)
+    return df_rlsd
+
+
+def match_released_file(path_released_ds, columns, intruder_factors,
+                        dtypes=None, chunksize=None):
+    """
+    Read one released dataset and find the matches of all intruder
+    rows in it. This is the unit of work given to the worker processes.
+
+    Only the intruder's columns are read. If chunksize is given, the
+    file is streamed in chunks of chunksize rows.
+
+    Returns
+    -------
+    num_rows : integer
+        Number of rows in the released dataset.
+    indptr, indices : numpy.array
+        The matches (see find_matches), indices is stored as int32
+        when the number of rows allows it.
+    """
+    if chunksize is None:
+        chunks_rlsd = [pd.read_csv(path_released_ds, usecols=columns, dtype=dtypes)]
+    else:
+        chunks_rlsd = pd.read_csv(path_released_ds, usecols=columns, dtype=dtypes,
+                                  chunksize=chunksize)
+    chunks_rlsd = (numeric_categories(df_chunk) for df_chunk in chunks_rlsd)
+    num_rows, indptr, indices = match_released_chunks(chunks_rlsd, columns,
+                                                      intruder_factors)
+    if num_rows <= np.iinfo(np.int32).max:
+        indices = indices.astype(np.int32)
+    return num_rows, indptr, indices
+
+
+def matches_cache_key(released_hash, df_itdr, vars_intruder,
+                      num_samples_intruder, random_state):
+    """
+    Key of the cached matches of a released dataset. It depends on the
+    contents of the released dataset (released_hash, see cache.file_hash)
+    and of the intruder's dataset, and on the parameters used to sample
+    the intruder's dataset.
+    """
+    itdr_hash = pd.util.hash_pandas_object(df_itdr, index=False).sum()
+    return cache.hash_key(released_hash, str(itdr_hash),
+                          vars_intruder, num_samples_intruder, random_state)
+
+
+def load_cached_matches(path_cache):
+    """Returns the (num_rows, indptr, indices) tuple stored by
+    save_cached_matches."""
+    with np.load(path_cache) as cached:
+        output = int(cached["num_rows"]), cached["indptr"], cached["indices"]
+    cache.touch(path_cache)
+    return output
+
+
+def save_cached_matches(path_cache, num_rows, indptr, indices):
+    """Stores the output of match_released_file in the cache."""
+    path_tmp = cache.temporary_path(path_cache)
+    with open(path_tmp, "wb") as f:
+        np.savez(f, num_rows=num_rows, indptr=indptr, indices=indices)
+    os.replace(path_tmp, path_cache)
+
+
+def probability_rows(list_file_matches, num_rows_itdr, num_rows_released):
+    """
+    Combine the matches of all released datasets into the probability
+    distribution over the released rows of each intruder row (part of
+    equation 6 in "Accounting for Intruder Uncertainty Due to Sampling
+    When Estimating Identification Disclosure Risks in Partially
+    Synthetic Data" paper). In each released dataset, every matched row
+    gets 1 / (number of matches) and the sum is normalized by the number
+    of released datasets.
+
+    The contributions are summed in the order of list_file_matches, so
+    the output does not depend on the order in which they were computed.
+
+    Parameters
+    ----------
+    list_file_matches : list
+        (indptr, indices) tuple of each released dataset.
+    num_rows_itdr : integer
+        Number of rows in the intruder's dataset.
+    num_rows_released : integer
+        Number of rows in the released datasets.
+
+    Returns
+    -------
+    p_dist_all : scipy.sparse.csr_matrix
+        Matrix with one row per intruder row and one column per released
+        row, only the non-zero probabilities are stored.
+    """
+    list_keys = []
+    list_weights = []
+    for indptr, indices in list_file_matches:
+        counts = np.diff(indptr)
+        rows = np.repeat(np.arange(num_rows_itdr, dtype=np.int64), counts)
+        list_keys.append(rows * num_rows_released + indices)
+        list_weights.append(1. / np.repeat(counts, counts))
+
+    # bincount adds the weights sequentially, i.e. in the order of the files
+    keys_unique, keys_inverse = np.unique(np.concatenate(list_keys), return_inverse=True)
+    data = np.bincount(keys_inverse, weights=np.concatenate(list_weights))
+    # normalize based on the number of released datasets
+    data /= float(len(list_file_matches))
+
+    rows, indices = np.divmod(keys_unique, num_rows_released)
+    indptr = np.zeros(num_rows_itdr + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=num_rows_itdr))
+    # the indices are already sorted within each row and have no duplicates
+    p_dist_all = sparse.csr_matrix((data, indices, indptr),
+                                   shape=(num_rows_itdr, num_rows_released))
+    p_dist_all.has_sorted_indices = True
+    return p_dist_all
+
+
+def max_matches(p_dist_all, threshold=threshold_max):
+    """
+    Extract, for each intruder row, the released rows with probability
+    >= np.max(p.d.f of the intruder row)*threshold from the sparse
+    probability distributions. If an intruder row has no matches, its
+    p.d.f. is zero everywhere and all released rows are (implicitly)
+    selected.
+
+    Returns
+    -------
+    counts : numpy.array
+        Number of selected released rows for each intruder row, this is
+        the number of released rows if the intruder row has no matches.
+    indptr, indices, values : numpy.array
+        The selected released rows and their probabilities in compressed
+        sparse row layout. Intruder rows without matches have no entries.
+    """
+    num_rows_itdr, num_rows_released = p_dist_all.shape
+    row_lengths = np.diff(p_dist_all.indptr)
+    rows = np.repeat(np.arange(num_rows_itdr), row_lengths)
+    has_matches = row_lengths > 0
+
+    row_max = np.zeros(num_rows_itdr)
+    if np.any(has_matches):
+        row_max[has_matches] = np.maximum.reduceat(p_dist_all.data,
+                                                   p_dist_all.indptr[:-1][has_matches])
+    found_max = p_dist_all.data >= (row_max[rows]*threshold)
+
+    indices = p_dist_all.indices[found_max]
+    values = p_dist_all.data[found_max]
+    indptr = np.zeros(num_rows_itdr + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(rows[found_max], minlength=num_rows_itdr))
+    counts = np.where(has_matches, np.diff(indptr), num_rows_released)
+    return counts, indptr, indices, values
+
+
+def max_matches_to_dict(counts, indptr, indices, values):
+    """
+    Convert the output of max_matches to a dictionary with the
+    intruder rows (as strings) as keys and lists
+    [indices of the released rows, probabilities] as values.
+    """
+    dict_max_matches = {}
+    for i_itdr in range(len(counts)):
+        if indptr[i_itdr] == indptr[i_itdr + 1]:
+            indx_max_matches = list(range(counts[i_itdr]))
+            values_max_matches = [0.] * int(counts[i_itdr])
+        else:
+            indx_max_matches = indices[indptr[i_itdr]:indptr[i_itdr + 1]].tolist()
+            values_max_matches = values[indptr[i_itdr]:indptr[i_itdr + 1]].tolist()
+        dict_max_matches[f"{i_itdr}"] = [indx_max_matches, values_max_matches]
+    return dict_max_matches
+
+
+def disclosure_risk_metrics(counts, indptr, indices, intruder_indexes,
+                            num_samples_intruder):
+    """
+    Calculate the disclosure risk metrics from the output of max_matches.
+
+    For each intruder row, c is the number of selected released rows and
+    I is 1 if the intruder row's index in the original dataset is one of
+    them (0 otherwise).
+
+    Parameters
+    ----------
+    counts, indptr, indices : numpy.array
+        Output of max_matches.
+    intruder_indexes : list
+        Index of each intruder row in the original dataset.
+    num_samples_intruder : integer
+        Number of rows in the intruder's dataset.
+
+    Returns
+    -------
+    metrics : dict
+        EMRi, TMRi and TMRa and the normalized EMRi_norm and TMRi_norm.
+    """
+    intruder_indexes = np.asarray(intruder_indexes)
+    num_rows_released = np.max(counts)
+    rows = np.repeat(np.arange(len(counts)), np.diff(indptr))
+    has_matches = np.diff(indptr) > 0
+
+    I = np.zeros(len(counts), dtype=np.int64)
+    I[rows[indices == intruder_indexes[rows]]] = 1
+    # without matches, all the released rows are selected
+    I[~has_matches] = intruder_indexes[~has_matches] < num_rows_released
+    c = counts
+
+    EMRi = np.sum(I / c)
+    EMRi_norm = EMRi / num_samples_intruder
+    TMRi = float(np.sum(c * I == 1))
+    TMRi_norm = TMRi / num_samples_intruder
+    TMRa = TMRi / np.sum(c == 1)
+    metrics = {'EMRi': EMRi, 'TMRi': TMRi, 'TMRa': TMRa, 'EMRi_norm': EMRi_norm, 'TMRi_norm': TMRi_norm}
+    return metrics
+
+
+def handle_cmdline_args(argv=None):
+    """Return the command line arguments (or the arguments in the list
+    argv) of the metric scripts, with the options specific to disclosure
+    risk added."""
+    parser = create_cmdline_parser()
+    parser.add_argument(
+        '--chunksize', dest='chunksize', type=int, default=None,
+        help='Stream the released datasets in chunks of this many rows '
+             '(default: read each released dataset at once)')
+    parser.add_argument(
+        '--force', dest='force', action='store_true',
+        help='Recompute the metrics even if the inputs have not changed')
+    parser.add_argument(
+        '--no-cache', dest='use_cache', action='store_false',
+        help='Do not read or write the cache of matches of the released datasets')
+    parser.add_argument(
+        '--cache-max-size', dest='cache_max_size', type=float, default=None,
+        help='Maximum size of the cache of matches in MB, the least recently '
+             'used entries are removed first (default: no limit)')
+    parser.add_argument(
+        '--cache-max-age', dest='cache_max_age', type=float, default=None,
+        help='Remove cached matches that have not been used for this many days '
+             '(default: no limit)')
+    args = parser.parse_args(argv)
+    return args
+
+
+def main(argv=None):
     # read command line options
-    args = handle_cmdline_args()
+    args = handle_cmdline_args(argv)
     verbose = False
 
     with open(args.infile) as f:
@@ -68,18 +539,42 @@ def main():
                                         os.path.basename(dataset) + "_numcat.csv")
     else:
         path_original_ds = os.path.abspath(dataset) + '.csv'
+    path_original_meta = os.path.abspath(dataset) + '.json'
 
     # read parameters from .json
     parameters = synth_params["parameters"]
     disclosure_risk_parameters = synth_params["privacy_parameters_disclosure_risk"]
 
+    # list of paths of the released/synthetic datasets, in the same
+    # order as in the utility metrics
+    list_paths_released_ds = released_paths(path_released_ds)
+
+    # skip the computation if none of the inputs changed since the last run
+    dict_released_hashes = {one_released_ds: cache.file_hash(one_released_ds)
+                            for one_released_ds in list_paths_released_ds}
+    manifest = {"run_input": cache.hash_key(dataset, synth_method,
+                                            parameters['random_state'],
+                                            disclosure_risk_parameters),
+                "original": cache.file_hash(path_original_ds),
+                "released": {os.path.basename(one_released_ds): released_hash
+                             for one_released_ds, released_hash in dict_released_hashes.items()}}
+    path_manifest = os.path.join(path_released_ds, path_save_manifest)
+    path_metrics = os.path.join(path_released_ds, path_save_metrics)
+    if not args.force and cache.is_up_to_date(path_manifest, manifest,
+                                              [path_metrics,
+                                               os.path.join(path_released_ds, path_save_max_values)]):
+        print("[INFO] Disclosure risk privacy metrics are up to date")
+        # mark the outputs as newer than the inputs (for make)
+        cache.touch(path_metrics)
+        return
+
     # read original data set
-    data_full = pd.read_csv(path_original_ds)
+    data_full = read_original(path_original_ds, path_original_meta)
 
     # read/set intruder samples number
     if disclosure_risk_parameters['num_samples_intruder'] > data_full.shape[0]:
         sys.exit("Intruder samples cannot be more than original dataset samples: "
-                 + disclosure_risk_parameters["num_samples_intruder"] + " > " + data_full.shape[0])
+                 f"{disclosure_risk_parameters['num_samples_intruder']} > {data_full.shape[0]}")
     elif disclosure_risk_parameters['num_samples_intruder'] == -1:
         num_samples_intruder = data_full.shape[0]
     else:
@@ -96,87 +591,73 @@ def main():
 
     # itdr: intruder
     df_itdr = pd.read_csv(path_released_ds + "/intruder_data.csv")
-    # XXX should be changed after indices are added to real/synthetic data
-    df_itdr["idx"] = df_itdr.index
-
-    # list of paths of the released/synthetic datasets
-    list_paths_released_ds = glob(path_released_ds + "/synthetic_data_*.csv")
-    list_paths_released_ds.sort()
-
-    dict_matches = {}
-    num_rows_released = False
-    num_files_released = False
+    vars_intruder = disclosure_risk_parameters['vars_intruder']
 
     # rlsd: released
     # itdr: intruder
     if verbose:
         print("Finding similar rows between released and intruder's datasets...\n")
-    for i_rlsd, one_released_ds in enumerate(list_paths_released_ds):
-        if verbose:
-            print(f"Processing {one_released_ds} ...")
-        df_rlsd = pd.read_csv(one_released_ds)
-        if not num_rows_released:
-            num_rows_released = len(df_rlsd)
-            num_files_released = len(list_paths_released_ds)
-
-        # XXX should be changed after indices are added to real/synthetic data
-        df_rlsd["idx"] = df_rlsd.index
-
-        # consider only columns that intruder has access to
-        df_rlsd_cols_selected = df_rlsd[df_itdr.columns]
-        for i_itdr, one_intruder_row in df_itdr.iterrows():
-            row_matches = compare_rows(one_intruder_row,
-                                       df_rlsd_cols_selected,
-                                       drop_column=indx_column)
-            matches_num_rows = len(row_matches)
-            if matches_num_rows > 0:
-                matches_indx_list = row_matches.idx.to_list()
-            else:
-                matches_indx_list = []
-
-            if not f"{i_itdr}" in dict_matches.keys():
-                dict_matches[f"{i_itdr}"] = [matches_indx_list]
-            else:
-                dict_matches[f"{i_itdr}"].append(matches_indx_list)
+    # consider only columns that intruder has access to
+    intruder_factors = factorize_intruder(df_itdr, vars_intruder)
+    dtypes = released_dtypes(df_itdr, vars_intruder)
+
+    # reuse the matches of released datasets that were already processed
+    path_cache_dir = os.path.join(path_released_ds, matches_cache_dir)
+    dict_outputs = {}
+    dict_paths_cache = {}
+    if args.use_cache:
+        for one_released_ds in list_paths_released_ds:
+            key = matches_cache_key(dict_released_hashes[one_released_ds], df_itdr, vars_intruder,
+                                    num_samples_intruder, parameters['random_state'])
+            dict_paths_cache[one_released_ds] = cache.cache_path(path_cache_dir, key, ".npz")
+            if os.path.isfile(dict_paths_cache[one_released_ds]):
+                dict_outputs[one_released_ds] = load_cached_matches(dict_paths_cache[one_released_ds])
+    list_paths_to_match = [one_released_ds for one_released_ds in list_paths_released_ds
+                           if one_released_ds not in dict_outputs]
+    if verbose:
+        print(f"{len(dict_outputs)} released datasets found in the cache")
+
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            list_new_outputs = list(executor.map(match_released_file,
+                                                 list_paths_to_match,
+                                                 repeat(vars_intruder),
+                                                 repeat(intruder_factors),
+                                                 repeat(dtypes),
+                                                 repeat(args.chunksize)))
+    else:
+        list_new_outputs = [match_released_file(one_released_ds, vars_intruder, intruder_factors,
+                                                dtypes, args.chunksize)
+                            for one_released_ds in list_paths_to_match]
+    for one_released_ds, one_output in zip(list_paths_to_match, list_new_outputs):
+        dict_outputs[one_released_ds] = one_output
+        if args.use_cache:
+            save_cached_matches(dict_paths_cache[one_released_ds], *one_output)
+    if args.use_cache:
+        cache.evict(path_cache_dir,
+                    max_size=None if args.cache_max_size is None else args.cache_max_size * 2**20,
+                    max_age=None if args.cache_max_age is None else args.cache_max_age * 86400,
+                    verbose=verbose)
+
+    # keep the order of list_paths_released_ds
+    list_outputs = [dict_outputs[one_released_ds] for one_released_ds in list_paths_released_ds]
+    num_rows_released = list_outputs[0][0]
+    list_file_matches = [(indptr, indices) for _, indptr, indices in list_outputs]
 
     if verbose:
         print("Creating probability distributions for each row in intruder's dataset...")
-    p_dist_all = np.array([])
-    dict_max_matches = {}
-    for i_itdr in dict_matches:
-        if verbose:
-            print(".", end="", flush=True)
-        # first create a zero array with num_rows_released as the number of entries
-        p_dist_row = np.zeros(num_rows_released)
-        for m_rlsd in range(num_files_released):
-            indicator_row = dict_matches[i_itdr][m_rlsd]
-            len_indicator_row = len(indicator_row)
-            # Part of equation 6 in "Accounting for Intruder Uncertainty Due to
-            # Sampling When Estimating Identification Disclosure Risks in
-            # Partially Synthetic Data" paper.
-            p_dist_row[indicator_row] += np.ones(len_indicator_row)/len_indicator_row
-        # normalize based on the number of released datasets
-        p_dist_row /= float(num_files_released)
-
-        # output_mode == 3, returns full probability
-        if output_mode == 3:
-            if len(p_dist_all) == 0:
-                p_dist_all = np.vstack([p_dist_row])
-            else:
-                p_dist_all = np.vstack([p_dist_all, p_dist_row])
-
-        # store indices and values correspond to p_dist_row >= (np.max(p_dist_row)*threshold_max)
-        indx_max_matches = np.where(p_dist_row >= (np.max(p_dist_row)*threshold_max))[0].tolist()
-        values_max_matches = p_dist_row[indx_max_matches].tolist()
-        dict_max_matches[f"{i_itdr}"] = [indx_max_matches, values_max_matches]
+    p_dist_all = probability_rows(list_file_matches, len(df_itdr), num_rows_released)
+
+    # store indices and values correspond to p_dist_row >= (np.max(p_dist_row)*threshold_max)
+    counts, indptr_max, indices_max, values_max = max_matches(p_dist_all, threshold_max)
 
     # save outputs
-    with open(path_save_max_values, "wb") as output_file:
-        pickle.dump(dict_max_matches, output_file)
+    with open(os.path.join(path_released_ds, path_save_max_values), "wb") as output_file:
+        pickle.dump(max_matches_to_dict(counts, indptr_max, indices_max, values_max),
+                    output_file)
     # output_mode == 3, returns full probability
     if output_mode == 3:
-        with open(path_save_p_dist_all, "wb") as output_file:
-            pickle.dump(p_dist_all, output_file)
+        sparse.save_npz(os.path.join(path_released_ds, path_save_p_dist_all), p_dist_all)
 
     # Plot p.d.f computed in the previous step
     # This only works with output_mode == 3 (return full probability)
@@ -190,12 +671,13 @@ def main():
             print(f"[ERROR] total number of rows in the intruder's dataset: {len(df_itdr)}")
             continue
 
-        # print the selected row in dict_matches
-        print(dict_matches[f"{row_select}"])
+        # print the matches of the selected row in each released dataset
+        print([indices[indptr[row_select]:indptr[row_select + 1]].tolist()
+               for indptr, indices in list_file_matches])
 
         # plot the p.d.f.
         plt.figure(figsize=(12, 6))
-        plt.plot(p_dist_all[row_select, :].T, c="k")
+        plt.plot(p_dist_all[row_select].toarray().ravel(), c="k")
         plt.xlabel("Released data row", size=22)
         plt.ylabel("p.d.f", size=22)
         plt.xticks(size=16)
@@ -206,26 +688,14 @@ def main():
         plt.show()
 
     # Calculate privacy metrics
-    with open(path_released_ds + "/intruder_indexes.json") as f_intruder_indexes:
-        intruder_indexes = json.load(f_intruder_indexes)
-
-    c = {key: len(value[0]) for key, value in dict_max_matches.items()}
-    I = {key: np.multiply(intruder_indexes[int(key)] in value[0], 1) for key, value in dict_max_matches.items()}
-    products = {k: c.get(k) * I.get(k) for k in set(c)}
-    K = {key: np.multiply(value == 1, 1) for key, value in products.items()}
-    c_indicator = {key: np.multiply(value == 1, 1) for key, value in c.items()}
-
-    EMRi = sum({k: I.get(k) / c.get(k) for k in set(c)}.values())
-    EMRi_norm = EMRi / disclosure_risk_parameters['num_samples_intruder']
-    TMRi = float(sum(K.values()))
-    TMRi_norm = TMRi / disclosure_risk_parameters['num_samples_intruder']
-    TMRa = TMRi / sum(c_indicator.values())
-    metrics = {'EMRi': EMRi, 'TMRi': TMRi, 'TMRa': TMRa, 'EMRi_norm': EMRi_norm, 'TMRi_norm': TMRi_norm}
+    metrics = disclosure_risk_metrics(counts, indptr_max, indices_max, indexes,
+                                      num_samples_intruder)
     if verbose:
         print(f"\nDisclosure risk metrics: {metrics}")
 
-    with open(path_released_ds + "/disclosure_risk.json", 'w') as f:
+    with open(path_metrics, 'w') as f:
         json.dump(metrics, f, indent=4)
+    cache.write_manifest(path_manifest, manifest)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,265 @@
+import json
+import os
+import pickle
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import disclosure_risk
+from disclosure_risk import find_matches, find_matches_reference, match_released_file, \
+    factorize_intruder, released_dtypes, probability_rows, max_matches, max_matches_to_dict, \
+    disclosure_risk_metrics, main, path_save_metrics, path_save_max_values, matches_cache_dir
+
+# Fixed inputs for tests
+vars_intruder = ["sex", "age", "edu"]
+random_state = 1234
+
+
+def make_dataset(num_rows, seed):
+    """Small mixed-type dataset with repeated rows and missing values"""
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame({"sex": rng.choice(["MALE", "FEMALE"], num_rows),
+                       "age": rng.randint(18, 23, num_rows),
+                       "edu": rng.choice(["PRIMARY", "SECONDARY", None], num_rows),
+                       "income": rng.rand(num_rows)})
+    return df
+
+
+@pytest.fixture
+def datasets():
+    df_rlsd = make_dataset(300, random_state)
+    df_itdr = make_dataset(40, random_state + 1)[vars_intruder]
+    return df_itdr, df_rlsd
+
+
+def test_find_matches_equals_reference(datasets):
+    df_itdr, df_rlsd = datasets
+    indptr, indices = find_matches(df_itdr, df_rlsd, vars_intruder)
+    indptr_ref, indices_ref = find_matches_reference(df_itdr, df_rlsd, vars_intruder)
+    np.testing.assert_array_equal(indptr, indptr_ref)
+    np.testing.assert_array_equal(indices, indices_ref)
+    assert len(indices) > 0, "Test datasets should contain some matches"
+
+
+def test_find_matches_mixed_numeric_types(datasets):
+    df_itdr, df_rlsd = datasets
+    # integers in the intruder's dataset should match the same floats
+    df_rlsd = df_rlsd.astype({"age": float})
+    indptr, indices = find_matches(df_itdr, df_rlsd, vars_intruder)
+    indptr_ref, indices_ref = find_matches_reference(df_itdr, df_rlsd, vars_intruder)
+    np.testing.assert_array_equal(indptr, indptr_ref)
+    np.testing.assert_array_equal(indices, indices_ref)
+
+
+def test_find_matches_no_matches(datasets):
+    df_itdr, df_rlsd = datasets
+    df_rlsd = df_rlsd.assign(sex="UNKNOWN")
+    indptr, indices = find_matches(df_itdr, df_rlsd, vars_intruder)
+    assert len(indptr) == len(df_itdr) + 1
+    assert len(indices) == 0
+
+
+def test_match_released_file_chunks(datasets, tmp_path):
+    df_itdr, df_rlsd = datasets
+    path_released_ds = os.path.join(tmp_path, "synthetic_data_1.csv")
+    df_rlsd.to_csv(path_released_ds, index=False)
+    df_rlsd = pd.read_csv(path_released_ds)
+    intruder_factors = factorize_intruder(df_itdr, vars_intruder)
+    dtypes = released_dtypes(df_itdr, vars_intruder)
+    indptr_ref, indices_ref = find_matches_reference(df_itdr, df_rlsd, vars_intruder)
+    for chunksize in [None, 7, 1000]:
+        num_rows, indptr, indices = match_released_file(path_released_ds, vars_intruder,
+                                                        intruder_factors, dtypes, chunksize)
+        assert num_rows == len(df_rlsd)
+        np.testing.assert_array_equal(indptr, indptr_ref)
+        np.testing.assert_array_equal(indices, indices_ref)
+
+
+@pytest.mark.parametrize("released_text", [False, True])
+def test_match_released_file_mixed_types(datasets, tmp_path, released_text):
+    """Text intruder values only match the released values read as text"""
+    df_itdr, df_rlsd = datasets
+    # e.g. ["18", "x", "20"] in the intruder's dataset
+    df_itdr = df_itdr.astype({"age": str})
+    df_itdr.loc[df_itdr.index[::3], "age"] = "x"
+    if released_text:
+        df_rlsd = df_rlsd.astype({"age": str})
+        df_rlsd.loc[df_rlsd.index[::5], "age"] = "x"
+    path_released_ds = os.path.join(tmp_path, "synthetic_data_1.csv")
+    df_rlsd.to_csv(path_released_ds, index=False)
+    df_rlsd = pd.read_csv(path_released_ds)
+    intruder_factors = factorize_intruder(df_itdr, vars_intruder)
+    dtypes = released_dtypes(df_itdr, vars_intruder)
+    indptr_ref, indices_ref = find_matches_reference(df_itdr, df_rlsd, vars_intruder)
+    assert (len(indices_ref) > 0) == released_text
+    for chunksize in [None, 1000]:
+        _, indptr, indices = match_released_file(path_released_ds, vars_intruder,
+                                                 intruder_factors, dtypes, chunksize)
+        np.testing.assert_array_equal(indptr, indptr_ref)
+        np.testing.assert_array_equal(indices, indices_ref)
+
+
+def test_probability_rows_equals_dense(datasets):
+    df_itdr, df_rlsd = datasets
+    list_file_matches = []
+    for seed in range(3):
+        df_one_rlsd = df_rlsd.sample(frac=1., replace=True, random_state=seed)
+        list_file_matches.append(find_matches(df_itdr, df_one_rlsd, vars_intruder))
+
+    # dense probability distributions, as in equation 6
+    p_dist_all = np.zeros((len(df_itdr), len(df_rlsd)))
+    for indptr, indices in list_file_matches:
+        for i_itdr in range(len(df_itdr)):
+            indicator_row = indices[indptr[i_itdr]:indptr[i_itdr + 1]]
+            p_dist_all[i_itdr, indicator_row] += np.ones(len(indicator_row))/len(indicator_row)
+    p_dist_all /= float(len(list_file_matches))
+
+    p_dist_sparse = probability_rows(list_file_matches, len(df_itdr), len(df_rlsd))
+    np.testing.assert_array_equal(p_dist_sparse.toarray(), p_dist_all)
+
+
+def test_disclosure_risk_metrics_equals_dict(datasets):
+    df_itdr, df_rlsd = datasets
+    # half of the intruder rows are taken from the released dataset
+    intruder_indexes = np.random.RandomState(random_state).choice(len(df_rlsd), len(df_itdr),
+                                                                  replace=False)
+    # and one of them is unique
+    df_rlsd.loc[intruder_indexes[0], "age"] = 99
+    df_itdr = pd.concat([df_rlsd.loc[intruder_indexes[:20], vars_intruder],
+                         df_itdr[20:]], ignore_index=True)
+
+    list_file_matches = [find_matches(df_itdr, df_rlsd, vars_intruder)]
+    p_dist_all = probability_rows(list_file_matches, len(df_itdr), len(df_rlsd))
+    counts, indptr, indices, values = max_matches(p_dist_all)
+    dict_max_matches = max_matches_to_dict(counts, indptr, indices, values)
+
+    # metrics computed with dictionaries
+    c = {key: len(value[0]) for key, value in dict_max_matches.items()}
+    I = {key: np.multiply(intruder_indexes[int(key)] in value[0], 1)
+         for key, value in dict_max_matches.items()}
+    EMRi = sum(I[k] / c[k] for k in c)
+    TMRi = float(sum(c[k] * I[k] == 1 for k in c))
+    TMRa = TMRi / sum(value == 1 for value in c.values())
+
+    metrics = disclosure_risk_metrics(counts, indptr, indices, intruder_indexes, len(df_itdr))
+    assert TMRi > 0, "Test datasets should contain some unique true matches"
+    assert metrics["EMRi"] == pytest.approx(EMRi)
+    assert metrics["TMRi"] == TMRi
+    assert metrics["TMRa"] == pytest.approx(TMRa)
+
+
+def write_run(write_datasets, tmp_path, name, num_releases=3):
+    """Original dataset (with its metadata), run input and the output
+    directory tmp_path/name with its released datasets (see
+    write_datasets in conftest.py), returns the paths of the run input
+    and of the output directory"""
+    columns = [{"name": "sex", "type": "Categorical"},
+               {"name": "age", "type": "DiscreteNumerical"},
+               {"name": "edu", "type": "Categorical"},
+               {"name": "income", "type": "ContinuousNumerical"}]
+    path_original, _, path_output = write_datasets(
+        columns, lambda i: make_dataset(300 if i > 0 else 200, random_state + i),
+        num_releases, path_released=tmp_path / name)
+    path_run_input = str(tmp_path / f"{name}.json")
+    with open(path_run_input, "w") as f:
+        json.dump({"enabled": True, "dataset": os.path.splitext(path_original)[0],
+                   "synth-method": "synthpop",
+                   "parameters": {"random_state": random_state},
+                   "privacy_parameters_disclosure_risk": {"enabled": True,
+                                                          "num_samples_intruder": 50,
+                                                          "vars_intruder": vars_intruder}},
+                  f)
+    return path_run_input, path_output
+
+
+def read_outputs(path_output):
+    """Metrics and maximum matches written by main"""
+    with open(os.path.join(path_output, path_save_metrics)) as f:
+        metrics = json.load(f)
+    with open(os.path.join(path_output, path_save_max_values), "rb") as f:
+        max_values = pickle.load(f)
+    return metrics, max_values
+
+
+def test_main_parallel_matches_sequential(write_datasets, tmp_path):
+    outputs = []
+    for jobs in [1, 2]:
+        path_run_input, path_output = write_run(write_datasets, tmp_path, f"jobs_{jobs}")
+        main(["-i", path_run_input, "-o", path_output, "-j", str(jobs), "--no-cache"])
+        outputs.append(read_outputs(path_output))
+    assert outputs[1][0] == outputs[0][0]
+    assert outputs[1][1].keys() == outputs[0][1].keys()
+    for row in outputs[0][1]:
+        np.testing.assert_array_equal(outputs[1][1][row], outputs[0][1][row])
+
+
+def test_main_matches_cache(write_datasets, tmp_path, monkeypatch):
+    path_run_input, path_output = write_run(write_datasets, tmp_path, "run")
+    main(["-i", path_run_input, "-o", path_output, "--no-cache"])
+    expected = read_outputs(path_output)
+    path_cache_dir = os.path.join(path_output, matches_cache_dir)
+    assert not os.path.isdir(path_cache_dir)
+
+    matched = []
+
+    def counting_match_released_file(path_released, *args):
+        matched.append(os.path.basename(path_released))
+        return match_released_file(path_released, *args)
+
+    monkeypatch.setattr(disclosure_risk, "match_released_file", counting_match_released_file)
+    # the matches are computed once, then read from the cache
+    for num_matched in [3, 0]:
+        matched.clear()
+        main(["-i", path_run_input, "-o", path_output, "--force"])
+        assert len(matched) == num_matched
+        assert len(os.listdir(path_cache_dir)) == 3
+        assert read_outputs(path_output)[0] == expected[0]
+
+    # only the modified released dataset is matched again, the entry of
+    # its previous contents stays in the cache until it is evicted
+    make_dataset(300, 0).to_csv(os.path.join(path_output, "synthetic_data_2.csv"), index=False)
+    matched.clear()
+    main(["-i", path_run_input, "-o", path_output, "--force"])
+    assert matched == ["synthetic_data_2.csv"]
+    assert len(os.listdir(path_cache_dir)) == 4
+    main(["-i", path_run_input, "-o", path_output, "--force", "--cache-max-size", "0"])
+    assert os.listdir(path_cache_dir) == []
+
+
+def test_main_skips_up_to_date(write_datasets, tmp_path, capsys):
+    path_run_input, path_output = write_run(write_datasets, tmp_path, "run")
+    path_metrics = os.path.join(path_output, path_save_metrics)
+
+    def run_main(*options):
+        if os.path.isfile(path_metrics):
+            os.utime(path_metrics, (1000, 1000))
+        capsys.readouterr()
+        main(["-i", path_run_input, "-o", path_output, *options])
+        return "up to date" in capsys.readouterr().out
+
+    assert not run_main()
+    expected = read_outputs(path_output)
+    # the outputs are only touched (newer than the inputs for make)
+    assert run_main()
+    assert os.path.getmtime(path_metrics) > 1000
+    assert read_outputs(path_output)[0] == expected[0]
+    assert not run_main("--force")
+
+    # a changed run input, original or released dataset or a missing
+    # output invalidates the outputs
+    with open(path_run_input) as f:
+        run_input = json.load(f)
+    run_input["privacy_parameters_disclosure_risk"]["num_samples_intruder"] = 60
+    with open(path_run_input, "w") as f:
+        json.dump(run_input, f)
+    assert not run_main()
+    assert run_main()
+    make_dataset(300, 0).to_csv(os.path.join(path_output, "synthetic_data_4.csv"), index=False)
+    assert not run_main()
+    make_dataset(200, 0).to_csv(str(tmp_path / "original.csv"), index=False)
+    assert not run_main()
+    os.remove(os.path.join(path_output, path_save_max_values))
+    assert not run_main()
+    assert run_main()
@@ -0,0 +1,340 @@
+"""
+Dashboard comparing the privacy and utility metrics of all the runs
+
+    python metrics/report/dashboard.py [-s synth-output] [--watch SECONDS]
+
+The metric outputs (see metric_files) of every run directory
+synth-output/<run>/ are read into an SQLite database (by default
+synth-output/metrics.sqlite) with the tables
+
+    runs(run, dataset, synth_method, signature)
+    parameters(run, name, value)  -- the run input, flattened
+    metrics(run, name, value)     -- e.g. "privacy/EMRi_norm"
+
+A run is only read again when one of its metric files has changed (see
+run_signature), so updating the database as new runs finish only reads
+the new outputs. The dashboard (dashboard.html with a utility/privacy
+plot and a table of the summary metrics of each run, and dashboard.json
+with all the metrics, both with the parameters that differ between the
+runs) is then built from the database, by default in
+synth-output/dashboard/.
+"""
+
+import argparse
+import json
+import numbers
+import os
+import sqlite3
+import sys
+import time
+import numpy as np
+import pandas as pd
+from glob import glob
+from plotting_tools import plot_privacy_utility
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, "utility-metrics"))
+from correlations import correlation_summary
+
+# metric outputs read in each run directory and the prefix of their
+# metric names
+metric_files = {"privacy_disclosure_risk.json": "privacy",
+                "utility_overall_diff.json": "classifiers",
+                "utility_diff.json": "classifiers",
+                "utility_correlations.json": "correlations"}
+
+# metrics plotted against each other in the dashboard (the plot is
+# skipped if no run has both)
+utility_metric = "classifiers/overall/f1/weighted"
+privacy_metric = "privacy/EMRi_norm"
+
+# prefixes of the metrics shown in the table of the dashboard, the
+# per-classifier differences are only in dashboard.json
+summary_prefixes = ["privacy/", "classifiers/overall/", "correlations/"]
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    run TEXT PRIMARY KEY,
+    dataset TEXT,
+    synth_method TEXT,
+    signature TEXT
+);
+CREATE TABLE IF NOT EXISTS parameters (
+    run TEXT,
+    name TEXT,
+    value,
+    PRIMARY KEY (run, name)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run TEXT,
+    name TEXT,
+    value REAL,
+    PRIMARY KEY (run, name)
+);
+CREATE INDEX IF NOT EXISTS metrics_name ON metrics (name);
+"""
+
+
+def flatten(inp_dict, prefix=""):
+    """
+    Yields the (name, value) pairs of the leaves of a nested dictionary,
+    the name joining the keys with "/".
+    """
+    for key, value in inp_dict.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}/")
+        else:
+            yield f"{prefix}{key}", value
+
+
+def correlation_metrics(correlations):
+    """
+    Summary scores of utility_correlations.json (see
+    correlations.correlation_summary). With the "npz" output format,
+    the file already contains them.
+    """
+    if "matrices_file" in correlations:
+        return {name: scores for name, scores in correlations.items()
+                if name != "matrices_file"}
+    suffix_orig, suffix_rlsd = "_Original", "_Released"
+    names = [key[:-len(suffix_orig)] for key in correlations if key.endswith(suffix_orig)]
+    return correlation_summary({name: np.array(correlations[name + suffix_orig], dtype=float)
+                                for name in names},
+                               {name: np.array(correlations[name + suffix_rlsd], dtype=float)
+                                for name in names})
+
+
+def run_signature(path_run):
+    """
+    Signature (sizes and modification times) of the metric outputs of
+    a run directory, None if it has none (e.g. the synthesis has not
+    finished).
+    """
+    signature = []
+    for filename in sorted(metric_files):
+        path_file = os.path.join(path_run, filename)
+        if os.path.isfile(path_file):
+            stat = os.stat(path_file)
+            signature.append([filename, stat.st_size, stat.st_mtime_ns])
+    return json.dumps(signature) if signature else None
+
+
+def read_run(path_run):
+    """
+    Reads the run input and metric outputs of a run directory.
+
+    Returns
+    -------
+    parameters : dict
+        The run input (<run>.json, copied to the directory by the
+        synthesis), flattened (see flatten). Lists are stored as json.
+    metrics : dict
+        Names and values of the metrics.
+    """
+    run = os.path.basename(os.path.normpath(path_run))
+    parameters = {}
+    path_run_input = os.path.join(path_run, f"{run}.json")
+    if os.path.isfile(path_run_input):
+        with open(path_run_input) as f:
+            for name, value in flatten(json.load(f)):
+                parameters[name] = json.dumps(value) if isinstance(value, (list, dict)) else value
+
+    metrics = {}
+    for filename, prefix in metric_files.items():
+        path_file = os.path.join(path_run, filename)
+        if not os.path.isfile(path_file):
+            continue
+        with open(path_file) as f:
+            output = json.load(f)
+        if prefix == "correlations":
+            output = correlation_metrics(output)
+        for name, value in flatten(output, f"{prefix}/"):
+            if isinstance(value, numbers.Number) and not isinstance(value, bool):
+                metrics[name] = float(value)
+    return parameters, metrics
+
+
+def update_database(path_db, path_synth_output="synth-output"):
+    """
+    Reads the runs of path_synth_output whose metric outputs are new or
+    have changed into the database path_db (created if needed) and
+    removes the runs that no longer exist.
+
+    Returns
+    -------
+    num_changed : int
+        Number of runs read or removed.
+    """
+    con = sqlite3.connect(path_db)
+    num_changed = 0
+    try:
+        con.executescript(schema)
+        stored = dict(con.execute("SELECT run, signature FROM runs"))
+        found = set()
+        for path_run in sorted(glob(os.path.join(path_synth_output, "*", ""))):
+            run = os.path.basename(os.path.normpath(path_run))
+            signature = run_signature(path_run)
+            if signature is None:
+                continue
+            found.add(run)
+            if stored.get(run) == signature:
+                continue
+            try:
+                parameters, metrics = read_run(path_run)
+            except json.JSONDecodeError:
+                # e.g. an output being written, it is read at the next
+                # update since its signature is not stored
+                print(f"[ERROR] {run}: could not read its outputs, skipped")
+                continue
+            # one transaction per run, so that the database is never
+            # left with a partially read run
+            with con:
+                delete_run(con, run)
+                con.execute("INSERT INTO runs VALUES (?, ?, ?, ?)",
+                            (run, parameters.get("dataset"), parameters.get("synth-method"),
+                             signature))
+                con.executemany("INSERT INTO parameters VALUES (?, ?, ?)",
+                                [(run, name, value) for name, value in parameters.items()])
+                con.executemany("INSERT INTO metrics VALUES (?, ?, ?)",
+                                [(run, name, value) for name, value in metrics.items()])
+            num_changed += 1
+
+        for run in set(stored) - found:
+            with con:
+                delete_run(con, run)
+            num_changed += 1
+    finally:
+        con.close()
+    return num_changed
+
+
+def delete_run(con, run):
+    """Removes a run from the database"""
+    for table in ["runs", "parameters", "metrics"]:
+        con.execute(f"DELETE FROM {table} WHERE run = ?", (run,))
+
+
+def load_table(path_db, prefixes=None):
+    """
+    Returns a DataFrame with one row per run (indexed by the run name),
+    the dataset and synthesis method of each run, the parameters of the
+    run inputs whose values differ between runs (see
+    varying_parameters) and the metrics (only those whose name starts
+    with one of prefixes, if given).
+    """
+    con = sqlite3.connect(path_db)
+    try:
+        runs = pd.read_sql_query("SELECT run, dataset, synth_method FROM runs", con,
+                                 index_col="run")
+        parameters = pd.read_sql_query("SELECT run, name, value FROM parameters", con)
+        metrics = pd.read_sql_query("SELECT run, name, value FROM metrics", con)
+    finally:
+        con.close()
+    parameters = parameters.pivot(index="run", columns="name", values="value")
+    parameters = parameters.reindex(runs.index)
+    if prefixes is not None:
+        metrics = metrics[metrics["name"].str.startswith(tuple(prefixes))]
+    metrics = metrics.pivot(index="run", columns="name", values="value")
+    return runs.join(parameters[varying_parameters(parameters)]).join(metrics).sort_index()
+
+
+def varying_parameters(parameters):
+    """
+    Names of the columns of parameters (one row per run) whose values
+    differ between runs, a run without the parameter counting as a
+    different value. The dataset and synthesis method are left out, as
+    they have their own columns.
+    """
+    return [name for name in parameters.columns
+            if name not in ["dataset", "synth-method"] and
+            parameters[name].nunique(dropna=False) > 1]
+
+
+def parameter_columns(table):
+    """Columns of a table returned by load_table with the varying
+    parameters of the runs"""
+    metric_prefixes = tuple(f"{prefix}/" for prefix in metric_files.values())
+    return [col for col in table.columns
+            if col not in ["dataset", "synth_method"] and not col.startswith(metric_prefixes)]
+
+
+def write_dashboard(path_db, path_output):
+    """
+    Writes dashboard.html and dashboard.json (see the module docstring)
+    in path_output from the database path_db.
+    """
+    table = load_table(path_db)
+    if not os.path.isdir(path_output):
+        os.makedirs(path_output)
+    table.to_json(os.path.join(path_output, "dashboard.json"), orient="index", indent=1)
+
+    message = "<html><head><style>" \
+              "table { border-collapse: collapse; font-size: small; } " \
+              "td, th { padding: 2px 6px; border: 1px solid #ccc; }" \
+              "</style></head><body>"
+    message += f"<h1>QUiPP runs ({len(table)})</h1>"
+
+    parameters = parameter_columns(table)
+    if utility_metric in table and privacy_metric in table:
+        plotted = table.dropna(subset=[utility_metric, privacy_metric])
+        if len(plotted) > 0:
+            # each point is labelled with the varying parameters of its run
+            labels = [", ".join(f"{name.split('/')[-1]}={value}"
+                                for name, value in row.items() if not pd.isna(value))
+                      for _, row in plotted[parameters].iterrows()]
+            path2image = plot_privacy_utility(
+                1 - plotted[utility_metric], 1 - plotted[privacy_metric],
+                plotted["synth_method"].fillna("unknown"),
+                os.path.join(path_output, "figs", "privacy_utility.png"),
+                xlabel=f"Utility (1 - {utility_metric})",
+                ylabel=f"Privacy (1 - {privacy_metric})",
+                labels=labels if parameters else None)
+            message += f'<img src={path2image} alt="" width="600"><br />'
+
+    columns = ["dataset", "synth_method"] + parameters + \
+        [col for col in table.columns if col.startswith(tuple(summary_prefixes))]
+    message += "<h2>Summary metrics</h2>"
+    message += table[columns].rename_axis(None).to_html(float_format="{:.4g}".format, na_rep="")
+    message += "</body></html>"
+    with open(os.path.join(path_output, "dashboard.html"), "w") as f:
+        f.write(message)
+
+
+def handle_cmdline_args(argv=None):
+    """Return an object with the command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Build a dashboard comparing the metrics of all the runs")
+    parser.add_argument(
+        "-s", "--synth-output", dest="synth_output", default="synth-output",
+        help="Directory containing the run directories (default: synth-output)")
+    parser.add_argument(
+        "--db", dest="db", default=None,
+        help="Path of the database (default: <synth-output>/metrics.sqlite)")
+    parser.add_argument(
+        "-o", dest="outdir", default=None,
+        help="Output directory of the dashboard (default: <synth-output>/dashboard)")
+    parser.add_argument(
+        "--watch", dest="watch", type=float, default=None,
+        help="Keep updating the dashboard, checking for new outputs every WATCH seconds")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = handle_cmdline_args(argv)
+    path_db = args.db or os.path.join(args.synth_output, "metrics.sqlite")
+    path_output = args.outdir or os.path.join(args.synth_output, "dashboard")
+
+    first = True
+    while True:
+        num_changed = update_database(path_db, args.synth_output)
+        if num_changed > 0 or first:
+            write_dashboard(path_db, path_output)
+            print(f"[INFO] {num_changed} run(s) updated, dashboard written to "
+                  f"{os.path.join(path_output, 'dashboard.html')}")
+        first = False
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main()
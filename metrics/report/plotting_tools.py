@@ -1,13 +1,34 @@
+"""
+Plotting functions of the report (see report.py).
 
+The figures are explicit matplotlib Figure objects drawn on an Agg
+canvas, they do not use pyplot's global state (or need a display), so
+they are freed once saved and can be rendered in worker processes.
+"""
 
 import codecs
 import json
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import numpy as np
 import os
 import itertools
 
 
+def new_figure(figsize):
+    """Returns a Figure drawn by the Agg backend"""
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def save_figure(fig, save_path):
+    """Saves fig to save_path (creating its directory) and returns the
+    absolute path of the image"""
+    if not os.path.isdir(os.path.dirname(save_path)):
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    fig.savefig(save_path, format="PNG", bbox_inches="tight")
+    return os.path.abspath(save_path)
 
 
 def plot_confusion_matrix(cm,
@@ -27,13 +48,16 @@ def plot_confusion_matrix(cm,
     target_names: given classification classes such as [0, 1, 2]
                   the class names, for example: ['high', 'medium', 'low']
     title:        the text to display at the top of the matrix
-    cmap:         the gradient of the values displayed from matplotlib.pyplot.cm
-                  see http://matplotlib.org/examples/color/colormaps_reference.html
-                  plt.get_cmap('jet') or plt.cm.Blues
+    cmap:         the gradient of the values displayed, a matplotlib colormap
+                  or its name, see
+                  http://matplotlib.org/examples/color/colormaps_reference.html
+                  ('Blues' by default)
     normalize:    If False, plot the raw numbers
                   If True, plot the proportions
     save_dir      parent directory to save the images
 
+    Returns the absolute path of the saved image (see confusion_matrix_path).
+
     Usage
     -----
     plot_confusion_matrix(cm           = cm,                  # confusion matrix created by
@@ -53,18 +77,21 @@ def plot_confusion_matrix(cm,
     misclass = 1 - accuracy
 
     if cmap is None:
-        cmap = plt.get_cmap('Blues')
+        cmap = 'Blues'
 
-    plt.figure(figsize=(10, 10))
-    plt.imshow(cm, interpolation='nearest', cmap=cmap)
-    plt.title(title, size=24)
-    cbar = plt.colorbar(fraction=0.03)
+    fig = new_figure(figsize=(10, 10))
+    ax = fig.add_subplot()
+    image = ax.imshow(cm, interpolation='nearest', cmap=cmap)
+    ax.set_title(title, size=24)
+    cbar = fig.colorbar(image, ax=ax, fraction=0.03)
     cbar.ax.tick_params(labelsize=24)
 
     if target_names is not None:
         tick_marks = np.arange(len(target_names))
-        plt.xticks(tick_marks, target_names, size=20, rotation=90)
-        plt.yticks(tick_marks, target_names, size=20)
+        ax.set_xticks(tick_marks)
+        ax.set_xticklabels(target_names, size=20, rotation=90)
+        ax.set_yticks(tick_marks)
+        ax.set_yticklabels(target_names, size=20)
 
     if normalize:
         cm = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
@@ -73,30 +100,35 @@ def plot_confusion_matrix(cm,
     thresh = cm.max() / 1.5 if normalize else cm.max() / 2
     for i, j in itertools.product(range(cm.shape[0]), range(cm.shape[1])):
         if normalize:
-            plt.text(j, i, "{:0.4f}".format(cm[i, j]),
-                     horizontalalignment="center",
-                     fontsize=22,
-                     color="white" if cm[i, j] > thresh else "black")
+            ax.text(j, i, "{:0.4f}".format(cm[i, j]),
+                    horizontalalignment="center",
+                    fontsize=22,
+                    color="white" if cm[i, j] > thresh else "black")
         else:
-            plt.text(j, i, "{:,}".format(cm[i, j]),
-                     horizontalalignment="center",
-                     fontsize=22,
-                     color="white" if cm[i, j] > thresh else "black")
-
-    plt.ylabel('True label', size=28)
-    plt.xlabel('Predicted label\naccuracy={:0.4f}; misclass={:0.4f}'.format(accuracy, misclass), size=28)
-    plt.ylim(len(cm)-0.5, -0.5)
-    figpath = f"{prefix}_{title}_confusion_matrix.png"
-    save_path = os.path.join(save_dir, figpath)
-    if not os.path.isdir(save_dir):
-        os.makedirs(save_dir)
-    plt.savefig(save_path, format="PNG", bbox_inches = "tight")
-    return os.path.abspath(save_path)
+            ax.text(j, i, "{:,}".format(cm[i, j]),
+                    horizontalalignment="center",
+                    fontsize=22,
+                    color="white" if cm[i, j] > thresh else "black")
 
+    ax.set_ylabel('True label', size=28)
+    ax.set_xlabel('Predicted label\naccuracy={:0.4f}; misclass={:0.4f}'.format(accuracy, misclass), size=28)
+    ax.set_ylim(len(cm)-0.5, -0.5)
+    return save_figure(fig, confusion_matrix_path(title, prefix, save_dir))
 
-def plot_util_confusion_matrix(confusion_dict_path, method_names=None, 
-                               prefix="", normalize=False, save_dir="."):
 
+def confusion_matrix_path(title, prefix="", save_dir="."):
+    """Absolute path of the image saved by plot_confusion_matrix"""
+    return os.path.abspath(os.path.join(save_dir, f"{prefix}_{title}_confusion_matrix.png"))
+
+
+def util_confusion_matrix_plots(confusion_dict_path, method_names=None,
+                                prefix="", normalize=False, save_dir="."):
+    """
+    Returns the keyword arguments of plot_confusion_matrix for each
+    confusion matrix in confusion_dict_path (the utility_confusion_*.json
+    files written by classifiers.py), so that they can be plotted later
+    or in other processes. Arguments as in plot_util_confusion_matrix.
+    """
     dict_r = codecs.open(confusion_dict_path, 'r', encoding='utf-8').read()
     confusion_dict = json.loads(dict_r)
 
@@ -104,7 +136,7 @@ def plot_util_confusion_matrix(confusion_dict_path, method_names=None,
         method_names = [method_names]
     if method_names == None:
         method_names = list(confusion_dict.keys())
-    plt_names = []
+    plots = []
     for method_name in method_names:
         if method_name not in confusion_dict:
             print(confusion_dict.keys())
@@ -113,12 +145,77 @@ def plot_util_confusion_matrix(confusion_dict_path, method_names=None,
         title = method_name
         cm = np.array(confusion_dict[method_name]["conf_matrix"])
         target_names = confusion_dict[method_name]["target_names"]
-        plt_name = plot_confusion_matrix(cm, 
-                                         target_names=target_names, 
-                                         normalize=normalize, 
-                                         title=title, 
-                                         prefix=prefix, 
-                                         save_dir=save_dir
-                                         )
-        plt_names.append(plt_name)
-    return plt_names
\ No newline at end of file
+        plots.append({"cm": cm,
+                      "target_names": target_names,
+                      "normalize": normalize,
+                      "title": title,
+                      "prefix": prefix,
+                      "save_dir": save_dir})
+    return plots
+
+
+def plot_util_confusion_matrix(confusion_dict_path, method_names=None,
+                               prefix="", normalize=False, save_dir="."):
+    """Plots the confusion matrices of method_names (by default all the
+    methods) in confusion_dict_path and returns the paths of the images"""
+    return [plot_confusion_matrix(**kwargs)
+            for kwargs in util_confusion_matrix_plots(confusion_dict_path, method_names,
+                                                      prefix, normalize, save_dir)]
+
+
+def plot_overall_diff(metric_name, metric_value, save_path):
+    """Bar plot of the overall differences (in %) of the classifier
+    metrics, returns the absolute path of the image"""
+    fig = new_figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    ax.bar(metric_name, metric_value, color='k')
+    ax.set_ylabel("Difference (%)", size=18)
+    ax.set_title("Overall difference", size=24)
+    ax.tick_params(axis="x", labelsize=18, labelrotation=90)
+    ax.tick_params(axis="y", labelsize=18)
+    ax.grid()
+    return save_figure(fig, save_path)
+
+
+def plot_method_diffs(method_names, prec_values, recall_values, f1_values, save_path):
+    """Differences (in %) of the weighted precision, recall and F1
+    score of each classifier, returns the absolute path of the image"""
+    fig = new_figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    ax.plot(prec_values, c="b", lw=3, marker="o", label="Precision (weighted)")
+    ax.plot(recall_values, c="r", lw=3, marker="o", label="Recall (weighted)")
+    ax.plot(f1_values, c="k", lw=3, marker="o", label="F1 (weighted)")
+    ax.set_ylabel("Difference (%)", size=32)
+    ax.set_xticks(range(len(method_names)))
+    ax.set_xticklabels(method_names, size=24, rotation=90)
+    ax.tick_params(axis="y", labelsize=24)
+    ax.legend(fontsize=24, bbox_to_anchor=(1.04, 1))
+    ax.grid()
+    return save_figure(fig, save_path)
+
+
+def plot_privacy_utility(utility_values, privacy_values, groups, save_path,
+                         xlabel="Utility", ylabel="Privacy", labels=None):
+    """Scatter plot of a utility score against a privacy score, one
+    colour per group (e.g. synthesis method) and each point annotated
+    with its label (if labels are given), returns the absolute path of
+    the image"""
+    fig = new_figure(figsize=(8, 8))
+    ax = fig.add_subplot()
+    utility_values = np.asarray(utility_values, dtype=float)
+    privacy_values = np.asarray(privacy_values, dtype=float)
+    groups = np.asarray(groups, dtype=str)
+    for group in sorted(set(groups)):
+        in_group = groups == group
+        ax.scatter(utility_values[in_group], privacy_values[in_group], s=70, label=group)
+    if labels is not None:
+        for utility_value, privacy_value, label in zip(utility_values, privacy_values, labels):
+            ax.annotate(label, (utility_value, privacy_value), xytext=(5, 5),
+                        textcoords="offset points", fontsize=10)
+    ax.set_title("Utility/Privacy", size=24)
+    ax.set_xlabel(xlabel, size=18)
+    ax.set_ylabel(ylabel, size=18)
+    ax.tick_params(labelsize=14)
+    ax.grid(linestyle="--", linewidth=0.5)
+    ax.legend(fontsize=14)
+    return save_figure(fig, save_path)
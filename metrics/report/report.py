@@ -1,18 +1,36 @@
 """
 Code to generate an HTML report from the classifiers' outputs
+
+This is a separate stage, run after classifiers.py, e.g. for all the
+directories in synth-output/ that contain classifier outputs:
+
+    python metrics/report/report.py -j 4
+
+or for some of them:
+
+    python metrics/report/report.py -j 4 synth-output/example ...
+
+The figures of all the reports are rendered together on a pool of
+worker processes (see plotting_tools for the plotting functions).
 """
 
 
+import argparse
 import json
 import os
 import sys
-import matplotlib.pyplot as plt
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from plotting_tools import plot_util_confusion_matrix
+from glob import glob
+import plotting_tools
+from plotting_tools import util_confusion_matrix_plots, confusion_matrix_path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, "utilities"))
+from utils import print_metric
 
-sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, "utility-metrics"))
-from classifiers import print_metric
+# output of classifiers.py used to find the directories to report on
+classifiers_output = "utility_overall_diff.json"
 
 
 # a list of items included in the report
@@ -71,8 +89,21 @@ def print_header():
     return myheader
 
 
-def report(path2synth_output):
-    """Generates the report"""
+def prepare_report(path2synth_output):
+    """
+    Builds the report of one synth-output directory without plotting
+    its figures.
+
+    Returns
+    -------
+    filename : string
+        Path of the report (report.html in a new time-stamped directory).
+    message : string
+        The html of the report.
+    figures : list
+        The figures of the report as (name of a plotting_tools
+        function, keyword arguments) tuples, see render_figures.
+    """
 
     # create time stamp
     curr_time = datetime.now()
@@ -96,16 +127,16 @@ def report(path2synth_output):
     if not os.path.isdir(par_dir):
         os.makedirs(par_dir)
     
-    # crete html file
+    # html file
     filename = os.path.join(par_dir, "report.html")
-    f = open(filename, 'w')
+    figures = []
     
     message = print_header()
     message += "<h1>Report" + "(" + curr_time_str_print + ")" + "</h1>"
     
     # --- plot overall differences
-    fio = open(os.path.join(path2synth_output, "utility_overall_diff.json")).read()
-    dict_read = json.loads(fio)
+    with open(os.path.join(path2synth_output, "utility_overall_diff.json")) as fio:
+        dict_read = json.load(fio)
     dict_read = dict_read["overall"]
     message += "<h2>Overall difference</h2><p>"
 
@@ -117,24 +148,15 @@ def report(path2synth_output):
             metric_name.append(f"{k_metric}_{k_value}")
             metric_value.append(v_value*100)
     path2image = os.path.abspath(os.path.join(par_dir, "figs", "overall_diffs.png"))
-    
-    if not os.path.isdir(os.path.dirname(path2image)):
-        os.makedirs(os.path.dirname(path2image))
-    
-    plt.figure(figsize=(10, 5))
-    plt.bar(metric_name, metric_value, color='k')
-    plt.ylabel("Difference (%)", size=18)
-    plt.title("Overall difference", size=24)
-    plt.xticks(size=18, rotation=90)
-    plt.yticks(size=18)
-    plt.grid()
-    plt.savefig(path2image, bbox_inches="tight")
+    figures.append(("plot_overall_diff", {"metric_name": metric_name,
+                                          "metric_value": metric_value,
+                                          "save_path": path2image}))
     message += f'<img src={path2image} alt="" width="800" align="middle"><br />' 
     message += "<hr>"
     
     # --- plot differences in each method
-    fio = open(os.path.join(path2synth_output, "utility_diff.json")).read()
-    dict_read = json.loads(fio)
+    with open(os.path.join(path2synth_output, "utility_diff.json")) as fio:
+        dict_read = json.load(fio)
     message += "<h2>Differences in each method</h2><p>"
 
     # convert the nested dictionary to a pandas dataframe
@@ -156,22 +178,12 @@ def report(path2synth_output):
         recall_values.append(df_rd.loc[one_method, "recall"]["weighted"]*100.)
         f1_values.append(df_rd.loc[one_method, "f1"]["weighted"]*100.)
     
-    plt.figure(figsize=(10, 5))
-    plt.plot(prec_values, c="b", lw=3, marker="o", label="Precision (weighted)")
-    plt.plot(recall_values, c="r", lw=3, marker="o", label="Recall (weighted)")
-    plt.plot(f1_values, c="k", lw=3, marker="o", label="F1 (weighted)")
-    plt.ylabel("Difference (%)", size=32)
-    
     path2image = os.path.abspath(os.path.join(par_dir, "figs", "diffs.png"))
-    
-    if not os.path.isdir(os.path.dirname(path2image)):
-        os.makedirs(os.path.dirname(path2image))
-    
-    plt.xticks(range(len(list_uniq_methods)), list_uniq_methods, size=24, rotation=90)
-    plt.yticks(size=24)
-    plt.legend(fontsize=24, bbox_to_anchor=(1.04,1))
-    plt.grid()
-    plt.savefig(path2image, bbox_inches="tight")
+    figures.append(("plot_method_diffs", {"method_names": list_uniq_methods,
+                                          "prec_values": prec_values,
+                                          "recall_values": recall_values,
+                                          "f1_values": f1_values,
+                                          "save_path": path2image}))
     message += f'<img src={path2image} alt="" width="1000" align="middle"><br />' 
     message += "<hr>"
     
@@ -189,28 +201,103 @@ def report(path2synth_output):
             on_right_window = True
     
         if one_item["action"] == "printMetric":
-            fio = open(os.path.join(path2synth_output, one_item["filename"])).read()
-            dict_read = json.loads(fio)
+            with open(os.path.join(path2synth_output, one_item["filename"])) as fio:
+                dict_read = json.load(fio)
             msg = print_metric(dict_read, title=one_item["title2print"], verbose=False)
             message += msg
     
         if one_item["action"] == "plot_confusion":
-            plt_names = plot_util_confusion_matrix(os.path.join(path2synth_output, one_item["filename"]),
-                                                   method_names=None, prefix=one_item["prefix"],
-                                                   save_dir=os.path.join(par_dir, "figs")
-                                                   )
-            for plt_name in plt_names:
+            plots = util_confusion_matrix_plots(os.path.join(path2synth_output, one_item["filename"]),
+                                                method_names=None, prefix=one_item["prefix"],
+                                                save_dir=os.path.join(par_dir, "figs")
+                                                )
+            for kwargs in plots:
+                figures.append(("plot_confusion_matrix", kwargs))
+                plt_name = confusion_matrix_path(kwargs["title"], kwargs["prefix"],
+                                                 kwargs["save_dir"])
                 message += "<hr>"
                 message += f'<img src={plt_name} alt="" width="500"><br />' 
     
     message += "</body></html>"
-    f.write(message)
-    f.close()
+    return filename, message, figures
+
+
+def render_figure(func_name, kwargs):
+    """Plots one figure returned by prepare_report"""
+    return getattr(plotting_tools, func_name)(**kwargs)
+
+
+def render_figures(figures, jobs=1):
+    """Plots the figures returned by prepare_report, on a pool of jobs
+    worker processes if jobs > 1"""
+    if jobs > 1 and len(figures) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(render_figure, *zip(*figures)))
+    return [render_figure(func_name, kwargs) for func_name, kwargs in figures]
+
+
+def batch_report(list_paths_synth_output, jobs=1):
+    """
+    Generates the reports of several synth-output directories, their
+    figures being rendered together (see render_figures).
+
+    Returns
+    -------
+    list_filenames : list
+        The paths of the reports.
+    """
+    reports = [prepare_report(path2synth_output)
+               for path2synth_output in list_paths_synth_output]
+    render_figures([figure for _, _, figures in reports for figure in figures], jobs=jobs)
+    for filename, message, _ in reports:
+        with open(filename, "w") as f:
+            f.write(message)
+    return [filename for filename, _, _ in reports]
+
+
+def report(path2synth_output, jobs=1):
+    """Generates the report of one synth-output directory"""
+    return batch_report([path2synth_output], jobs=jobs)[0]
+
+
+def handle_cmdline_args(argv=None):
+    """Return an object with the command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Generate the html reports of the classifier utility metrics")
+    parser.add_argument(
+        "paths_synth_output", nargs="*",
+        help="synth-output directories to report on (default: all the "
+             f"directories in synth-output/ containing {classifiers_output})")
+    parser.add_argument(
+        "-j", "--jobs", dest="jobs", type=int, default=1,
+        help="Number of worker processes used to render the figures (default: 1)")
+    return parser.parse_args(argv)
+
+
+def report_paths(paths_synth_output=None):
+    """
+    The directories of paths_synth_output (by default all the
+    directories in synth-output/) that contain the outputs of
+    classifiers.py, the others are reported and skipped.
+    """
+    if not paths_synth_output:
+        return sorted(os.path.dirname(one_path) for one_path in
+                      glob(os.path.join("synth-output", "*", classifiers_output)))
+    list_paths = []
+    for one_path in paths_synth_output:
+        if os.path.isfile(os.path.join(one_path, classifiers_output)):
+            list_paths.append(one_path)
+        else:
+            print(f"[ERROR] {one_path}: no {classifiers_output}, skipped")
+    return list_paths
+
+
+def main(argv=None):
+    args = handle_cmdline_args(argv)
+    list_paths = report_paths(args.paths_synth_output)
+    for filename in batch_report(list_paths, jobs=args.jobs):
+        print(f"[INFO] Report written to {filename}")
 
 
-"""
 if __name__ == "__main__":
-    # XXX move this to the input file
-    path2synth_output = "../synth-output/polish-synthpop-dr-4"
-    report(path2synth_output)
-"""
+    main()
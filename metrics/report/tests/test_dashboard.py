@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import sys
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+from dashboard import update_database, load_table, write_dashboard
+
+
+def write_run(path_synth_output, run, emri_norm, correlations_released, random_state=1):
+    """Run directory with a run input and some of the metric outputs"""
+    path_run = os.path.join(path_synth_output, run)
+    os.makedirs(path_run)
+    outputs = {f"{run}.json": {"dataset": "datasets/example", "synth-method": "synthpop",
+                               "parameters": {"random_state": random_state,
+                                              "vars_sequence": [1, 2]}},
+               "privacy_disclosure_risk.json": {"EMRi_norm": emri_norm, "TMRi": 0.0},
+               "utility_overall_diff.json": {"overall": {"f1": {"weighted": 0.1}}},
+               "utility_correlations.json": {"Correlations_Original": [[1.0, 0.5], [0.5, 1.0]],
+                                             "Correlations_Released": correlations_released}}
+    for filename, output in outputs.items():
+        with open(os.path.join(path_run, filename), "w") as f:
+            json.dump(output, f)
+    return path_run
+
+
+def test_update_database(tmp_path):
+    path_synth_output = str(tmp_path / "synth-output")
+    path_db = str(tmp_path / "metrics.sqlite")
+    write_run(path_synth_output, "run1", 0.2, [[1.0, 0.5], [0.5, 1.0]])
+    path_run2 = write_run(path_synth_output, "run2", 0.4, [[1.0, 0.2], [0.2, 1.0]])
+    # runs without metric outputs are ignored
+    os.makedirs(os.path.join(path_synth_output, "run3"))
+
+    assert update_database(path_db, path_synth_output) == 2
+    assert update_database(path_db, path_synth_output) == 0
+    table = load_table(path_db)
+    assert list(table.index) == ["run1", "run2"]
+    assert list(table["synth_method"]) == ["synthpop", "synthpop"]
+    assert list(table["privacy/EMRi_norm"]) == [0.2, 0.4]
+    assert list(table["correlations/Correlations/max_abs_difference"]) == \
+        [0.0, pytest.approx(0.3)]
+
+    # changed and removed runs
+    with open(os.path.join(path_run2, "privacy_disclosure_risk.json"), "w") as f:
+        json.dump({"EMRi_norm": 0.5}, f)
+    os.utime(os.path.join(path_run2, "privacy_disclosure_risk.json"), ns=(0, 0))
+    shutil.rmtree(os.path.join(path_synth_output, "run1"))
+    assert update_database(path_db, path_synth_output) == 2
+    table = load_table(path_db, prefixes=["privacy/"])
+    assert list(table.index) == ["run2"]
+    assert list(table.columns) == ["dataset", "synth_method", "privacy/EMRi_norm"]
+    assert table.loc["run2", "privacy/EMRi_norm"] == 0.5
+
+    write_dashboard(path_db, str(tmp_path / "dashboard"))
+    for filename in ["dashboard.html", "dashboard.json", os.path.join("figs", "privacy_utility.png")]:
+        assert os.path.isfile(tmp_path / "dashboard" / filename)
+
+
+def test_varying_parameters(tmp_path):
+    path_synth_output = str(tmp_path / "synth-output")
+    path_db = str(tmp_path / "metrics.sqlite")
+    for i, random_state in enumerate([1, 2, 1]):
+        write_run(path_synth_output, f"run{i}", 0.2 * i, [[1.0, 0.5], [0.5, 1.0]],
+                  random_state=random_state)
+    update_database(path_db, path_synth_output)
+
+    # only the parameter that differs between the runs is joined
+    table = load_table(path_db, prefixes=["privacy/EMRi_norm"])
+    assert list(table.columns) == ["dataset", "synth_method", "parameters/random_state",
+                                   "privacy/EMRi_norm"]
+    assert list(table["parameters/random_state"]) == [1, 2, 1]
+
+    write_dashboard(path_db, str(tmp_path / "dashboard"))
+    with open(tmp_path / "dashboard" / "dashboard.json") as f:
+        dashboard = json.load(f)
+    assert dashboard["run1"]["parameters/random_state"] == 2
+    with open(tmp_path / "dashboard" / "dashboard.html") as f:
+        assert "parameters/random_state" in f.read()
@@ -0,0 +1,44 @@
+import json
+import os
+import re
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+from report import batch_report, report_paths
+
+
+def write_classifier_outputs(path_output):
+    """Minimal outputs of classifiers.py with two methods"""
+    metrics = {"precision": {"macro": 0.5, "weighted": 0.6},
+               "recall": {"macro": 0.4, "weighted": 0.5},
+               "f1": {"macro": 0.45, "weighted": 0.55}}
+    methods = ["LogisticRegression", "SVC"]
+    confusion = {"conf_matrix": [[3, 1], [2, 4]], "target_names": ["a", "b"]}
+    outputs = {"utility_overall_diff.json": {"overall": metrics},
+               "utility_diff.json": {method: metrics for method in methods},
+               "utility_o_o.json": {method: metrics for method in methods},
+               "utility_r_o.json": {method: metrics for method in methods},
+               "utility_confusion_o_o.json": {method: confusion for method in methods},
+               "utility_confusion_r_o.json": {method: confusion for method in methods}}
+    os.makedirs(path_output)
+    for filename, output in outputs.items():
+        with open(os.path.join(path_output, filename), "w") as f:
+            json.dump(output, f)
+
+
+def test_batch_report(tmp_path):
+    list_paths = [str(tmp_path / "run1"), str(tmp_path / "run2")]
+    for one_path in list_paths:
+        write_classifier_outputs(one_path)
+    os.makedirs(tmp_path / "no-classifiers")
+
+    paths_report = report_paths(list_paths + [str(tmp_path / "no-classifiers")])
+    assert paths_report == list_paths
+    list_filenames = batch_report(paths_report)
+    assert len(list_filenames) == 2
+    for filename in list_filenames:
+        with open(filename) as f:
+            images = re.findall(r"<img src=(\S+)", f.read())
+        # overall and per method differences, 2 x 2 confusion matrices
+        assert len(images) == 6
+        assert all(os.path.isfile(image) for image in images)
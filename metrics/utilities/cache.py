@@ -0,0 +1,110 @@
+"""
+Helpers for the content-addressed caches used by the metric scripts.
+Cached items are stored as files named after a hash of everything
+that determines their content.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+
+def file_hash(path, block_size=2**20):
+    """Returns the sha256 hex digest of the contents of a file."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def hash_key(*parts):
+    """
+    Returns a sha256 hex digest identifying parts, which can be any
+    json serializable objects (e.g. file hashes, lists of column names
+    and parameters).
+    """
+    serialized = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def cache_path(cache_dir, key, extension):
+    """Path of the cache entry with the given key, creating
+    cache_dir if it does not exist already."""
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    return os.path.join(cache_dir, key + extension)
+
+
+def touch(path):
+    """Marks a cache entry as recently used."""
+    os.utime(path, None)
+
+
+def temporary_path(path):
+    """Path to write a cache entry to before moving it to path with
+    os.replace, so that readers never see partially written entries."""
+    return f"{path}.{os.getpid()}.tmp"
+
+
+def evict(cache_dir, max_size=None, max_age=None, verbose=False):
+    """
+    Removes cache entries from cache_dir.
+
+    Parameters
+    ----------
+    cache_dir : string
+        The cache directory.
+    max_size : integer
+        If given, the least recently used entries are removed until the
+        total size of the cache is at most max_size bytes.
+    max_age : float
+        If given, entries that have not been used for more than max_age
+        seconds are removed.
+    verbose : bool
+        If True, print the removed entries.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    # least recently used first
+    entries.sort()
+
+    now = time.time()
+    total_size = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        too_old = (max_age is not None) and (now - mtime > max_age)
+        too_big = (max_size is not None) and (total_size > max_size)
+        if not (too_old or too_big):
+            continue
+        if verbose:
+            print(f"[INFO] Removing cache entry {path}")
+        os.remove(path)
+        total_size -= size
+
+
+def is_up_to_date(path_manifest, manifest, paths_outputs):
+    """
+    Returns True if the manifest (a dictionary describing the inputs of
+    a pipeline stage, e.g. their hashes) is the same as the one stored in
+    path_manifest by a previous run and all its outputs exist.
+    """
+    if not all(os.path.isfile(one_path) for one_path in paths_outputs):
+        return False
+    if not os.path.isfile(path_manifest):
+        return False
+    with open(path_manifest) as f:
+        return json.load(f) == manifest
+
+
+def write_manifest(path_manifest, manifest):
+    """Stores the manifest of a pipeline stage, see is_up_to_date."""
+    with open(path_manifest, "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
@@ -0,0 +1,301 @@
+"""
+Loading of the original datasets and their metadata, shared by the
+metric scripts and the synthesis methods.
+
+A <dataset>.csv file is parsed once into a typed DataFrame (columns of
+type Categorical/Ordinal in <dataset>.json are stored as pandas
+categoricals, see metadata_dtypes for the other types) and written to
+a Feather file in the cache directory, keyed by the hash of the .csv
+file and the column types. Later reads, by any stage, memory-map the
+Feather file instead of parsing the .csv again. The cache directory is
+$QUIPP_CACHE_DIR, or ~/.cache/quipp by default. The least recently
+used Feather files are removed when the cache exceeds
+$QUIPP_DATASETS_CACHE_MAX_SIZE MB (10240 by default). If pyarrow is
+not installed, or cannot store the dataset (e.g. an object column with
+mixed types), the .csv file is parsed every time.
+
+Within a process (see quipp.py), datasets are also kept in memory once
+loaded, so a process running several stages reads each of them once.
+These DataFrames are shared and must not be modified, see read_original.
+"""
+
+import copy
+import functools
+import json
+import os
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.feather as feather
+except ImportError:
+    pyarrow = None
+    feather = None
+
+import cache
+
+# column types (in the metadata) stored as pandas categoricals
+categorical_types = ['Categorical', 'Ordinal']
+
+# dtype of the DiscreteNumerical columns when integers=True in
+# metadata_dtypes, these are converted to the smallest integer type
+# that fits their values after parsing
+smallest_integer = 'smallest_integer'
+
+# directory of the typed dataset cache, see load_dataset
+cache_dir = os.environ.get("QUIPP_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "quipp"))
+datasets_cache_subdir = "datasets"
+# maximum size (in bytes) of the typed dataset cache
+datasets_cache_max_size = float(os.environ.get("QUIPP_DATASETS_CACHE_MAX_SIZE", 10240)) * 2**20
+
+
+@functools.lru_cache(maxsize=16)
+def _read_json_cached(path_json, mtime):
+    """Reads a .json file, cached on its path and modification time."""
+    with open(path_json) as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=64)
+def _file_hash_cached(path, mtime, size):
+    """Hash of a file, cached on its path, modification time and size."""
+    return cache.file_hash(path)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_dataset_cached(path_csv, mtime, path_meta, mtime_meta, use_cache, schema):
+    """load_dataset, cached on the paths, modification times and
+    schema (the keyword arguments of metadata_dtypes as a tuple)."""
+    return load_dataset(path_csv, path_meta, use_cache=use_cache, **dict(schema))
+
+
+def read_metadata(path_original_meta):
+    """
+    Returns the metadata (.json) of the original dataset as a dictionary.
+    The file is only parsed once per process, a copy of the stored
+    dictionary is returned so that callers can modify it.
+    """
+    path_original_meta = os.path.abspath(path_original_meta)
+    metadata = _read_json_cached(path_original_meta, os.path.getmtime(path_original_meta))
+    return copy.deepcopy(metadata)
+
+
+def metadata_dtypes(metadata, integers=False, dates=False, float32=False):
+    """
+    Returns the pandas dtypes of the columns, as given by their type in
+    the metadata (a dictionary with a 'columns' key). Only the columns
+    whose dtype is set are included, the others are left to pandas.
+
+    Parameters
+    ----------
+    metadata : dict
+        The metadata of the dataset.
+    integers : bool
+        If True, DiscreteNumerical columns are stored in the smallest
+        integer type that fits their values (columns with missing
+        values are left as floats).
+    dates : bool
+        If True, DateTime columns are parsed as datetime64.
+    float32 : bool
+        If True, ContinuousNumerical columns are parsed as float32. This
+        halves their memory but loses precision.
+
+    Returns
+    -------
+    dtypes : dict
+        Keys are column names and values are dtypes. Categorical and
+        Ordinal columns are always 'category'.
+    """
+    dtypes = {}
+    for col in metadata['columns']:
+        if col['type'] in categorical_types:
+            dtypes[col['name']] = 'category'
+        elif col['type'] == 'DiscreteNumerical' and integers:
+            dtypes[col['name']] = smallest_integer
+        elif col['type'] == 'DateTime' and dates:
+            dtypes[col['name']] = 'datetime64[ns]'
+        elif col['type'] == 'ContinuousNumerical' and float32:
+            dtypes[col['name']] = 'float32'
+    return dtypes
+
+
+def apply_dtypes(data, dtypes):
+    """
+    Converts the columns of data to dtypes (see metadata_dtypes) after
+    parsing. Categoricals are created from the parsed columns so that
+    the categories keep the types inferred by pandas (e.g. integers stay
+    integers).
+    """
+    dtypes = {col: dtype for col, dtype in dtypes.items() if col in data.columns}
+    for col, dtype in dtypes.items():
+        if dtype == smallest_integer:
+            if not data[col].isna().any():
+                data[col] = pd.to_numeric(data[col], downcast='integer')
+        elif dtype.startswith('datetime64'):
+            # dates are converted by the parser (see read_csv_typed),
+            # columns it could not parse are left as they are
+            continue
+        elif data[col].dtype != dtype:
+            data[col] = data[col].astype(dtype)
+    return data
+
+
+def read_csv_typed(path_csv, dtypes=None, **kwargs):
+    """
+    Parses a .csv file with the columns converted to dtypes. Floats and
+    dates are converted by the parser, categoricals and integers after
+    parsing (see apply_dtypes).
+    """
+    dtypes = dtypes or {}
+    usecols = kwargs.get('usecols')
+    parse_dtypes = {col: dtype for col, dtype in dtypes.items()
+                    if dtype == 'float32' and (usecols is None or col in usecols)}
+    parse_dates = [col for col, dtype in dtypes.items()
+                   if dtype.startswith('datetime64') and (usecols is None or col in usecols)]
+    data = pd.read_csv(path_csv, dtype=parse_dtypes or None,
+                       parse_dates=parse_dates or None, **kwargs)
+    return apply_dtypes(data, dtypes)
+
+
+def default_memory_usage(data, dtypes):
+    """
+    Estimates the memory (in bytes) that data would use if it had been
+    parsed without dtypes, i.e. with the columns converted by dtypes
+    stored as 64-bit numbers or Python strings.
+    """
+    memory = data.memory_usage(deep=True, index=False)
+    for col in dtypes:
+        if col not in data.columns:
+            continue
+        if isinstance(data[col].dtype, pd.CategoricalDtype) and \
+                data[col].cat.categories.dtype == object:
+            memory[col] = data[col].astype(object).memory_usage(deep=True, index=False)
+        elif pd.api.types.is_datetime64_any_dtype(data[col]):
+            # the dates would have been parsed as strings
+            memory[col] = data[col].astype(str).astype(object).memory_usage(deep=True, index=False)
+        else:
+            memory[col] = 8 * len(data)
+    return int(memory.sum())
+
+
+def dataset_hash(path_csv):
+    """Hash of the contents of a dataset file, computed once per process."""
+    path_csv = os.path.abspath(path_csv)
+    stat = os.stat(path_csv)
+    return _file_hash_cached(path_csv, stat.st_mtime, stat.st_size)
+
+
+def dataset_cache_path(path_csv, dtypes):
+    """Path of the cached Feather file of path_csv read with dtypes."""
+    key = cache.hash_key(dataset_hash(path_csv), dtypes)
+    return cache.cache_path(os.path.join(cache_dir, datasets_cache_subdir),
+                            key, ".feather")
+
+
+def load_dataset(path_csv, path_meta=None, use_cache=True, **schema):
+    """
+    Reads a dataset, with the column dtypes given by its metadata.
+
+    Parameters
+    ----------
+    path_csv : string
+        Path to the dataset (.csv).
+    path_meta : string
+        Path to the metadata (.json) of the dataset. If None, the dtypes
+        are left to pandas.
+    use_cache : bool
+        If True (and pyarrow is installed), read the dataset from the
+        Feather cache, creating the cache entry if needed.
+    schema : dict
+        Keyword arguments of metadata_dtypes (integers, dates and
+        float32) selecting the dtypes of the non categorical columns.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        The dataset.
+    """
+    dtypes = metadata_dtypes(read_metadata(path_meta), **schema) if path_meta else {}
+    if not use_cache or feather is None:
+        return read_csv_typed(path_csv, dtypes)
+
+    path_feather = dataset_cache_path(path_csv, dtypes)
+    if os.path.isfile(path_feather):
+        cache.touch(path_feather)
+        # uncompressed Feather files are memory-mapped without copying,
+        # numerical columns are only copied when converted to pandas
+        table = feather.read_table(path_feather, memory_map=True)
+        return table.to_pandas(split_blocks=True)
+
+    data = read_csv_typed(path_csv, dtypes)
+    path_tmp = cache.temporary_path(path_feather)
+    try:
+        feather.write_feather(data, path_tmp, compression="uncompressed")
+    except pyarrow.ArrowException as err:
+        # the dataset is not cached, it is parsed again by the next reads
+        print(f"[INFO] Not caching {path_csv}: {err}")
+        if os.path.isfile(path_tmp):
+            os.remove(path_tmp)
+        return data
+    os.replace(path_tmp, path_feather)
+    cache.evict(os.path.dirname(path_feather), max_size=datasets_cache_max_size)
+    return data
+
+
+def read_original(path_original_ds, path_original_meta=None, use_cache=True, copy=False,
+                  **schema):
+    """
+    Returns the original dataset stored in path_original_ds as a pandas
+    DataFrame, with the dtypes given by the metadata in
+    path_original_meta and schema (see load_dataset).
+
+    By default, the dataset is only loaded the first time it is
+    requested by the current process and the stored DataFrame itself is
+    returned, without copying it. It is shared by all the callers and
+    must be treated as read-only (some of its columns can be read-only
+    memory maps of the Feather cache): callers derive new DataFrames
+    from it (e.g. df = df.fillna(...)) instead of modifying it in place.
+
+    With copy=True, a DataFrame that the caller can modify is returned.
+    It is not kept by the process, so this does not hold two copies of
+    the dataset in memory.
+    """
+    path_original_ds = os.path.abspath(path_original_ds)
+    if copy:
+        return load_dataset(path_original_ds, path_original_meta, use_cache=use_cache,
+                            **schema).copy()
+    mtime_meta = None
+    if path_original_meta is not None:
+        path_original_meta = os.path.abspath(path_original_meta)
+        mtime_meta = os.path.getmtime(path_original_meta)
+    data = _load_dataset_cached(path_original_ds, os.path.getmtime(path_original_ds),
+                                path_original_meta, mtime_meta, use_cache,
+                                tuple(sorted(schema.items())))
+    return data
+
+
+def read_released(path_released_ds, path_original_meta=None, schema=None, **kwargs):
+    """
+    Reads a released (synthetic) dataset with the same dtypes as the
+    original dataset (read with the same schema, see load_dataset).
+    Released datasets are read once, so they are not cached. kwargs are
+    passed to pandas.read_csv.
+    """
+    dtypes = metadata_dtypes(read_metadata(path_original_meta), **(schema or {})) \
+        if path_original_meta else {}
+    return read_csv_typed(path_released_ds, dtypes, **kwargs)
+
+
+def align_categories(df_a, df_b):
+    """
+    Gives the categorical columns shared by df_a and df_b (in place)
+    the union of their categories, so that rows can be copied from one
+    to the other.
+    """
+    for col in df_a.columns.intersection(df_b.columns):
+        if isinstance(df_a[col].dtype, pd.CategoricalDtype) and \
+                isinstance(df_b[col].dtype, pd.CategoricalDtype):
+            categories = df_a[col].cat.categories.union(df_b[col].cat.categories)
+            df_a[col] = df_a[col].cat.set_categories(categories)
+            df_b[col] = df_b[col].cat.set_categories(categories)
@@ -0,0 +1,72 @@
+"""
+Binary storage of the matrices computed by the metric scripts, as an
+alternative to nested lists in .json files.
+
+Matrices are stored uncompressed in a .npz file (one .npy member per
+matrix), so that load_matrices can memory-map each of them directly
+from the file instead of reading and parsing it.
+"""
+
+import zipfile
+import numpy as np
+
+# size of the fixed part of the local file header of a zip member, the
+# name and extra field lengths are the last two 2-byte fields
+_zip_local_header_size = 30
+
+
+def save_matrices(path, matrices):
+    """
+    Saves a dictionary of numpy arrays (e.g. matrices and the names of
+    their rows/columns) to an uncompressed .npz file. Keys can contain
+    "/" to group the matrices.
+    """
+    np.savez(path, **{name: np.asarray(array) for name, array in matrices.items()})
+
+
+def _member_offset(f, info):
+    """Offset of the data of the zip member described by info"""
+    f.seek(info.header_offset)
+    header = f.read(_zip_local_header_size)
+    name_length = int.from_bytes(header[26:28], "little")
+    extra_length = int.from_bytes(header[28:30], "little")
+    return info.header_offset + _zip_local_header_size + name_length + extra_length
+
+
+def load_matrices(path, mmap=True):
+    """
+    Loads the arrays saved by save_matrices.
+
+    Parameters
+    ----------
+    path : string
+        Path to the .npz file.
+    mmap : bool
+        If True (default), the arrays are read-only memory maps of the
+        file, only the pages that are used are read. Arrays of Python
+        objects and compressed members are read into memory.
+
+    Returns
+    -------
+    matrices : dict
+        The arrays, with the keys given to save_matrices.
+    """
+    matrices = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[:-len(".npy")]
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                f.seek(_member_offset(f, info))
+                version = np.lib.format.read_magic(f)
+                read_header = {(1, 0): np.lib.format.read_array_header_1_0,
+                               (2, 0): np.lib.format.read_array_header_2_0}.get(version)
+                if read_header is not None:
+                    shape, fortran_order, dtype = read_header(f)
+                    if not dtype.hasobject and np.prod(shape) > 0:
+                        matrices[name] = np.memmap(path, dtype=dtype, mode="r", shape=shape,
+                                                   order="F" if fortran_order else "C",
+                                                   offset=f.tell())
+                        continue
+            with archive.open(info) as member:
+                matrices[name] = np.lib.format.read_array(member, allow_pickle=False)
+    return matrices
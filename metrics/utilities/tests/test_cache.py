@@ -0,0 +1,82 @@
+import hashlib
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import cache
+
+
+def write_entry(path, size, mtime):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (mtime, mtime))
+
+
+def test_file_hash(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_bytes(b"a,b\n1,2\n" * 1000)
+    expected = hashlib.sha256(path.read_bytes()).hexdigest()
+    # the result does not depend on the size of the blocks read
+    assert cache.file_hash(str(path)) == expected
+    assert cache.file_hash(str(path), block_size=7) == expected
+    path.write_bytes(b"a,b\n1,3\n" * 1000)
+    assert cache.file_hash(str(path)) != expected
+
+
+def test_hash_key():
+    key = cache.hash_key("abc", ["sex", "age"], {"a": 1, "b": [1, 2]})
+    assert len(key) == 64
+    # stable across calls and dictionary orders
+    assert cache.hash_key("abc", ["sex", "age"], {"b": [1, 2], "a": 1}) == key
+    # but not across the order of the parts or lists, or their values
+    assert cache.hash_key(["sex", "age"], "abc", {"a": 1, "b": [1, 2]}) != key
+    assert cache.hash_key("abc", ["age", "sex"], {"a": 1, "b": [1, 2]}) != key
+    assert cache.hash_key("abc", ["sex", "age"], {"a": 2, "b": [1, 2]}) != key
+    # objects that are not json serializable are hashed through str
+    assert cache.hash_key(int) == cache.hash_key(str(int))
+
+
+def test_cache_path(tmp_path):
+    path_cache_dir = str(tmp_path / "cache" / "matches")
+    path = cache.cache_path(path_cache_dir, "0123", ".npz")
+    assert path == os.path.join(path_cache_dir, "0123.npz")
+    assert os.path.isdir(path_cache_dir)
+    assert cache.temporary_path(path).startswith(path)
+
+
+def test_evict(tmp_path):
+    for i, name in enumerate(["a", "b", "c", "d"]):
+        write_entry(str(tmp_path / name), 100, 1000 + i)
+    # "b" is used, it becomes the most recently used entry
+    cache.touch(str(tmp_path / "b"))
+
+    cache.evict(str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ["a", "b", "c", "d"]
+    # least recently used entries first
+    cache.evict(str(tmp_path), max_size=250)
+    assert sorted(os.listdir(tmp_path)) == ["b", "d"]
+    # only "b" was used in the last hour
+    cache.evict(str(tmp_path), max_age=3600)
+    assert os.listdir(tmp_path) == ["b"]
+    # a missing cache directory is not an error
+    cache.evict(str(tmp_path / "missing"), max_size=0)
+
+
+def test_is_up_to_date(tmp_path):
+    path_manifest = str(tmp_path / "manifest.json")
+    path_output = str(tmp_path / "output.json")
+    manifest = {"original": "0123", "released": {"synthetic_data_1.csv": "4567"}}
+    assert not cache.is_up_to_date(path_manifest, manifest, [path_output])
+
+    cache.write_manifest(path_manifest, manifest)
+    assert not cache.is_up_to_date(path_manifest, manifest, [path_output])
+    write_entry(path_output, 10, 1000)
+    assert cache.is_up_to_date(path_manifest, manifest, [path_output])
+
+    # any changed input invalidates the outputs
+    changed = {"original": "0123", "released": {"synthetic_data_1.csv": "89ab"}}
+    assert not cache.is_up_to_date(path_manifest, changed, [path_output])
+    added = {**manifest, "released": {**manifest["released"], "synthetic_data_2.csv": "4567"}}
+    assert not cache.is_up_to_date(path_manifest, added, [path_output])
+    os.remove(path_output)
+    assert not cache.is_up_to_date(path_manifest, manifest, [path_output])
@@ -0,0 +1,119 @@
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import data_loader
+from data_loader import load_dataset, read_original, read_released, align_categories, \
+    metadata_dtypes, default_memory_usage
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    """Small dataset with text and integer categorical columns,
+    written as a .csv/.json pair, and an empty cache directory"""
+    monkeypatch.setattr(data_loader, "cache_dir", str(tmp_path / "cache"))
+    rng = np.random.RandomState(1234)
+    df = pd.DataFrame({"sex": rng.choice(["MALE", "FEMALE"], 50),
+                       "region": rng.randint(1, 5, 50),
+                       "age": rng.randint(18, 80, 50),
+                       "edu": rng.choice(["PRIMARY", "SECONDARY", None], 50),
+                       "income": rng.rand(50)})
+    metadata = {"columns": [{"name": "sex", "type": "Categorical"},
+                            {"name": "region", "type": "Categorical"},
+                            {"name": "age", "type": "DiscreteNumerical"},
+                            {"name": "edu", "type": "Ordinal"},
+                            {"name": "income", "type": "ContinuousNumerical"}]}
+    path_csv = str(tmp_path / "dataset.csv")
+    path_meta = str(tmp_path / "dataset.json")
+    df.to_csv(path_csv, index=False)
+    with open(path_meta, "w") as f:
+        json.dump(metadata, f)
+    return path_csv, path_meta
+
+
+def test_load_dataset_types(dataset):
+    path_csv, path_meta = dataset
+    data = load_dataset(path_csv, path_meta, use_cache=False)
+    for col in ["sex", "region", "edu"]:
+        assert isinstance(data[col].dtype, pd.CategoricalDtype)
+    # categories keep the types inferred from the .csv file
+    assert pd.api.types.is_integer_dtype(data["region"].cat.categories)
+    assert pd.api.types.is_integer_dtype(data["age"])
+    pd.testing.assert_frame_equal(data.astype(object),
+                                  pd.read_csv(path_csv).astype(object))
+
+
+def test_load_dataset_cache(dataset):
+    pytest.importorskip("pyarrow")
+    path_csv, path_meta = dataset
+    data_csv = load_dataset(path_csv, path_meta, use_cache=False)
+    data_first = load_dataset(path_csv, path_meta)
+    assert len(os.listdir(os.path.join(data_loader.cache_dir,
+                                       data_loader.datasets_cache_subdir))) == 1
+    data_cached = load_dataset(path_csv, path_meta)
+    pd.testing.assert_frame_equal(data_first, data_csv)
+    pd.testing.assert_frame_equal(data_cached, data_csv)
+
+
+def test_load_dataset_cache_mixed_types(dataset, monkeypatch):
+    path_csv, path_meta = dataset
+    # e.g. an object column read with mixed types by pandas
+    data_mixed = load_dataset(path_csv, path_meta, use_cache=False)
+    data_mixed["mixed"] = pd.Series([1, "x"] * 25, dtype=object)
+    monkeypatch.setattr(data_loader, "read_csv_typed", lambda *args: data_mixed.copy())
+    path_cache_dir = os.path.join(data_loader.cache_dir, data_loader.datasets_cache_subdir)
+    # the dataset is returned, but not cached
+    pd.testing.assert_frame_equal(load_dataset(path_csv, path_meta), data_mixed)
+    assert os.listdir(path_cache_dir) == []
+
+
+def test_load_dataset_cache_max_size(dataset, monkeypatch):
+    path_csv, path_meta = dataset
+    path_cache_dir = os.path.join(data_loader.cache_dir, data_loader.datasets_cache_subdir)
+    load_dataset(path_csv, path_meta)
+    size = os.path.getsize(os.path.join(path_cache_dir, os.listdir(path_cache_dir)[0]))
+    # only the most recently written dataset fits in the cache
+    monkeypatch.setattr(data_loader, "datasets_cache_max_size", size)
+    load_dataset(path_csv, path_meta, integers=True)
+    assert os.listdir(path_cache_dir) == [os.path.basename(
+        data_loader.dataset_cache_path(path_csv, metadata_dtypes(
+            data_loader.read_metadata(path_meta), integers=True)))]
+
+
+def test_read_original_shared_or_copy(dataset):
+    path_csv, path_meta = dataset
+    data = read_original(path_csv, path_meta)
+    # the stored DataFrame is returned without copying it
+    assert read_original(path_csv, path_meta) is data
+    data_copy = read_original(path_csv, path_meta, copy=True)
+    pd.testing.assert_frame_equal(data_copy, data)
+    data_copy["income"] = 0.
+    data_copy.iloc[0, data_copy.columns.get_loc("age")] = 0
+    assert (read_original(path_csv, path_meta)["income"] != 0.).any()
+
+
+def test_align_categories(dataset):
+    path_csv, path_meta = dataset
+    df_orig = read_original(path_csv, path_meta, copy=True)
+    df_rlsd = read_released(path_csv, path_meta).iloc[:5].copy()
+    df_rlsd["region"] = df_rlsd["region"].cat.remove_unused_categories()
+    align_categories(df_orig, df_rlsd)
+    df_rlsd[:5] = df_orig[-5:].to_numpy()
+    assert list(df_rlsd["region"]) == list(df_orig["region"][-5:])
+
+
+def test_load_dataset_schema(dataset):
+    path_csv, path_meta = dataset
+    data = load_dataset(path_csv, path_meta, use_cache=False,
+                        integers=True, float32=True)
+    assert data["age"].dtype == np.int8
+    assert data["income"].dtype == np.float32
+    data_default = load_dataset(path_csv, path_meta, use_cache=False)
+    np.testing.assert_array_equal(data["age"], data_default["age"])
+    assert default_memory_usage(data, metadata_dtypes(json.load(open(path_meta)),
+                                                      integers=True, float32=True)) > \
+        data.memory_usage(deep=True, index=False).sum()
@@ -0,0 +1,23 @@
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+from matrix_store import save_matrices, load_matrices
+
+
+def test_save_load_matrices(tmp_path):
+    rng = np.random.RandomState(1234)
+    matrices = {"Cramers_V_Original": rng.rand(4, 4),
+                "Correlation_Ratio_Original": np.asfortranarray(rng.rand(4, 3)),
+                "release_1/Cramers_V_Released": rng.rand(4, 4),
+                "categorical_features": np.array(["sex", "edu", "region", "job"]),
+                "numeric_features": np.array([], dtype=str)}
+    path = str(tmp_path / "matrices.npz")
+    save_matrices(path, matrices)
+    for mmap in [True, False]:
+        loaded = load_matrices(path, mmap=mmap)
+        assert sorted(loaded) == sorted(matrices)
+        for name in matrices:
+            np.testing.assert_array_equal(loaded[name], matrices[name])
+    assert isinstance(load_matrices(path)["Cramers_V_Original"], np.memmap)
@@ -0,0 +1,24 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+from utils import released_paths
+
+
+def test_released_paths_numeric_order(tmp_path):
+    for i in [1, 2, 10, 3]:
+        (tmp_path / f"synthetic_data_{i}.csv").write_text("a\n1\n")
+    (tmp_path / "intruder_data.csv").write_text("a\n1\n")
+    # not released datasets
+    for name in ["synthetic_data_backup.csv", "synthetic_data_1_numcat.csv"]:
+        (tmp_path / name).write_text("a\n1\n")
+    assert [os.path.basename(one_path) for one_path in released_paths(str(tmp_path))] == \
+        ["synthetic_data_1.csv", "synthetic_data_2.csv",
+         "synthetic_data_3.csv", "synthetic_data_10.csv"]
+
+
+def test_released_paths_none(tmp_path):
+    (tmp_path / "synthetic_data_old.csv").write_text("a\n1\n")
+    with pytest.raises(FileNotFoundError, match="synthetic_data"):
+        released_paths(str(tmp_path))
@@ -5,12 +5,26 @@ Utility methods used in other parts of the code.
 import argparse
 import json
 import os
+import re
+from glob import glob
 
 
-def handle_cmdline_args():
+def handle_cmdline_args(argv=None):
     """
     Return an object with attributes 'infile' and
     'outfile', after handling the command line arguments
+    (or the list of arguments argv, if given)
+    """
+
+    parser = create_cmdline_parser()
+    args = parser.parse_args(argv)
+    return args
+
+
+def create_cmdline_parser():
+    """
+    Return the command line parser shared by all metric scripts,
+    scripts that need extra options can add them to it.
     """
 
     parser = argparse.ArgumentParser(
@@ -26,8 +40,11 @@ def handle_cmdline_args():
         help='The prefix of the output paths (data json and csv), '
              'relative to the QUIPP-pipeline root directory')
 
-    args = parser.parse_args()
-    return args
+    parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=1,
+        help='Number of worker processes to use (default: 1)')
+
+    return parser
 
 
 def extract_parameters(args, synth_params):
@@ -74,3 +91,44 @@ def find_column_types(orig_metadata, synth_method, categorical_types):
             numeric_features.append(col["name"])
 
     return categorical_features, numeric_features
+
+
+def released_paths(path_released_ds):
+    """
+    Returns the paths of all the released datasets
+    (synthetic_data_<number>.csv) in path_released_ds, ordered by their
+    number. Other files matching synthetic_data_*.csv (e.g.
+    synthetic_data_1_numcat.csv) are not released datasets and are
+    skipped. Raises FileNotFoundError if there are none.
+    """
+    dict_paths = {}
+    for one_path in glob(os.path.join(path_released_ds, "synthetic_data_*.csv")):
+        match = re.fullmatch(r"synthetic_data_(\d+)\.csv", os.path.basename(one_path))
+        if match:
+            dict_paths[one_path] = int(match.group(1))
+    if not dict_paths:
+        raise FileNotFoundError(f"No released datasets (synthetic_data_<number>.csv) "
+                                f"found in {path_released_ds}")
+    return sorted(dict_paths, key=dict_paths.get)
+
+
+def print_metric(inp_dict, title=" ", verbose=True):
+    """Prints metrics from dictionary"""
+    msg = ""
+    msg += f"\n\n{title}" + "<br />"
+    if verbose:
+        print(f"\n\n{title}")
+    for k_method, v_method in inp_dict.items():
+        msg += "<br />"
+        msg += f"{k_method}" + "<br />"
+        msg += "-"*len(k_method) + "<br />"
+        if verbose:
+            print("")
+            print(f"{k_method}")
+            print("-"*len(k_method))
+        for k_metric, v_metric in v_method.items():
+            for k_value, v_value in v_metric.items():
+                msg += f"{k_metric} ({k_value}): {v_value:.2f}" + "<br />"
+                if verbose:
+                    print(f"{k_metric} ({k_value}): {v_value}")
+    return msg
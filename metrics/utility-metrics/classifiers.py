@@ -7,21 +7,29 @@ import codecs
 import importlib
 import json
 import os
+import pickle
 import random
 import sys
+import tempfile
 import warnings
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
 import pandas as pd
+import sklearn
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
+from sklearn.base import clone
+from joblib import Memory
+from scipy import sparse
 
 sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, "utilities"))
-sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, "report"))
-from utils import handle_cmdline_args, extract_parameters, find_column_types
-import report
+from utils import create_cmdline_parser, extract_parameters, find_column_types, \
+    released_paths, print_metric
+from data_loader import read_original, read_released, read_metadata, align_categories, \
+    dataset_hash, cache_dir
+import cache
 
 
 # classifiers
@@ -35,8 +43,36 @@ from sklearn.tree import DecisionTreeClassifier
 from sklearn.ensemble import RandomForestClassifier, AdaBoostClassifier
 from sklearn.naive_bayes import GaussianNB
 from sklearn.discriminant_analysis import QuadraticDiscriminantAnalysis
-from sklearn.model_selection import GridSearchCV
-from sklearn.metrics import confusion_matrix
+from sklearn.model_selection import GridSearchCV, RandomizedSearchCV
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingGridSearchCV
+from sklearn.utils import resample
+
+# classifiers that do not accept sparse input, the encoded
+# data is converted to dense arrays for them
+dense_only_classifiers = (GaussianNB, QuadraticDiscriminantAnalysis,
+                          GaussianProcessClassifier)
+
+# the encoded data is stored as a sparse matrix if the fraction of its
+# entries that are non-zero is below this threshold (i.e. if the
+# discrete columns have more than about 10 levels on average), for
+# narrower data dense arrays are faster
+sparse_threshold = 0.1
+
+# number of released datasets read and fitted at the same time when the
+# classifiers are run in parallel, see classifier_metrics
+releases_in_flight = 2
+
+# subdirectory of the cache directory (see data_loader) with the
+# results of the models trained on the original datasets
+original_results_cache_subdir = "classifiers"
+
+# parameter search of the classifiers in "range" mode, see make_search
+default_search = {"strategy": "grid",   # "grid", "random" or "halving"
+                  "n_iter": 10,         # number of candidates ("random")
+                  "factor": 3,          # candidates kept per iteration ("halving")
+                  "min_resources": "exhaust",  # samples in the first iteration ("halving")
+                  "subsample": None}    # fraction (<= 1) or number (> 1) of training rows
 
 
 def classifier_metrics(synth_method, path_original_ds,
@@ -45,12 +81,16 @@ def classifier_metrics(synth_method, path_original_ds,
                        test_train_ratio, classifiers,
                        num_leaked_rows=0, random_seed=1234,
                        disable_all_warnings=True,
-                       verbose=False):
+                       verbose=False, preprocess_once=True,
+                       sparse_onehot=True, max_categories=None,
+                       jobs=1, multi_release=False, use_cache=True,
+                       search=None, cache_max_size=None, cache_max_age=None,
+                       cores=None):
     """
     Calculates ML classifier performance metrics for the original
     and released datasets, which are then compared to estimate the
-    utility of the released dataset. Results are saved to .json files
-    and an html report is generated.
+    utility of the released dataset. Results are saved to .json files,
+    the html report is generated separately (see metrics/report/report.py).
 
     Parameters
     ----------
@@ -86,6 +126,60 @@ def classifier_metrics(synth_method, path_original_ds,
         Disable all warning messages.
     verbose : bool
         If True, print all info messages.
+    preprocess_once : bool
+        If True (default), the preprocessor (scaling and one-hot
+        encoding) is fitted once on the original and once on the released
+        training sets, and the encoded matrices are reused by all the
+        classifiers. In "range" mode, the preprocessor fitted on each
+        cross-validation fold is also reused across the parameter grid.
+        The results are the same as with preprocess_once=False, where the
+        preprocessor is refitted for every classifier.
+    sparse_onehot : bool
+        If True (default), the one-hot encoded data is stored as a sparse
+        (CSR) matrix when most of its entries are zeros, i.e. when the
+        discrete columns have many levels (see sparse_threshold).
+        Classifiers that do not accept sparse input
+        (dense_only_classifiers) are given dense arrays.
+    max_categories : integer
+        If given, the levels of each discrete column beyond the
+        max_categories - 1 most frequent ones are grouped into a single
+        "infrequent" level before one-hot encoding.
+    jobs : integer
+        Number of worker processes. If larger than 1, the fits of the
+        classifiers on the original and released datasets are run in
+        parallel, on up to releases_in_flight released datasets at the
+        same time (and each grid search uses a single core), otherwise
+        they are run one after the other. Defaults to 1.
+    cores : integer
+        Number of cores used by each parameter search when jobs is 1,
+        e.g. the share of the machine of this task when several stages
+        run in parallel (see quipp.py). Defaults to all the cores.
+    multi_release : bool
+        If False (default), only the first released dataset
+        (synthetic_data_1.csv) is evaluated. If True, all released
+        datasets (synthetic_data_*.csv) are evaluated against the same
+        models trained on the original dataset. The metrics of each
+        released dataset are saved in utility_r_o_releases.json, their
+        mean and variance in utility_r_o_aggregate.json, and the other
+        output files contain the means across released datasets (the
+        confusion matrices are the ones of the first released dataset).
+    use_cache : bool
+        If True (default), the predictions of the models trained on the
+        original dataset (and the best parameters found in range mode)
+        are read from/stored in a cache shared by all runs, see
+        original_results_key.
+    cache_max_size : float
+        If given, the least recently used entries of this cache are
+        removed until it is at most cache_max_size MB.
+    cache_max_age : float
+        If given, the entries of this cache that have not been used for
+        more than cache_max_age days are removed.
+    search : dict
+        Parameter search of the classifiers in "range" mode, the keys
+        missing from search are taken from default_search (an
+        exhaustive grid search on all the training rows). A classifier
+        can override it with a "search" key in its tuning parameters.
+        See make_search.
     """
 
     print("[INFO] Calculating classifier-based utility metrics")
@@ -101,8 +195,7 @@ def classifier_metrics(synth_method, path_original_ds,
             os.environ["PYTHONWARNINGS"] = "ignore"  # also affect subprocesses
 
     # read metadata in JSON format
-    with open(path_original_meta) as orig_metadata_json:
-        orig_metadata = json.load(orig_metadata_json)
+    orig_metadata = read_metadata(path_original_meta)
 
     # divide columns into discrete and numeric,
     # discrete columns will be later vectorized
@@ -110,18 +203,11 @@ def classifier_metrics(synth_method, path_original_ds,
     discrete_features, numeric_features = \
         find_column_types(orig_metadata, synth_method, discrete_types)
 
-    # read original and released/synthetic datasets
-    # only the first synthetic data set is used for utility evaluation
-    orig_df = pd.read_csv(path_original_ds)
-    rlsd_df = pd.read_csv(path_released_ds + "/synthetic_data_1.csv")
+    # read original dataset
+    orig_df = read_original(path_original_ds, path_original_meta)
 
-    # fill all NaNs in datasets
-    orig_df.fillna(orig_df.median(), inplace=True)
-    rlsd_df.fillna(rlsd_df.median(), inplace=True)
-
-    # introduce leaked rows
-    if num_leaked_rows > 0:
-        rlsd_df[:num_leaked_rows] = orig_df[:num_leaked_rows]
+    # fill all NaNs in dataset
+    orig_df = fill_missing(orig_df)
 
     # split original into X/y and train/test
     X_o, y_o = orig_df[input_columns], orig_df[label_column]
@@ -129,11 +215,13 @@ def classifier_metrics(synth_method, path_original_ds,
         train_test_split(X_o, y_o, test_size=test_train_ratio,
                          random_state=random_seed)
 
-    # split released into X/y and train/test
-    X_r, y_r = rlsd_df[input_columns], rlsd_df[label_column]
-    X_train_r, X_test_r, y_train_r, y_test_r = \
-        train_test_split(X_r, y_r, test_size=test_train_ratio,
-                         random_state=random_seed)
+    # released/synthetic datasets to evaluate, by default only the
+    # first one is used for utility evaluation
+    if multi_release:
+        list_paths_released = released_paths(path_released_ds)
+    else:
+        list_paths_released = [os.path.join(path_released_ds, "synthetic_data_1.csv")]
+    list_releases = [os.path.basename(one_path) for one_path in list_paths_released]
 
     # create preprocessing pipelines for both numeric and discrete data.
     # SimpleImputer: Imputation transformer for completing missing values.
@@ -142,84 +230,293 @@ def classifier_metrics(synth_method, path_original_ds,
     # OneHotEncoder: Encode discrete features as a one-hot numeric array.
     numeric_transformer = Pipeline(steps=[('scaler', StandardScaler())])
     discrete_transformer = \
-        Pipeline(steps=[('onehot', OneHotEncoder(sparse=False,
-                                                 handle_unknown='ignore'))])
+        Pipeline(steps=[('onehot', OneHotEncoder(sparse_output=sparse_onehot,
+                                                 handle_unknown='ignore',
+                                                 max_categories=max_categories))])
 
     # extract numeric/discrete features contained in input columns
-    numeric_features_in_df = list(set(numeric_features).intersection(input_columns))
-    discrete_features_in_df = list(set(discrete_features).intersection(input_columns))
+    # (in the order of input_columns, so that the encoded data does not
+    # depend on the hashing of strings)
+    numeric_features_in_df = [col for col in input_columns if col in numeric_features]
+    discrete_features_in_df = [col for col in input_columns if col in discrete_features]
 
-    # column transformer
+    # column transformer, its output is sparse if the density of
+    # the encoded data is lower than sparse_threshold
     preprocessor = ColumnTransformer(
         transformers=[
             ('num', numeric_transformer, numeric_features_in_df),
             ('cat', discrete_transformer, discrete_features_in_df)
-        ])
-
-    # train and score each classifier for both datasets,
-    # using different metrics (accuracy, precision, recall, F1)
-    # two values are calculated for each metric
+        ], sparse_threshold=sparse_threshold if sparse_onehot else 0)
+    # same, with dense output
+    preprocessor_dense = clone(preprocessor).set_params(sparse_threshold=0)
+
+    # encode the original training and testing sets once
+    if preprocess_once:
+        X_train_enc_o, X_test_enc_o = encode_datasets(preprocessor, X_train_o, X_test_o)
+        # cache of the preprocessors fitted on cross-validation folds
+        cache_dir_pipeline = tempfile.TemporaryDirectory()
+        memory = Memory(cache_dir_pipeline.name, verbose=0)
+
+    def read_released_split(path_released_file):
+        """Reads and splits a released dataset, returns its training set
+        and the original testing set, both encoded with the preprocessor
+        fitted on the released training set if preprocess_once"""
+        rlsd_df = read_released(path_released_file, path_original_meta)
+
+        # fill all NaNs in dataset
+        rlsd_df = fill_missing(rlsd_df)
+
+        # introduce leaked rows
+        if num_leaked_rows > 0:
+            align_categories(orig_df, rlsd_df)
+            rlsd_df[:num_leaked_rows] = orig_df[:num_leaked_rows]
+
+        # split released into X/y and train/test
+        X_r, y_r = rlsd_df[input_columns], rlsd_df[label_column]
+        X_train_r, X_test_r, y_train_r, y_test_r = \
+            train_test_split(X_r, y_r, test_size=test_train_ratio,
+                             random_state=random_seed)
+        if preprocess_once:
+            X_train_enc_r, X_test_enc_r_o = encode_datasets(preprocessor, X_train_r, X_test_o)
+            return X_train_enc_r, y_train_r, X_test_enc_r_o
+        return X_train_r, y_train_r, X_test_o
+
+    def task_orig(one_clf):
+        """Arguments of fit_and_predict for training one_clf on the original
+        training set and predicting the original testing set"""
+        dense_only = issubclass(one_clf, dense_only_classifiers)
+        preprocessor_clf = preprocessor_dense if dense_only else preprocessor
+        # append classifier to preprocessing pipeline.
+        if classifiers[one_clf]["mode"] == "main":
+            parameters = classifiers[one_clf]["params_main"]
+            if preprocess_once:
+                return (one_clf(**parameters), to_dense(X_train_enc_o, dense_only),
+                        y_train_o, to_dense(X_test_enc_o, dense_only))
+            clf_orig = Pipeline(steps=[('preprocessor', preprocessor_clf),
+                                       ('classifier', one_clf(**parameters))])
+        else:
+            parameters = classifiers[one_clf]["params_range"]
+            clf_orig = Pipeline(steps=[('preprocessor', preprocessor_clf),
+                                       ('classifier', one_clf())],
+                                memory=memory if preprocess_once else None)
+            # when the classifiers are run in parallel, each of them
+            # uses a single core
+            clf_search = {**default_search, **(search or {}),
+                          **classifiers[one_clf].get("search", {})}
+            clf_orig = make_search(clf_orig, parameters, clf_search, random_seed,
+                                   n_jobs=(cores or -1) if jobs == 1 else 1)
+            search_size = search_sample_size(clf_search["subsample"], len(y_train_o))
+            return clf_orig, X_train_o, y_train_o, X_test_o, search_size
+        return clf_orig, X_train_o, y_train_o, X_test_o
+
+    def task_rlsd(one_clf, best_params, data_released):
+        """Arguments of fit_and_predict for training one_clf on the training
+        set of a released dataset (data_released, see read_released_split)
+        and predicting the original testing set, with the parameters of
+        the main mode or the best parameters found by the grid search on
+        the original dataset (range mode)"""
+        dense_only = issubclass(one_clf, dense_only_classifiers)
+        preprocessor_clf = preprocessor_dense if dense_only else preprocessor
+        if classifiers[one_clf]["mode"] == "main":
+            parameters_rlsd = classifiers[one_clf]["params_main"]
+        else:
+            parameters_rlsd = {k.split("classifier__")[1]: v for k, v
+                               in best_params.items()}
+        X_train_r, y_train_r, X_test_r_o = data_released
+        if preprocess_once:
+            return (one_clf(**parameters_rlsd), to_dense(X_train_r, dense_only),
+                    y_train_r, to_dense(X_test_r_o, dense_only))
+        clf_rlsd = Pipeline(steps=[('preprocessor', preprocessor_clf),
+                                   ('classifier', one_clf(**parameters_rlsd))])
+        return clf_rlsd, X_train_r, y_train_r, X_test_r_o
+
+    # results of the models trained on the original dataset are
+    # reused from previous runs with the same inputs (see
+    # original_results_cache_path), only the fits on the released
+    # datasets are then needed
+    dict_paths_cache = {}
+    dict_results = {}
+    if use_cache:
+        key_orig = original_results_key(path_original_ds, orig_metadata,
+                                        discrete_features_in_df, numeric_features_in_df,
+                                        input_columns, label_column, test_train_ratio,
+                                        random_seed, sparse_onehot, max_categories,
+                                        search)
+        for one_clf in classifiers:
+            dict_paths_cache[one_clf] = original_results_cache_path(key_orig, one_clf,
+                                                                    classifiers[one_clf])
+            if os.path.isfile(dict_paths_cache[one_clf]):
+                cache.touch(dict_paths_cache[one_clf])
+                with open(dict_paths_cache[one_clf], "rb") as f:
+                    dict_results[(one_clf, "o")] = pickle.load(f)
+        if verbose:
+            print(f"[INFO] {len(dict_results)} original models found in the cache")
+
+    def store_orig(one_clf, result):
+        """Stores the result of the fit of one_clf on the original dataset"""
+        dict_results[(one_clf, "o")] = result
+        if use_cache:
+            path_tmp = cache.temporary_path(dict_paths_cache[one_clf])
+            with open(path_tmp, "wb") as f:
+                pickle.dump(result, f)
+            os.replace(path_tmp, dict_paths_cache[one_clf])
+
+    def fit_releases_sequential():
+        """Trains each classifier on the original dataset (if needed) and
+        on each released dataset, predicting the original testing set,
+        one fit after the other. The results are stored in dict_results
+        with keys (classifier, "o") (trained on original) and
+        (classifier, release) (trained on a released dataset), the
+        releases are yielded in order once all their results are stored"""
+        for release, path_released_file in zip(list_releases, list_paths_released):
+            data_released = read_released_split(path_released_file)
+            for one_clf in classifiers:
+                if (one_clf, "o") not in dict_results:
+                    store_orig(one_clf, fit_and_predict(*task_orig(one_clf),
+                                                        random_seed=random_seed))
+                dict_results[(one_clf, release)] = \
+                    fit_and_predict(*task_rlsd(one_clf, dict_results[(one_clf, "o")][2],
+                                               data_released),
+                                    random_seed=random_seed)
+            del data_released
+            yield release
+
+    def fit_releases_parallel(executor):
+        """Same as fit_releases_sequential, the fits being independent
+        tasks run by executor, except that in range mode the fit on a
+        released dataset is only submitted when the grid search on the
+        original dataset has finished. At most releases_in_flight
+        released datasets are read and fitted at the same time (the next
+        one is read and submitted while the fits of the previous ones
+        run), so that only their data is in memory"""
+        running = {}
+        # data of the releases being fitted, number of their fits that
+        # have not finished and releases waiting for the grid search of
+        # each classifier on the original dataset
+        dict_data = {}
+        dict_remaining = {}
+        dict_waiting = {one_clf: [] for one_clf in classifiers}
+
+        def submit_released(one_clf, release):
+            best_params = dict_results.get((one_clf, "o"), (None, None, None))[2]
+            future = executor.submit(fit_and_predict,
+                                     *task_rlsd(one_clf, best_params, dict_data[release]),
+                                     random_seed=random_seed)
+            running[future] = (one_clf, release)
+
+        def start_release(release, path_released_file):
+            dict_data[release] = read_released_split(path_released_file)
+            dict_remaining[release] = len(classifiers)
+            for one_clf in classifiers:
+                if (one_clf, "o") not in dict_results and \
+                        (one_clf, "o") not in running.values():
+                    future = executor.submit(fit_and_predict, *task_orig(one_clf),
+                                             random_seed=random_seed)
+                    running[future] = (one_clf, "o")
+                if (one_clf, "o") in dict_results or classifiers[one_clf]["mode"] == "main":
+                    submit_released(one_clf, release)
+                else:
+                    dict_waiting[one_clf].append(release)
+
+        def is_done(release):
+            # the models trained on the original dataset are all needed
+            # to score the first release
+            return dict_remaining.get(release) == 0 and \
+                all((one_clf, "o") in dict_results for one_clf in classifiers)
+
+        list_todo = list(zip(list_releases, list_paths_released))
+        num_started = 0
+        for num_done, release in enumerate(list_releases):
+            while not is_done(release):
+                while num_started < min(num_done + releases_in_flight, len(list_todo)):
+                    start_release(*list_todo[num_started])
+                    num_started += 1
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    one_clf, dataset = running.pop(future)
+                    if dataset != "o":
+                        dict_results[(one_clf, dataset)] = future.result()
+                        dict_remaining[dataset] -= 1
+                        continue
+                    store_orig(one_clf, future.result())
+                    for release_waiting in dict_waiting.pop(one_clf):
+                        submit_released(one_clf, release_waiting)
+            del dict_data[release]
+            yield release
+
+    # train each classifier on the original dataset and on each released
+    # dataset, and score them using different metrics (accuracy,
+    # precision, recall, F1). Two values are calculated for each metric
     #   * trained on original, tested on original
     #   * trained on released, tested on original
+    # the second one for each released dataset. The released datasets
+    # are read, fitted and scored in order, only a few of them being in
+    # memory at the same time. The random seeds are set before each
+    # fit, so that the results do not depend on the order of the fits
+    # (or on which are cached)
     utility_o_o = {}
-    utility_r_o = {}
-    utility_diff = {}
     utility_confusion_o_o = {}
-    utility_confusion_r_o = {}
-    for one_clf in classifiers:
-
-        clf_name = one_clf.__name__
-
+    utility_r_o_releases = {}
+    utility_diff_releases = {}
+    utility_confusion_r_o_releases = {}
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
         with warnings.catch_warnings(record=True) as warns:
+            fitted_releases = fit_releases_sequential() if executor is None \
+                else fit_releases_parallel(executor)
+            for release in fitted_releases:
+                if not utility_o_o:
+                    for one_clf in classifiers:
+                        clf_name = one_clf.__name__
+                        y_test_pred_o_o, classes_o, _ = dict_results[(one_clf, "o")]
+                        conf_matrix = confusion_counts(y_test_pred_o_o, y_test_o)
+                        utility_o_o[clf_name] = calculate_metrics(y_test_pred_o_o, y_test_o,
+                                                                  conf_matrix=conf_matrix)
+                        utility_confusion_o_o[clf_name] = \
+                            calculate_confusion_matrix(y_test_pred_o_o, y_test_o,
+                                                       target_names=classes_o,
+                                                       conf_matrix=conf_matrix)
+
+                utility_r_o_releases[release] = {}
+                utility_diff_releases[release] = {}
+                utility_confusion_r_o_releases[release] = {}
+                for one_clf in classifiers:
+                    clf_name = one_clf.__name__
+                    y_test_pred_r_o, classes_r, _ = dict_results.pop((one_clf, release))
+
+                    # calculate and store all metrics, from a single confusion matrix
+                    conf_matrix = confusion_counts(y_test_pred_r_o, y_test_o)
+                    utility_r_o_releases[release][clf_name] = \
+                        calculate_metrics(y_test_pred_r_o, y_test_o, conf_matrix=conf_matrix)
+
+                    # calculate and store metrics' relative differences between
+                    # original/original and released/original settings
+                    utility_diff_releases[release][clf_name] = \
+                        calculate_diff_metrics(utility_o_o[clf_name],
+                                               utility_r_o_releases[release][clf_name])
+
+                    # calculate and store confusion matrices
+                    utility_confusion_r_o_releases[release][clf_name] = \
+                        calculate_confusion_matrix(y_test_pred_r_o, y_test_o,
+                                                   target_names=classes_r,
+                                                   conf_matrix=conf_matrix)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # with a single released dataset the means are its metrics
+    utility_r_o = mean_metrics(list(utility_r_o_releases.values()))
+    utility_diff = mean_metrics(list(utility_diff_releases.values()))
+    utility_confusion_r_o = utility_confusion_r_o_releases[list_releases[0]]
+
+    if preprocess_once:
+        cache_dir_pipeline.cleanup()
+    if use_cache:
+        cache.evict(os.path.join(cache_dir, original_results_cache_subdir),
+                    max_size=None if cache_max_size is None else cache_max_size * 2**20,
+                    max_age=None if cache_max_age is None else cache_max_age * 86400,
+                    verbose=verbose)
 
-            # original dataset
-            # append classifier to preprocessing pipeline.
-            if classifiers[one_clf]["mode"] == "main":
-                parameters = classifiers[one_clf]["params_main"]
-                clf_orig = Pipeline(steps=[('preprocessor', preprocessor),
-                                           ('classifier', one_clf(**parameters))])
-            else:
-                parameters = classifiers[one_clf]["params_range"]
-                clf_orig = Pipeline(steps=[('preprocessor', preprocessor),
-                                           ('classifier', one_clf())])
-                clf_orig = GridSearchCV(clf_orig, parameters,
-                                        scoring="f1_macro", n_jobs=-1)
-            # train classifier on original training set
-            # and predict original testing set
-            clf_orig.fit(X_train_o, y_train_o)
-            y_test_pred_o_o = clf_orig.predict(X_test_o)
-
-            # released dataset
-            # append classifier to preprocessing pipeline.
-            if classifiers[one_clf]["mode"] == "main":
-                clf_rlsd = Pipeline(steps=[('preprocessor', preprocessor),
-                                           ('classifier', one_clf(**parameters))])
-            else:
-                parameters_rlsd = {k.split("classifier__")[1]: v for k, v
-                                   in clf_orig.best_params_.items()}
-                clf_rlsd = Pipeline(steps=[('preprocessor', preprocessor),
-                                           ('classifier', one_clf(**parameters_rlsd))])
-            # train classifier on released training set
-            # and predict original testing set
-            clf_rlsd.fit(X_train_r, y_train_r)
-            y_test_pred_r_o = clf_rlsd.predict(X_test_o)
-
-            # calculate and store all metrics for both train/test combinations
-            utility_o_o[clf_name] = calculate_metrics(y_test_pred_o_o, y_test_o)
-            utility_r_o[clf_name] = calculate_metrics(y_test_pred_r_o, y_test_o)
-
-            # calculate and store metrics' relative differences between
-            # original/original and released/original settings
-            utility_diff[clf_name] = calculate_diff_metrics(utility_o_o[clf_name], utility_r_o[clf_name])
-
-            # calculate and store confusion matrices
-            utility_confusion_o_o[clf_name] = calculate_confusion_matrix(y_test_pred_o_o,
-                                                                         y_test_o,
-                                                                         target_names=clf_orig.classes_)
-            utility_confusion_r_o[clf_name] = calculate_confusion_matrix(y_test_pred_r_o,
-                                                                         y_test_o,
-                                                                         target_names=clf_rlsd.classes_)
-    
     # mean relative differences for each metric (from all classifiers combined)
     utility_overall_diff = calculate_overall_diff(utility_diff)
 
@@ -235,6 +532,12 @@ def classifier_metrics(synth_method, path_original_ds,
     save_json(utility_r_o, filename="utility_r_o.json", par_dir=path_released_ds)
     save_json(utility_confusion_o_o, filename="utility_confusion_o_o.json", par_dir=path_released_ds)
     save_json(utility_confusion_r_o, filename="utility_confusion_r_o.json", par_dir=path_released_ds)
+    if multi_release:
+        save_json(utility_r_o_releases, filename="utility_r_o_releases.json",
+                  par_dir=path_released_ds)
+        save_json({"mean": utility_r_o,
+                   "variance": variance_metrics(list(utility_r_o_releases.values()))},
+                  filename="utility_r_o_aggregate.json", par_dir=path_released_ds)
 
     # print any warnings
     if len(warns) > 0:
@@ -242,13 +545,193 @@ def classifier_metrics(synth_method, path_original_ds,
         for iw in warns:
             print(iw.message)
 
-    # create output report
-    report.report(path_released_ds)
 
+def fill_missing(df):
+    """
+    Returns a copy of df with its missing values filled by the median
+    of each column with numerical values. Categorical/Ordinal columns
+    with numerical categories are also filled with the median of their
+    values (added to their categories), as they were when they were
+    read as numbers, columns with text values are left as they are.
+    """
+    # the medians are only computed for the columns with missing values,
+    # pandas fails on the read-only columns of the shared original
+    # dataset (see data_loader.read_original) otherwise
+    numeric_df = df.select_dtypes("number")
+    df = df.fillna(numeric_df[numeric_df.columns[numeric_df.isna().any()]].median())
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and \
+                pd.api.types.is_numeric_dtype(df[col].cat.categories) and df[col].isna().any():
+            median = df[col].astype(float).median()
+            if np.isnan(median):
+                continue
+            if median not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories([median])
+            df[col] = df[col].fillna(median)
+    return df
+
+
+def encode_datasets(preprocessor, X_train, X_test):
+    """Fits a copy of the preprocessor on X_train and returns
+    the encoded X_train and X_test"""
+    preprocessor = clone(preprocessor)
+    X_train_enc = preprocessor.fit_transform(X_train)
+    X_test_enc = preprocessor.transform(X_test)
+    return X_train_enc, X_test_enc
+
+
+def original_results_key(path_original_ds, orig_metadata, discrete_features,
+                         numeric_features, input_columns, label_column, test_train_ratio,
+                         random_seed, sparse_onehot, max_categories, search=None):
+    """
+    Key of the results of the models trained on the original dataset,
+    in the cache shared by all runs. It depends on the contents of the
+    original dataset and on all the parameters that determine the
+    training and testing sets and their encoding (but not on the
+    released datasets). The synthesis method only changes the encoding
+    through the discrete and numeric features (see find_column_types),
+    so runs of methods with the same column types share the results.
+    """
+    return cache.hash_key(dataset_hash(path_original_ds), orig_metadata,
+                          discrete_features, numeric_features,
+                          input_columns, label_column, test_train_ratio,
+                          random_seed, sparse_onehot, max_categories,
+                          {**default_search, **(search or {})}, sklearn.__version__)
+
+
+def original_results_cache_path(key_orig, one_clf, clf_parameters):
+    """Path of the cached results of classifier one_clf (with parameters
+    clf_parameters) trained on the original dataset"""
+    key = cache.hash_key(key_orig, one_clf.__name__, clf_parameters)
+    return cache.cache_path(os.path.join(cache_dir, original_results_cache_subdir),
+                            key, ".pkl")
+
+
+def make_search(estimator, param_grid, search, random_seed=None, n_jobs=None):
+    """
+    Parameter search of estimator over param_grid in "range" mode,
+    scored on the macro-averaged F1 score.
+
+    Parameters
+    ----------
+    estimator : sklearn estimator
+        The pipeline of the classifier.
+    param_grid : dict
+        Lists of values of the parameters to search.
+    search : dict
+        The search strategy (see default_search): "grid" (exhaustive
+        GridSearchCV), "random" (RandomizedSearchCV evaluating n_iter
+        candidates) or "halving" (HalvingGridSearchCV, which evaluates
+        all candidates on min_resources training rows and keeps the best
+        1/factor of them for the next iteration with factor times more
+        rows).
+    random_seed : integer
+        Random state of the randomized and halving searches.
+    n_jobs : integer
+        Number of jobs of the search.
+
+    Returns
+    -------
+    clf : sklearn estimator
+        The search, not fitted. If search["subsample"] is given, it is
+        not refitted on the best parameters (see fit_and_predict).
+    """
+    refit = search.get("subsample") is None
+    if search["strategy"] == "grid":
+        return GridSearchCV(estimator, param_grid, scoring="f1_macro",
+                            n_jobs=n_jobs, refit=refit)
+    if search["strategy"] == "random":
+        return RandomizedSearchCV(estimator, param_grid, n_iter=search["n_iter"],
+                                  scoring="f1_macro", n_jobs=n_jobs, refit=refit,
+                                  random_state=random_seed)
+    if search["strategy"] == "halving":
+        return HalvingGridSearchCV(estimator, param_grid, factor=search["factor"],
+                                   resource="n_samples",
+                                   min_resources=search["min_resources"],
+                                   scoring="f1_macro", n_jobs=n_jobs, refit=refit,
+                                   random_state=random_seed)
+    raise ValueError(f"Unknown search strategy: {search['strategy']}, "
+                     f"should be one of 'grid', 'random' or 'halving'")
+
+
+def search_sample_size(subsample, num_rows):
+    """
+    Number of training rows used by the parameter search, given by
+    subsample as a fraction of the rows (0 < subsample <= 1, so that 1
+    and 1.0 both mean all the rows) or as a number of rows (an integer
+    larger than 1). Returns None if all num_rows rows are used.
+    """
+    if subsample is None:
+        return None
+    if subsample <= 0 or (subsample > 1 and int(subsample) != subsample):
+        raise ValueError(f"Invalid search subsample: {subsample}, should be a fraction "
+                         f"of the training rows (at most 1) or a number of rows "
+                         f"(an integer larger than 1)")
+    if subsample <= 1:
+        subsample = int(round(subsample * num_rows))
+    if subsample >= num_rows:
+        return None
+    return int(subsample)
+
+
+def fit_and_predict(clf, X_train, y_train, X_test, search_size=None, random_seed=None):
+    """
+    Trains clf on X_train/y_train and predicts X_test. This is the unit
+    of work given to the worker processes.
 
-def calculate_confusion_matrix(y_pred, y_test, target_names):
-    """Calculate confusion matrix and save to dictionary"""
-    output = {"conf_matrix": confusion_matrix(y_pred, y_test).tolist(),
+    Parameters
+    ----------
+    clf : sklearn estimator
+        The classifier (a Pipeline, a parameter search or a bare classifier).
+    X_train, y_train, X_test
+        Training and testing data.
+    search_size : integer
+        If given, clf is a parameter search (see make_search) that is
+        run on a stratified sample of search_size training rows, then
+        the classifier with the best parameters is trained on all the
+        training rows.
+    random_seed : integer
+        If given, numpy and python random seeds are set before training,
+        so that the results do not depend on the process running the task.
+
+    Returns
+    -------
+    y_pred : numpy.array
+        The predicted labels of X_test.
+    classes : numpy.array
+        The class labels of the classifier.
+    best_params : dict
+        The best parameters found (parameter search only), otherwise None.
+    """
+    if random_seed is not None:
+        random.seed(random_seed)
+        np.random.seed(random_seed)
+    if search_size is not None:
+        X_search, y_search = resample(X_train, y_train, replace=False,
+                                      n_samples=search_size, stratify=y_train,
+                                      random_state=random_seed)
+        search = clf.fit(X_search, y_search)
+        clf = clone(search.estimator).set_params(**search.best_params_)
+        clf.fit(X_train, y_train)
+        return clf.predict(X_test), clf.classes_, search.best_params_
+    clf.fit(X_train, y_train)
+    y_pred = clf.predict(X_test)
+    return y_pred, clf.classes_, getattr(clf, "best_params_", None)
+
+
+def to_dense(X, dense=True):
+    """Converts X to a dense array if it is a sparse matrix and dense=True"""
+    if dense and sparse.issparse(X):
+        return X.toarray()
+    return X
+
+
+def calculate_confusion_matrix(y_pred, y_test, target_names, conf_matrix=None):
+    """Calculate confusion matrix (if conf_matrix is not given, see
+    confusion_counts) and save to dictionary"""
+    if conf_matrix is None:
+        conf_matrix = confusion_counts(y_pred, y_test)
+    output = {"conf_matrix": conf_matrix.tolist(),
               "target_names": target_names.tolist()}
     return output
 
@@ -263,28 +746,6 @@ def save_json(inp_dict, filename, par_dir):
         json.dump(inp_dict, write_file)
 
 
-def print_metric(inp_dict, title=" ", verbose=True):
-    """Prints metrics from dictionary"""
-    msg = ""
-    msg += f"\n\n{title}" + "<br />"
-    if verbose:
-        print(f"\n\n{title}")
-    for k_method, v_method in inp_dict.items():
-        msg += "<br />"
-        msg += f"{k_method}" + "<br />"
-        msg += "-"*len(k_method) + "<br />"
-        if verbose:
-            print("")
-            print(f"{k_method}")
-            print("-"*len(k_method))
-        for k_metric, v_metric in v_method.items():
-            for k_value, v_value in v_metric.items():
-                msg += f"{k_metric} ({k_value}): {v_value:.2f}" + "<br />"
-                if verbose:
-                    print(f"{k_metric} ({k_value}): {v_value}")
-    return msg
-
-
 def print_summary(inp_dict, title="Summary"):
     """Prints summary metrics from dictionary"""
     print()
@@ -296,6 +757,33 @@ def print_summary(inp_dict, title="Summary"):
             print(f"{k_metric} ({k_value}): {v_value}")
 
 
+def mean_metrics(list_utils):
+    """Mean of each metric across a list of metric dictionaries
+    with the same structure (e.g. utility_r_o of each released dataset)"""
+    return aggregate_metrics(list_utils, np.mean)
+
+
+def variance_metrics(list_utils):
+    """Sample variance of each metric across a list of metric
+    dictionaries (zero if the list has a single element)"""
+    return aggregate_metrics(list_utils,
+                             lambda values: np.var(values, ddof=1) if len(values) > 1 else 0.)
+
+
+def aggregate_metrics(list_utils, func):
+    """Applies func to the values of each metric of the
+    dictionaries in list_utils, see mean_metrics"""
+    util_agg = {}
+    for method_k, method_v in list_utils[0].items():
+        util_agg[method_k] = {}
+        for metric_k, metric_v in method_v.items():
+            util_agg[method_k][metric_k] = {}
+            for avg_k in metric_v:
+                values = [one_util[method_k][metric_k][avg_k] for one_util in list_utils]
+                util_agg[method_k][metric_k][avg_k] = float(func(values))
+    return util_agg
+
+
 def calculate_overall_diff(util_diff):
     """Calculate mean difference across models"""
     list_methods = list(util_diff.keys())
@@ -327,10 +815,32 @@ def calculate_diff_metrics(util1, util2):
     return util_diff
 
 
+def confusion_counts(y_pred, y_test):
+    """
+    Confusion matrix of y_pred (rows) against y_test (columns), over the
+    sorted labels of both, as given by confusion_matrix(y_pred, y_test).
+    All the pairs of labels are counted by a single np.bincount.
+    """
+    y_pred, y_test = np.asarray(y_pred), np.asarray(y_test)
+    labels, codes = np.unique(np.concatenate([y_pred, y_test]), return_inverse=True)
+    num_labels = len(labels)
+    codes_pred, codes_test = codes[:len(y_pred)], codes[len(y_pred):]
+    counts = np.bincount(codes_pred * num_labels + codes_test, minlength=num_labels ** 2)
+    return counts.reshape(num_labels, num_labels)
+
+
 def calculate_metrics(y_pred, y_test,
-                      metrics=None):
+                      metrics=None, conf_matrix=None):
     """Computes metrics using a list of predictions
-    and their ground-truth labels"""
+    and their ground-truth labels.
+
+    All the metrics are derived from the confusion matrix
+    conf_matrix = confusion_counts(y_pred, y_test) (computed if not
+    given), with the same values as the scikit-learn scores called
+    as score(y_pred, y_test) with zero_division=1, i.e. the
+    predictions play the role of the true labels: precision is
+    computed per column and recall and the weights of the weighted
+    averages per row of conf_matrix."""
     if metrics is None:
         metrics = [("accuracy", "value"),
                    ("precision", "macro"),
@@ -339,34 +849,67 @@ def calculate_metrics(y_pred, y_test,
                    ("recall", "weighted"),
                    ("f1", "macro"),
                    ("f1", "weighted")]
+    if conf_matrix is None:
+        conf_matrix = confusion_counts(y_pred, y_test)
+
+    tp = np.diag(conf_matrix).astype(float)
+    rows = conf_matrix.sum(axis=1)
+    cols = conf_matrix.sum(axis=0)
+    # per label scores, 1 where their denominator is 0 (zero_division)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        per_label = {"precision": np.where(cols > 0, tp / cols, 1.),
+                     "recall": np.where(rows > 0, tp / rows, 1.),
+                     "f1": np.where(rows + cols > 0, 2 * tp / (rows + cols), 1.)}
+    per_label["f-1"] = per_label["f1"]
+
     util_collect = {}
     for method_name, ave_method in metrics:
 
         if method_name not in util_collect:
             util_collect[method_name] = {}
 
-        if method_name.lower() in ["precision"]:
-            util_collect[method_name][ave_method] = \
-                precision_score(y_pred, y_test, average=ave_method,
-                                zero_division=True) * 100.
-        elif method_name.lower() in ["recall"]:
-            util_collect[method_name][ave_method] = \
-                recall_score(y_pred, y_test, average=ave_method,
-                             zero_division=True) * 100.
-        elif method_name.lower() in ["f1", "f-1"]:
-            util_collect[method_name][ave_method] = \
-                f1_score(y_pred, y_test, average=ave_method,
-                         zero_division=True) * 100.
+        if method_name.lower() in per_label:
+            scores = per_label[method_name.lower()]
+            if ave_method == "macro":
+                value = scores.mean()
+            elif ave_method == "weighted":
+                value = np.average(scores, weights=rows)
+            else:
+                raise ValueError(f"Unknown average: {ave_method}, "
+                                 f"should be 'macro' or 'weighted'")
+            util_collect[method_name][ave_method] = float(value) * 100.
         elif method_name.lower() in ["accuracy"]:
             util_collect[method_name][ave_method] = \
-                accuracy_score(y_pred, y_test) * 100.
+                float(tp.sum() / conf_matrix.sum()) * 100.
 
     return util_collect
 
 
-def main():
+def handle_cmdline_args(argv=None):
+    """Return the command line arguments (or the arguments in the list
+    argv) of the metric scripts, with the options specific to the
+    classifiers added."""
+    parser = create_cmdline_parser()
+    parser.add_argument(
+        '--cache-max-size', dest='cache_max_size', type=float, default=None,
+        help='Maximum size of the cache of the models trained on the original '
+             'datasets in MB, the least recently used entries are removed first '
+             '(default: no limit)')
+    parser.add_argument(
+        '--cache-max-age', dest='cache_max_age', type=float, default=None,
+        help='Remove cached models that have not been used for this many days '
+             '(default: no limit)')
+    parser.add_argument(
+        '--cores', dest='cores', type=int, default=None,
+        help='Number of cores used by each parameter search when a single job '
+             'is used (default: all the cores)')
+    args = parser.parse_args(argv)
+    return args
+
+
+def main(argv=None):
     # process command line arguments
-    args = handle_cmdline_args()
+    args = handle_cmdline_args(argv)
 
     # read run input parameters file
     with open(args.infile) as f:
@@ -389,6 +932,12 @@ def main():
     label_column = utility_parameters_classifiers["label_column"]
     test_train_ratio = utility_parameters_classifiers["test_train_ratio"]
     num_leaked_rows = utility_parameters_classifiers["num_leaked_rows"]
+    preprocess_once = utility_parameters_classifiers.get("preprocess_once", True)
+    sparse_onehot = utility_parameters_classifiers.get("sparse_onehot", True)
+    max_categories = utility_parameters_classifiers.get("max_categories", None)
+    multi_release = utility_parameters_classifiers.get("multi_release", False)
+    use_cache = utility_parameters_classifiers.get("cache_original_models", True)
+    search = utility_parameters_classifiers.get("search", None)
 
     # create dictionary with classifier tuning parameters
     if "classifier" in utility_parameters_classifiers:
@@ -437,7 +986,17 @@ def main():
                        path_original_meta, path_released_ds,
                        input_columns, label_column,
                        test_train_ratio, classifiers,
-                       num_leaked_rows, random_seed)
+                       num_leaked_rows, random_seed,
+                       preprocess_once=preprocess_once,
+                       sparse_onehot=sparse_onehot,
+                       max_categories=max_categories,
+                       jobs=args.jobs,
+                       multi_release=multi_release,
+                       use_cache=use_cache,
+                       search=search,
+                       cache_max_size=args.cache_max_size,
+                       cache_max_age=args.cache_max_age,
+                       cores=args.cores)
 
 
 if __name__ == '__main__':
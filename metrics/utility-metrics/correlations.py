@@ -2,24 +2,288 @@
 Code to calculate correlation-like utility metrics
 """
 
+import functools
 import json
 import os
 import sys
+import tempfile
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
 import pandas as pd
-from dython.nominal import cramers_v, theils_u, correlation_ratio
+from scipy import sparse
 
 sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, "utilities"))
-from utils import handle_cmdline_args, extract_parameters, find_column_types
+from utils import handle_cmdline_args, extract_parameters, find_column_types, released_paths
+from data_loader import read_original, read_released, read_metadata, metadata_dtypes, \
+    apply_dtypes
+from matrix_store import save_matrices, load_matrices
+
+
+# pairwise contingency tables with at most this number of cells are
+# counted as dense arrays, larger ones only store the observed pairs
+max_dense_table_cells = 2**22
+
+# the pairs of columns are split into about this number of tiles per
+# worker process (see split_tiles), so that all workers stay busy
+tiles_per_job = 4
+
+# columns of the dataset corresponding to the rows and columns of
+# each matrix
+matrix_axes = {"Cramers_V": ("categorical", "categorical"),
+               "Theils_U": ("categorical", "categorical"),
+               "Correlations": ("numeric", "numeric"),
+               "Correlation_Ratio": ("categorical", "numeric")}
+
+# number of rows per chunk in streaming mode
+default_chunk_size = 100000
+
+# sampled mode: number of rows sampled from each dataset, sampling
+# method ("random" or "reservoir") and number of bootstrap resamples
+# used to estimate the standard errors, see sampled_correlation_matrices
+default_sample = {"size": 100000, "method": "random", "bootstrap": 50}
+
+# values of Cramer's V and Theil's U within this distance of [0, 1]
+# are rounded to 0 or 1, as in dython
+precision = 1e-13
+
+
+def is_zero_level(level):
+    """
+    True if a level of a categorical column is 0, the value that
+    replaces missing values (as in dython). Columns read as text (e.g.
+    in streaming mode) have the levels "0" or "0.0" instead.
+    """
+    return level == 0 or level in ("0", "0.0")
+
+
+def categorical_codes(df):
+    """
+    Factorizes the columns of df into integer codes, once for all the
+    pairs of columns. As in dython, missing values are replaced with 0.0,
+    i.e. they are merged with the level equal to 0 (see is_zero_level)
+    if there is one, otherwise they form a level of their own.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The input dataframe containing only categorical data.
+
+    Returns
+    -------
+    codes : numpy.array
+        An array with one row per column of df, containing the codes
+        (from 0 to the number of levels of the column minus 1) of its
+        values.
+    num_levels : numpy.array
+        The number of (observed) levels of each column.
+    """
+    codes = np.empty((df.shape[1], df.shape[0]), dtype=np.int64)
+    num_levels = np.empty(df.shape[1], dtype=np.int64)
+    for i, col in enumerate(df.columns):
+        col_codes, uniques = pd.factorize(df[col])
+        missing = col_codes == -1
+        if missing.any():
+            zero = [j for j, level in enumerate(uniques) if is_zero_level(level)]
+            # (not in place, the codes can be a view of the column)
+            col_codes = np.where(missing, zero[0] if zero else len(uniques), col_codes)
+            num_levels[i] = len(uniques) + (0 if zero else 1)
+        else:
+            num_levels[i] = len(uniques)
+        codes[i] = col_codes
+    return codes, num_levels
+
+
+def entropy(counts, num_rows):
+    """Entropy (in nats) of the distribution given by counts"""
+    p = counts[counts > 0] / num_rows
+    return -np.sum(p * np.log(p))
+
+
+def chi2_statistic(table):
+    """
+    Pearson's chi-squared statistic of a (dense) contingency table
+    without empty rows or columns, with Yates' correction for 2x2
+    tables, as given by scipy.stats.chi2_contingency.
+    """
+    if table.shape[0] == 1 or table.shape[1] == 1:
+        return 0.0
+    expected = np.outer(table.sum(axis=1), table.sum(axis=0)) / table.sum()
+    observed = table.astype(float)
+    if table.shape == (2, 2):
+        diff = expected - observed
+        observed = observed + np.sign(diff) * np.minimum(0.5, np.abs(diff))
+    return np.sum((observed - expected) ** 2 / expected)
+
+
+def sparse_chi2_statistic(counts, rows, cols, num_rows):
+    """
+    Pearson's chi-squared statistic of a contingency table given by its
+    non-zero counts and the totals of their rows and columns. With O the
+    observed and E the expected counts,
+    chi2 = sum((O - E)**2 / E) = sum(O**2 / E) - num_rows,
+    where the sum is over the observed cells only (no Yates' correction,
+    see chi2_statistic for 2x2 tables).
+    """
+    return num_rows * np.sum(counts / rows * (counts / cols)) - num_rows
+
+
+def cramers_v_from_chi2(chi2, num_rows, r, k):
+    """
+    Cramer's V with the bias correction of Bergsma and Wicher, from the
+    chi-squared statistic of a r x k contingency table (see dython's
+    cramers_v).
+    """
+    phi2 = chi2 / num_rows
+    phi2corr = max(0, phi2 - ((k - 1) * (r - 1)) / (num_rows - 1))
+    rcorr = r - ((r - 1) ** 2) / (num_rows - 1)
+    kcorr = k - ((k - 1) ** 2) / (num_rows - 1)
+    if min((kcorr - 1), (rcorr - 1)) == 0:
+        warnings.warn("Unable to calculate Cramer's V using bias correction.",
+                      RuntimeWarning)
+        return np.nan
+    v = np.sqrt(phi2corr / min((kcorr - 1), (rcorr - 1)))
+    if 1.0 < v <= 1.0 + precision:
+        return 1.0
+    return v
+
+
+def theils_u_from_entropies(entropy_x, entropy_y, entropy_xy):
+    """
+    Theil's U of x given y (see dython's theils_u), from the entropies
+    of x and y and their joint entropy.
+    """
+    if entropy_x == 0:
+        return 1.0
+    # the conditional entropy of x given y is entropy_xy - entropy_y
+    u = (entropy_x - (entropy_xy - entropy_y)) / entropy_x
+    if -precision <= u < 0.0:
+        return 0.0
+    if 1.0 < u <= 1.0 + precision:
+        return 1.0
+    return u
+
+
+def pair_associations(codes, num_levels, entropies, pairs):
+    """
+    Cramer's V and Theil's U of pairs of categorical columns. The
+    contingency table of each pair is counted once (with np.bincount on
+    the combined codes of the two columns), and both statistics are
+    computed from it.
+
+    Parameters
+    ----------
+    codes, num_levels : numpy.array
+        The codes of the columns, see categorical_codes.
+    entropies : numpy.array
+        The entropy of each column.
+    pairs : list
+        The pairs of column indices (i1, i2).
+
+    Returns
+    -------
+    output : list
+        For each pair, a tuple with Cramer's V, Theil's U of i1 given i2
+        and Theil's U of i2 given i1.
+    """
+    num_rows = codes.shape[1]
+    output = []
+    for i1, i2 in pairs:
+        r, k = num_levels[i1], num_levels[i2]
+        combined = codes[i1] * k + codes[i2]
+        # (2x2 tables are always dense, for Yates' correction)
+        if r * k <= max(max_dense_table_cells, 4):
+            table = np.bincount(combined, minlength=r * k).reshape(r, k)
+            chi2 = chi2_statistic(table)
+            counts = table.ravel()
+        else:
+            # large tables are mostly empty, only the observed pairs are
+            # counted
+            combined, counts = np.unique(combined, return_counts=True)
+            rows = np.bincount(codes[i1], minlength=r)[combined // k]
+            cols = np.bincount(codes[i2], minlength=k)[combined % k]
+            chi2 = sparse_chi2_statistic(counts, rows, cols, num_rows)
+        output.append(table_associations(chi2, counts, num_rows, r, k,
+                                         entropies[i1], entropies[i2]))
+    return output
+
+
+def table_associations(chi2, counts, num_rows, r, k, entropy_x, entropy_y):
+    """
+    Cramer's V, Theil's U of x given y and Theil's U of y given x, from
+    the r x k contingency table of x and y given by its chi-squared
+    statistic and its counts, and the entropies of x and y.
+    """
+    entropy_xy = entropy(counts, num_rows)
+    return (cramers_v_from_chi2(chi2, num_rows, r, k),
+            theils_u_from_entropies(entropy_x, entropy_y, entropy_xy),
+            theils_u_from_entropies(entropy_y, entropy_x, entropy_xy))
+
+
+def categorical_association_matrices(df):
+    """
+    Calculates Cramer's V and Theil's U for each combination of
+    columns of a dataframe df containing only categorical data, with
+    the same results as dython's cramers_v and theils_u. The columns
+    are factorized once, and the contingency table of each pair of
+    columns is counted once for both statistics (see
+    pair_associations).
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The input dataframe containing only categorical data.
+
+    Returns
+    -------
+    cramers_v : numpy.array
+        A symmetric array with number of rows and columns equal to the
+        number of columns of df, which contains the Cramer's V metrics.
+    theils_u : numpy.array
+        An array of the same shape, whose element [i1, i2] is Theil's U
+        of column i1 given column i2.
+    """
+    codes, num_levels = categorical_codes(df)
+    pairs = association_pairs(df.shape[1])
+    return association_matrices(df.shape[1], pairs,
+                                pair_associations(codes, num_levels,
+                                                  column_entropies(codes), pairs))
+
+
+def column_entropies(codes):
+    """Entropy of each column, given its codes (see categorical_codes)"""
+    num_rows = codes.shape[1]
+    return np.array([entropy(np.bincount(col_codes), num_rows) for col_codes in codes])
+
+
+def association_pairs(num_cols):
+    """Pairs of columns (i1, i2) with i1 >= i2, the other pairs are
+    obtained by symmetry (see association_matrices)"""
+    return [(i1, i2) for i1 in range(num_cols) for i2 in range(i1 + 1)]
+
+
+def association_matrices(num_cols, pairs, associations):
+    """
+    Fills the Cramer's V and Theil's U matrices (see
+    categorical_association_matrices) with the output of
+    pair_associations for the pairs given by association_pairs.
+    """
+    cramers_v = np.empty([num_cols, num_cols])
+    theils_u = np.empty([num_cols, num_cols])
+    for (i1, i2), (v, u12, u21) in zip(pairs, associations):
+        cramers_v[i1, i2] = cramers_v[i2, i1] = v
+        theils_u[i1, i2] = u12
+        theils_u[i2, i1] = u21
+    return cramers_v, theils_u
 
 
 def cramers_v_corrected_matrix(df):
     """
-    Wrapper around dython's cramers_v. Given a dataframe df
-    containing only categorical data, it calculates Cramer's V
-    for each combination of columns, filling an output matrix, and
-    returns the output matrix.
+    Given a dataframe df containing only categorical data, it
+    calculates Cramer's V (with dython's bias correction) for each
+    combination of columns, filling an output matrix, and returns the
+    output matrix. See categorical_association_matrices.
 
     Parameters
     ----------
@@ -33,25 +297,15 @@ def cramers_v_corrected_matrix(df):
         number of columns of df, which contains the Cramer's V
         metrics for all combinations of columns in df.
     """
-
-    output = np.empty([df.shape[1], df.shape[1]])
-    array = np.array(df)
-
-    for i1 in range(array.shape[1]):
-        for i2 in range(array.shape[1]):
-            if i1 >= i2:
-                output[i1, i2] = cramers_v(array[:, i1], array[:, i2])
-                output[i2, i1] = output[i1, i2]
-
-    return output
+    return categorical_association_matrices(df)[0]
 
 
 def theils_u_matrix(df):
     """
-    Wrapper around dython's theils_u. Given a dataframe df
-    containing only categorical data, it calculates Theil's U
-    for each combination of columns, filling an output matrix, and
-    returns the output matrix.
+    Given a dataframe df containing only categorical data, it
+    calculates Theil's U (as dython's theils_u) for each combination of
+    columns, filling an output matrix, and returns the output matrix.
+    See categorical_association_matrices.
 
     Parameters
     ----------
@@ -65,23 +319,82 @@ def theils_u_matrix(df):
         number of columns of df, which contains the Theil's U
         metrics for all combinations of columns in df.
     """
+    return categorical_association_matrices(df)[1]
+
+
+def numeric_values(df):
+    """
+    Values of the numeric columns of df as a float array with one row
+    per row of df, minus the mean of each column. As in dython, missing
+    values are replaced with 0.0.
+
+    Returns
+    -------
+    centered : numpy.array
+        The centered values.
+    total_squares : numpy.array
+        The sum of squares of the centered values of each column (0 for
+        constant columns).
+    """
+    # (a copy, df can be the read-only original dataset)
+    values = df.to_numpy(dtype=float, copy=True)
+    values[np.isnan(values)] = 0.0
+    centered = values - values.mean(axis=0)
+    total_squares = np.sum(centered ** 2, axis=0)
+    total_squares[np.ptp(values, axis=0) == 0] = 0.0
+    return centered, total_squares
+
 
-    output = np.empty([df.shape[1], df.shape[1]])
-    array = np.array(df)
+def correlation_ratios(codes, num_levels, centered, total_squares, rows):
+    """
+    Correlation ratios of some categorical columns with all the numeric
+    columns. The sums of the numeric columns over the levels of all the
+    categorical columns are computed at once, as the product of the
+    (sparse) one-hot encoding of the categorical columns with the
+    centered numeric values. The correlation ratio of a categorical
+    column x with a numeric column y is then
+        sqrt(sum_g sum_y(g)**2 / n(g) / sum(y**2))
+    where g are the levels of x, n(g) the number of rows and sum_y(g)
+    the sum of y at level g. It is 0 when y is constant.
 
-    for i1 in range(array.shape[1]):
-        for i2 in range(array.shape[1]):
-            output[i1, i2] = theils_u(array[:, i1], array[:, i2])
+    Parameters
+    ----------
+    codes, num_levels : numpy.array
+        The codes of the categorical columns, see categorical_codes.
+    centered, total_squares : numpy.array
+        The numeric columns, see numeric_values.
+    rows : list
+        The indices of the categorical columns to compute.
 
+    Returns
+    -------
+    output : numpy.array
+        An array with one row per categorical column in rows and one
+        column per numeric column.
+    """
+    num_rows = codes.shape[1]
+    offsets = np.concatenate([[0], np.cumsum(num_levels[rows])])
+    levels = (codes[rows] + offsets[:-1, np.newaxis]).ravel()
+    onehot = sparse.csr_matrix((np.ones(len(levels)),
+                                (np.tile(np.arange(num_rows), len(rows)), levels)),
+                               shape=(num_rows, offsets[-1]))
+    counts = np.bincount(levels, minlength=offsets[-1])
+    sums = np.asarray(onehot.T @ centered)
+    between = np.add.reduceat(sums ** 2 / counts[:, np.newaxis], offsets[:-1], axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        output = np.sqrt(between / total_squares)
+    output[:, total_squares == 0] = 0.0
+    output[(1.0 < output) & (output <= 1.0 + precision)] = 1.0
     return output
 
 
 def correlation_ratio_matrix(df, categorical, numeric):
     """
-    Wrapper around dython's correlation ratio. Given a dataframe df
-    containing a mix of categorical and continuous data, it calculates
-    the correlation ratio for each combination of columns, filling an
-    output matrix, and returns the output matrix.
+    Given a dataframe df containing a mix of categorical and
+    continuous data, it calculates the correlation ratio (as dython's
+    correlation_ratio) for each combination of columns, filling an
+    output matrix, and returns the output matrix. See
+    correlation_ratios.
 
     Parameters
     ----------
@@ -101,20 +414,607 @@ def correlation_ratio_matrix(df, categorical, numeric):
         of continuous, which contains the correlation ratios for
         all combinations of columns in df.
     """
+    codes, num_levels = categorical_codes(df[categorical])
+    centered, total_squares = numeric_values(df[numeric])
+    return correlation_ratios(codes, num_levels, centered, total_squares,
+                              list(range(len(categorical))))
 
-    output = np.empty((df[categorical].shape[1], df[numeric].shape[1]))
 
-    for i1, col1 in enumerate(df[categorical].columns):
-        for i2, col2 in enumerate(df[numeric].columns):
-            output[i1, i2] = correlation_ratio(np.array(df[col1]),
-                                               np.array(df[col2]))
+def correlation_matrices(df, categorical_features, numeric_features, verbose=True):
+    """
+    Calculates all the correlation-like matrices of one dataset.
 
-    return output
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The dataset.
+    categorical_features : list
+        A list of column names which contain categorical data.
+    numeric_features : list
+        A list of column names which contain continuous data.
+    verbose : bool
+        If True (default), print the name of each matrix.
+
+    Returns
+    -------
+    matrices : dict
+        The matrices (as numpy arrays), with keys "Cramers_V",
+        "Theils_U", "Correlations" and "Correlation_Ratio". Only the
+        matrices that can be computed from the given column types are
+        included.
+    """
+    matrices = {}
+
+    # calculate Cramer's V and Thiel's U for
+    # categorical-categorical combinations of columns
+    if len(categorical_features) > 0:
+        if verbose:
+            print("Cramer's V and Theil's U...")
+        matrices["Cramers_V"], matrices["Theils_U"] = \
+            categorical_association_matrices(df[categorical_features])
+
+    # calculate correlations for continuous-continuous
+    # combinations of columns
+    if len(numeric_features) > 0:
+        if verbose:
+            print("Correlation...")
+        matrices["Correlations"] = np.array(df[numeric_features].corr())
+
+    # calculate correlation ratio for
+    # continuous-categorical combinations of columns
+    if (len(categorical_features) > 0) and (len(numeric_features) > 0):
+        if verbose:
+            print("Correlation ratio...")
+        matrices["Correlation_Ratio"] = correlation_ratio_matrix(df,
+                                                                 categorical_features,
+                                                                 numeric_features)
+    return matrices
+
+
+def save_shared(array, tmp_dir, name):
+    """Saves array to tmp_dir, so that the worker processes memory-map
+    it (see load_shared) instead of receiving a pickled copy"""
+    path = os.path.join(tmp_dir, name + ".npy")
+    np.save(path, array)
+    return path
+
+
+@functools.lru_cache(maxsize=8)
+def load_shared(path):
+    """Memory-maps an array saved by save_shared, once per process"""
+    return np.load(path, mmap_mode="r")
+
+
+def split_tiles(pairs, jobs):
+    """Splits a list of pairs of columns (or of columns) into about
+    tiles_per_job tiles of consecutive items per worker process"""
+    tile_size = max(1, int(np.ceil(len(pairs) / (tiles_per_job * jobs))))
+    return [pairs[i:i + tile_size] for i in range(0, len(pairs), tile_size)]
+
+
+def association_tile(path_codes, num_levels, entropies, pairs):
+    """
+    pair_associations for a tile of pairs of categorical columns, whose
+    codes are memory-mapped from path_codes. This is the unit of work
+    given to the worker processes.
+
+    Returns
+    -------
+    associations : list
+        See pair_associations.
+    warns : list
+        The warnings raised during the calculation.
+    """
+    with warnings.catch_warnings(record=True) as warns:
+        associations = pair_associations(load_shared(path_codes), num_levels,
+                                         entropies, pairs)
+    return associations, list(warns)
+
+
+def correlation_ratio_tile(path_codes, num_levels, path_centered, total_squares, rows):
+    """
+    correlation_ratios for a tile of categorical columns (rows), with
+    the codes and the centered numeric values memory-mapped from
+    path_codes and path_centered. This is the unit of work given to the
+    worker processes.
+
+    Returns
+    -------
+    ratios : numpy.array
+        See correlation_ratios.
+    warns : list
+        The warnings raised during the calculation.
+    """
+    with warnings.catch_warnings(record=True) as warns:
+        ratios = correlation_ratios(load_shared(path_codes), num_levels,
+                                    load_shared(path_centered), total_squares, rows)
+    return ratios, list(warns)
+
+
+def submit_correlation_matrices(executor, jobs, tmp_dir, name, df,
+                                categorical_features, numeric_features):
+    """
+    Starts calculating the correlation-like matrices of one dataset (see
+    correlation_matrices) on the worker processes of executor. The
+    columns are factorized here and saved to tmp_dir, the workers
+    memory-map them and process tiles of pairs of columns.
+
+    Returns
+    -------
+    pending : tuple
+        The arguments of collect_correlation_matrices.
+    """
+    num_categorical, num_numeric = len(categorical_features), len(numeric_features)
+    tiles = []
+    if num_categorical > 0:
+        codes, num_levels = categorical_codes(df[categorical_features])
+        path_codes = save_shared(codes, tmp_dir, f"{name}_codes")
+        entropies = column_entropies(codes)
+        for tile in split_tiles(association_pairs(num_categorical), jobs):
+            tiles.append(("associations", tile,
+                          executor.submit(association_tile, path_codes,
+                                          num_levels, entropies, tile)))
+
+    if (num_categorical > 0) and (num_numeric > 0):
+        centered, total_squares = numeric_values(df[numeric_features])
+        path_centered = save_shared(centered, tmp_dir, f"{name}_numeric")
+        for tile in split_tiles(list(range(num_categorical)), jobs):
+            tiles.append(("ratios", tile,
+                          executor.submit(correlation_ratio_tile, path_codes, num_levels,
+                                          path_centered, total_squares, tile)))
+
+    correlations = np.array(df[numeric_features].corr()) if num_numeric > 0 else None
+    return num_categorical, num_numeric, correlations, tiles
+
+
+def collect_correlation_matrices(num_categorical, num_numeric, correlations, tiles):
+    """
+    Waits for the tiles started by submit_correlation_matrices and
+    assembles the matrices.
+
+    Returns
+    -------
+    matrices : dict
+        See correlation_matrices.
+    warns : list
+        The warnings raised by the workers.
+    """
+    results = {"associations": ([], []), "ratios": ([], [])}
+    warns = []
+    for kind, tile, future in tiles:
+        values, tile_warns = future.result()
+        results[kind][0].extend(tile)
+        results[kind][1].extend(values)
+        warns.extend(tile_warns)
+
+    matrices = {}
+    if num_categorical > 0:
+        matrices["Cramers_V"], matrices["Theils_U"] = \
+            association_matrices(num_categorical, *results["associations"])
+    if num_numeric > 0:
+        matrices["Correlations"] = correlations
+    if (num_categorical > 0) and (num_numeric > 0):
+        matrices["Correlation_Ratio"] = np.empty((num_categorical, num_numeric))
+        for i1, ratios in zip(*results["ratios"]):
+            matrices["Correlation_Ratio"][i1] = ratios
+    return matrices, warns
+
+
+def parallel_correlation_matrices(orig_df, list_paths_released, path_original_meta,
+                                  categorical_features, numeric_features, jobs):
+    """
+    Calculates the correlation-like matrices (see correlation_matrices)
+    of the original dataset and of the released datasets in
+    list_paths_released, on a pool of jobs worker processes shared by
+    all datasets. The released datasets are read while the workers
+    process the previous ones.
+
+    Returns
+    -------
+    matrices_orig : dict
+        The matrices of the original dataset.
+    list_matrices_rlsd : list
+        The matrices of each released dataset.
+    warns : list
+        The warnings raised by the workers.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = [submit_correlation_matrices(executor, jobs, tmp_dir, "original", orig_df,
+                                               categorical_features, numeric_features)]
+        for i, path_released_file in enumerate(list_paths_released):
+            rlsd_df = read_released(path_released_file, path_original_meta)
+            pending.append(submit_correlation_matrices(executor, jobs, tmp_dir,
+                                                       f"released_{i}", rlsd_df,
+                                                       categorical_features,
+                                                       numeric_features))
+        list_matrices = []
+        warns = []
+        for one_pending in pending:
+            matrices, warns_dataset = collect_correlation_matrices(*one_pending)
+            list_matrices.append(matrices)
+            warns.extend(warns_dataset)
+    return list_matrices[0], list_matrices[1:], warns
+
+
+class CorrelationStatistics:
+    """
+    Sufficient statistics of the correlation-like matrices of a dataset
+    (see correlation_matrices), accumulated over chunks of its rows, so
+    that the memory used does not depend on the number of rows:
+
+    * the contingency table of each pair of categorical columns, the
+      levels of each column being numbered as they are found. Tables
+      that would have more than max_dense_table_cells cells are stored
+      as their non-zero cells only (see pair_keys and sum_counts),
+    * the sums, sums of squares and cross-products of the numeric
+      columns over the rows where both columns of a pair are given
+      (as pandas' corr, which excludes missing values pairwise),
+    * the sums of each numeric column at each level of each
+      categorical column (for the correlation ratio).
+
+    The numeric values are shifted by the means of the first chunk to
+    limit the loss of precision of the sums. The arrays indexed by the
+    levels of the categorical columns grow geometrically (see grow) as
+    new levels are found, only their first num_levels(i) entries are
+    used.
+    """
+
+    def __init__(self, categorical_features, numeric_features):
+        self.categorical_features = list(categorical_features)
+        self.numeric_features = list(numeric_features)
+        num_categorical, num_numeric = len(categorical_features), len(numeric_features)
+        self.num_rows = 0
+        # categorical columns: level -> code, with None for missing values
+        self.levels = [{} for _ in range(num_categorical)]
+        self.counts = [np.zeros(0, dtype=np.int64) for _ in range(num_categorical)]
+        self.pairs = [(i1, i2) for i1 in range(num_categorical) for i2 in range(i1)]
+        self.tables = {pair: np.zeros((0, 0), dtype=np.int64) for pair in self.pairs}
+        # sparse tables: keys (see pair_keys) and counts of the non-zero cells
+        self.sparse_tables = {}
+        # numeric columns, pairwise
+        self.shift = None
+        self.pair_counts = np.zeros((num_numeric, num_numeric))
+        self.pair_sums = np.zeros((num_numeric, num_numeric))
+        self.pair_squares = np.zeros((num_numeric, num_numeric))
+        self.cross_products = np.zeros((num_numeric, num_numeric))
+        # numeric columns with missing values replaced with 0.0 (as in
+        # dython), for the correlation ratio
+        self.sums = np.zeros(num_numeric)
+        self.squares = np.zeros(num_numeric)
+        self.minimum = np.full(num_numeric, np.inf)
+        self.maximum = np.full(num_numeric, -np.inf)
+        self.level_sums = [np.zeros((0, num_numeric)) for _ in range(num_categorical)]
+
+    def num_levels(self, i):
+        """Number of levels of categorical column i found so far"""
+        return len(self.levels[i])
+
+    def chunk_codes(self, column, i):
+        """Codes of the values of a chunk of categorical column i,
+        adding the new levels"""
+        col_codes, uniques = pd.factorize(column)
+        keys = list(uniques)
+        if (col_codes == -1).any():
+            # missing values (code -1) are given the last key
+            keys.append(None)
+        mapping = np.array([self.levels[i].setdefault(key, len(self.levels[i]))
+                            for key in keys], dtype=np.int64)
+        return mapping[col_codes]
+
+    def update(self, chunk):
+        """Adds the rows of chunk (a pandas.DataFrame) to the statistics"""
+        num_rows = len(chunk)
+        self.num_rows += num_rows
+
+        codes = [self.chunk_codes(chunk[col], i)
+                 for i, col in enumerate(self.categorical_features)]
+        num_levels = [self.num_levels(i) for i in range(len(self.levels))]
+        for i, col_codes in enumerate(codes):
+            self.counts[i] = grow(self.counts[i], num_levels[i])
+            self.counts[i][:num_levels[i]] += np.bincount(col_codes, minlength=num_levels[i])
+        for pair in self.pairs:
+            i1, i2 = pair
+            r, k = num_levels[i1], num_levels[i2]
+            if pair in self.tables and r * k > max(max_dense_table_cells, 4):
+                table = self.tables.pop(pair)
+                rows, cols = np.nonzero(table)
+                self.sparse_tables[pair] = pair_keys(rows, cols), table[rows, cols]
+            if pair in self.sparse_tables:
+                keys, counts = self.sparse_tables[pair]
+                self.sparse_tables[pair] = sum_counts(
+                    np.concatenate([keys, pair_keys(codes[i1], codes[i2])]),
+                    np.concatenate([counts, np.ones(num_rows, dtype=np.int64)]))
+            else:
+                table = grow(self.tables[pair], r, k)
+                table[:r, :k] += np.bincount(codes[i1] * k + codes[i2],
+                                             minlength=r * k).reshape(r, k)
+                self.tables[pair] = table
+
+        if len(self.numeric_features) == 0:
+            return
+        values = chunk[self.numeric_features].to_numpy(dtype=float)
+        if self.shift is None:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                self.shift = np.nan_to_num(np.nanmean(values, axis=0))
+        given = (~np.isnan(values)).astype(float)
+        shifted = np.nan_to_num(values - self.shift)
+        self.pair_counts += given.T @ given
+        self.pair_sums += shifted.T @ given
+        self.pair_squares += (shifted ** 2).T @ given
+        self.cross_products += shifted.T @ shifted
+
+        values = np.nan_to_num(values)
+        self.minimum = np.minimum(self.minimum, values.min(axis=0, initial=np.inf))
+        self.maximum = np.maximum(self.maximum, values.max(axis=0, initial=-np.inf))
+        shifted = values - self.shift
+        self.sums += shifted.sum(axis=0)
+        self.squares += (shifted ** 2).sum(axis=0)
+        for i, col_codes in enumerate(codes):
+            onehot = sparse.csr_matrix((np.ones(num_rows), (np.arange(num_rows), col_codes)),
+                                       shape=(num_rows, num_levels[i]))
+            self.level_sums[i] = grow(self.level_sums[i], num_levels[i])
+            self.level_sums[i][:num_levels[i]] += np.asarray(onehot.T @ shifted)
+
+    def merge_missing(self):
+        """
+        Merges the missing values of each categorical column with the
+        level equal to 0 (see is_zero_level), if there is one, as in
+        categorical_codes.
+        """
+        for i, levels in enumerate(self.levels):
+            zero = [code for key, code in levels.items()
+                    if key is not None and is_zero_level(key)]
+            if None not in levels or not zero:
+                continue
+            # the arrays are cut to the levels found before merging
+            sizes = [self.num_levels(j) for j in range(len(self.levels))]
+            missing = levels.pop(None)
+            for key, code in levels.items():
+                if code > missing:
+                    levels[key] = code - 1
+            self.counts[i] = merge_level(self.counts[i][:sizes[i]], missing, zero[0])
+            # (the level sums are only accumulated with numeric columns)
+            if self.numeric_features:
+                self.level_sums[i] = merge_level(self.level_sums[i][:sizes[i]],
+                                                 missing, zero[0])
+            for (i1, i2), table in self.tables.items():
+                table = table[:sizes[i1], :sizes[i2]]
+                if i1 == i:
+                    self.tables[(i1, i2)] = merge_level(table, missing, zero[0])
+                elif i2 == i:
+                    self.tables[(i1, i2)] = merge_level(table.T, missing, zero[0]).T
+            for (i1, i2), (keys, counts) in self.sparse_tables.items():
+                if i in (i1, i2):
+                    rows, cols = split_pair_keys(keys)
+                    if i1 == i:
+                        rows = merge_code(rows, missing, zero[0])
+                    else:
+                        cols = merge_code(cols, missing, zero[0])
+                    self.sparse_tables[(i1, i2)] = sum_counts(pair_keys(rows, cols), counts)
+
+    def associations(self, i1, i2):
+        """Cramer's V and Theil's U (see table_associations) of
+        categorical columns i1 >= i2"""
+        num_rows = self.num_rows
+        r, k = self.num_levels(i1), self.num_levels(i2)
+        counts_1, counts_2 = self.counts[i1][:r], self.counts[i2][:k]
+        entropy_1 = entropy(counts_1, num_rows)
+        entropy_2 = entropy(counts_2, num_rows)
+        if (i1, i2) in self.sparse_tables:
+            keys, counts = self.sparse_tables[(i1, i2)]
+            rows, cols = split_pair_keys(keys)
+            if r * k <= max(max_dense_table_cells, 4):
+                # (e.g. fewer levels after merge_missing)
+                table = np.zeros((r, k), dtype=np.int64)
+                table[rows, cols] = counts
+                chi2 = chi2_statistic(table)
+            else:
+                chi2 = sparse_chi2_statistic(counts, counts_1[rows], counts_2[cols], num_rows)
+            return table_associations(chi2, counts, num_rows, r, k, entropy_1, entropy_2)
+        if i1 > i2:
+            table = self.tables[(i1, i2)][:r, :k]
+            return table_associations(chi2_statistic(table), table.ravel(), num_rows,
+                                      r, k, entropy_1, entropy_2)
+        # a column with itself: the table is diagonal
+        counts = counts_1
+        if k * k <= max(max_dense_table_cells, 4):
+            chi2 = chi2_statistic(np.diag(counts))
+        else:
+            chi2 = sparse_chi2_statistic(counts, counts, counts, num_rows)
+        return table_associations(chi2, counts, num_rows, k, k, entropy_1, entropy_2)
+
+    def matrices(self):
+        """The matrices of correlation_matrices, from the statistics of
+        all the rows added so far"""
+        self.merge_missing()
+        num_categorical = len(self.categorical_features)
+        num_numeric = len(self.numeric_features)
+        matrices = {}
+        if num_categorical > 0:
+            pairs = association_pairs(num_categorical)
+            matrices["Cramers_V"], matrices["Theils_U"] = \
+                association_matrices(num_categorical, pairs,
+                                     [self.associations(i1, i2) for i1, i2 in pairs])
+
+        if num_numeric > 0:
+            # Pearson's correlations on the rows where both columns are given
+            n = self.pair_counts
+            with np.errstate(divide="ignore", invalid="ignore"):
+                covariances = self.cross_products - self.pair_sums * self.pair_sums.T / n
+                variances = self.pair_squares - self.pair_sums ** 2 / n
+                matrices["Correlations"] = covariances / np.sqrt(variances * variances.T)
+
+        if (num_categorical > 0) and (num_numeric > 0):
+            # between-group and total sums of squares around the mean
+            total_squares = self.squares - self.sums ** 2 / self.num_rows
+            output = np.empty((num_categorical, num_numeric))
+            for i in range(num_categorical):
+                n = self.num_levels(i)
+                between = np.sum(self.level_sums[i][:n] ** 2 / self.counts[i][:n, np.newaxis],
+                                 axis=0) - self.sums ** 2 / self.num_rows
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    output[i] = np.sqrt(np.maximum(between, 0) / total_squares)
+            output[:, self.maximum == self.minimum] = 0.0
+            output[(1.0 < output) & (output <= 1.0 + precision)] = 1.0
+            matrices["Correlation_Ratio"] = output
+        return matrices
+
+
+def grow(array, *shape):
+    """
+    Returns array if its first dimensions are at least shape, otherwise
+    array padded with zeros to at least twice its size in the dimensions
+    that are too small, so that arrays growing by a few entries at a time
+    are only copied a logarithmic number of times.
+    """
+    if all(size <= current for size, current in zip(shape, array.shape)):
+        return array
+    padding = [(0, max(size, 2 * current) - current if size > current else 0)
+               for size, current in zip(shape, array.shape)]
+    padding += [(0, 0)] * (array.ndim - len(shape))
+    return np.pad(array, padding)
+
+
+def pair_keys(rows, cols):
+    """Keys of the cells (rows, cols) of a sparse contingency table, in
+    the order of the rows then columns"""
+    return (np.asarray(rows, dtype=np.int64) << 32) | np.asarray(cols, dtype=np.int64)
+
+
+def split_pair_keys(keys):
+    """The rows and columns of the keys given by pair_keys"""
+    return keys >> 32, keys & 0xFFFFFFFF
+
+
+def sum_counts(keys, counts):
+    """Sums the counts of equal keys, returns the sorted unique keys and
+    their counts"""
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse, weights=counts, minlength=len(keys)).astype(np.int64)
+
+
+def merge_code(codes, source, target):
+    """Codes after merging level source into level target (see
+    merge_level): source becomes target and the codes above source are
+    shifted down"""
+    codes = np.where(codes == source, target, codes)
+    return codes - (codes > source)
+
+
+def merge_level(array, source, target):
+    """Adds row source of array to row target and removes row source"""
+    array = array.copy()
+    array[target] += array[source]
+    return np.delete(array, source, axis=0)
+
+
+def streaming_correlation_matrices(path_csv, categorical_features, numeric_features,
+                                   chunk_size=None):
+    """
+    Calculates the correlation-like matrices (see correlation_matrices)
+    of a .csv file read in chunks of chunk_size rows, accumulating their
+    sufficient statistics (see CorrelationStatistics) in a single pass.
+    The categorical columns are read as text. This is the unit of work
+    given to the worker processes in streaming mode.
+
+    Returns
+    -------
+    matrices : dict
+        See correlation_matrices.
+    warns : list
+        The warnings raised during the calculation.
+    """
+    statistics = CorrelationStatistics(categorical_features, numeric_features)
+    with warnings.catch_warnings(record=True) as warns:
+        chunks = pd.read_csv(path_csv, usecols=categorical_features + numeric_features,
+                             dtype={col: str for col in categorical_features},
+                             chunksize=chunk_size or default_chunk_size)
+        for chunk in chunks:
+            statistics.update(chunk)
+        matrices = statistics.matrices()
+    return matrices, list(warns)
+
+
+def sample_rows(path_csv, path_original_meta, sample, rng, chunk_size=None,
+                original=False):
+    """
+    Reads a uniform random sample of sample["size"] rows (without
+    replacement) of a dataset, with the dtypes of the original dataset.
+    With sample["method"] == "random", the dataset is read, then sampled.
+    With "reservoir", it is read in chunks of chunk_size rows, each row
+    being given a uniform random key, and the rows with the smallest keys
+    so far are kept, so that at most sample["size"] + chunk_size rows are
+    in memory.
+    """
+    size = sample["size"]
+    if sample["method"] == "random":
+        if original:
+            df = read_original(path_csv, path_original_meta)
+        else:
+            df = read_released(path_csv, path_original_meta)
+        if len(df) <= size:
+            return df
+        return df.iloc[np.sort(rng.choice(len(df), size, replace=False))]
+    if sample["method"] != "reservoir":
+        raise ValueError(f"Unknown sampling method: {sample['method']}, "
+                         f"should be 'random' or 'reservoir'")
+
+    reservoir, keys = None, np.empty(0)
+    for chunk in pd.read_csv(path_csv, chunksize=chunk_size or default_chunk_size):
+        reservoir = chunk if reservoir is None else pd.concat([reservoir, chunk])
+        keys = np.concatenate([keys, rng.random(len(chunk))])
+        if len(keys) > size:
+            # (in the order of the rows of the dataset)
+            kept = np.sort(np.argpartition(keys, size - 1)[:size])
+            reservoir, keys = reservoir.iloc[kept], keys[kept]
+    dtypes = metadata_dtypes(read_metadata(path_original_meta)) if path_original_meta else {}
+    return apply_dtypes(reservoir.reset_index(drop=True), dtypes)
+
+
+def sampled_correlation_matrices(path_csv, path_original_meta, categorical_features,
+                                 numeric_features, sample, random_seed, chunk_size=None,
+                                 original=False):
+    """
+    Calculates the correlation-like matrices (see correlation_matrices)
+    of a sample of the rows of a dataset (see sample_rows), and their
+    standard errors, estimated from sample["bootstrap"] bootstrap
+    resamples of the sample. The time taken depends on the size of the
+    sample, not of the dataset. This is the unit of work given to the
+    worker processes in sampled mode.
+
+    Returns
+    -------
+    matrices : dict
+        See correlation_matrices.
+    standard_errors : dict
+        The standard error of each entry of the matrices, with the same
+        keys as matrices.
+    warns : list
+        The warnings raised during the calculation.
+    """
+    rng = np.random.default_rng(random_seed)
+    with warnings.catch_warnings(record=True) as warns:
+        df = sample_rows(path_csv, path_original_meta, sample, rng,
+                         chunk_size=chunk_size, original=original)
+        matrices = correlation_matrices(df, categorical_features, numeric_features,
+                                        verbose=False)
+        list_bootstrap = [correlation_matrices(df.iloc[rng.integers(0, len(df), len(df))],
+                                               categorical_features, numeric_features,
+                                               verbose=False)
+                          for _ in range(sample["bootstrap"])]
+        standard_errors = {name: np.std([bootstrap[name] for bootstrap in list_bootstrap],
+                                        axis=0, ddof=1)
+                           for name in matrices}
+    return matrices, standard_errors, list(warns)
 
 
 def correlation_metrics(synth_method, path_original_ds,
                         path_original_meta, path_released_ds,
-                        output_file_json, random_seed=1234):
+                        output_file_json, random_seed=1234,
+                        multi_release=False, jobs=1, streaming=False,
+                        chunk_size=None, sample=None, output_format="json"):
     """
     Calculates correlation and correlation-like metrics for all
     combinations of columns of the original and released datasets
@@ -135,6 +1035,40 @@ def correlation_metrics(synth_method, path_original_ds,
         Path to the output json file that will be generated.
     random_seed : integer
         Random seed for numpy. Defaults to 1234
+    multi_release : bool
+        If False (default), only the first released dataset
+        (synthetic_data_1.csv) is used. If True, the matrices of all
+        released datasets (synthetic_data_*.csv) are calculated, the
+        output json contains their means and two more files are saved
+        next to it, with the matrices of each released dataset
+        (_releases.json) and their mean and variance (_aggregate.json).
+    jobs : integer
+        Number of worker processes. If larger than 1, the pairs of
+        columns of all datasets are processed in parallel (see
+        parallel_correlation_matrices). Defaults to 1.
+    streaming : bool
+        If True, each dataset is read in chunks of chunk_size rows
+        (default_chunk_size by default) and its matrices are computed
+        from statistics accumulated over the chunks (see
+        CorrelationStatistics), so that the datasets do not have to fit
+        in memory. The datasets are then processed in parallel if more
+        than one job is used. Defaults to False.
+    chunk_size : integer
+        Number of rows per chunk in streaming mode (and when sampling
+        with the "reservoir" method).
+    sample : dict
+        If given, the matrices are computed on a random sample of the
+        rows of each dataset (see sampled_correlation_matrices), the
+        missing keys being taken from default_sample. The output json
+        then also contains the bootstrap standard errors of the matrices
+        (with keys ending with _SE, from at least 2 resamples). The
+        datasets are processed in parallel if more than one job is used.
+    output_format : string
+        "json" (default): the matrices are saved as nested lists in
+        output_file_json. "npz": the matrices (and the names of their
+        rows and columns) are saved to a binary .npz file next to it, see
+        load_correlation_matrices, and output_file_json only contains
+        summary scores (see correlation_summary).
     """
 
     print("[INFO] Calculating correlation-like utility metrics:")
@@ -143,8 +1077,7 @@ def correlation_metrics(synth_method, path_original_ds,
     np.random.seed(random_seed)
 
     # read metadata in JSON format
-    with open(path_original_meta) as orig_metadata_json:
-        orig_metadata = json.load(orig_metadata_json)
+    orig_metadata = read_metadata(path_original_meta)
 
     # divide columns into categorical and numeric
     categorical_types = ['Categorical', 'Ordinal', 'DateTime']
@@ -152,52 +1085,90 @@ def correlation_metrics(synth_method, path_original_ds,
         find_column_types(orig_metadata, synth_method, categorical_types)
 
     # read original and released/synthetic datasets,
-    # only the first synthetic data set (synthetic_data_1.csv)
+    # by default only the first synthetic data set (synthetic_data_1.csv)
     # is used for utility evaluation
-    orig_df = pd.read_csv(path_original_ds)
-    rlsd_df = pd.read_csv(path_released_ds + "/synthetic_data_1.csv")
+    if multi_release:
+        list_paths_released = released_paths(path_released_ds)
+    else:
+        list_paths_released = [os.path.join(path_released_ds, "synthetic_data_1.csv")]
 
+    # calculate the matrices of the original and released datasets,
+    # in parallel over tiles of pairs of columns if more than one job
+    # is used
+    standard_errors_orig, list_standard_errors_rlsd = None, None
     with warnings.catch_warnings(record=True) as warns:
-        # calculate Cramer's V and Thiel's U for
-        # categorical-categorical combinations of
-        # columns for both datasets
-        if len(categorical_features) > 0:
-            print("Cramer's V...")
-            cramers_matrix_orig = cramers_v_corrected_matrix(orig_df[categorical_features])
-            cramers_matrix_rlsd = cramers_v_corrected_matrix(rlsd_df[categorical_features])
-            print("Theil's U...")
-            theils_matrix_orig = theils_u_matrix(orig_df[categorical_features])
-            theils_matrix_rlsd = theils_u_matrix(rlsd_df[categorical_features])
-
-        # calculate correlations for continuous-continuous
-        # combinations of columns
-        if len(numeric_features) > 0:
-            print("Correlation...")
-            correlation_matrix_orig = np.array(orig_df[numeric_features].corr())
-            correlation_matrix_rlsd = np.array(rlsd_df[numeric_features].corr())
+        if sample is not None:
+            sample = {**default_sample, **sample}
+            # the sample standard deviation needs two resamples
+            if sample["bootstrap"] < 2:
+                raise ValueError(f"Invalid number of bootstrap resamples: "
+                                 f"{sample['bootstrap']}, should be at least 2")
+            list_paths = [path_original_ds] + list_paths_released
+            args_sampled = (list_paths, repeat(path_original_meta),
+                            repeat(categorical_features), repeat(numeric_features),
+                            repeat(sample), [random_seed + i for i in range(len(list_paths))],
+                            repeat(chunk_size), [True] + [False] * len(list_paths_released))
+            if jobs > 1:
+                with ProcessPoolExecutor(max_workers=jobs) as executor:
+                    list_outputs = list(executor.map(sampled_correlation_matrices,
+                                                     *args_sampled))
+            else:
+                list_outputs = list(map(sampled_correlation_matrices, *args_sampled))
+            matrices_orig, standard_errors_orig, _ = list_outputs[0]
+            list_matrices_rlsd = [matrices for matrices, _, _ in list_outputs[1:]]
+            list_standard_errors_rlsd = [errors for _, errors, _ in list_outputs[1:]]
+            warns_workers = [iw for _, _, warns_dataset in list_outputs for iw in warns_dataset]
+        elif streaming:
+            args_streaming = ([path_original_ds] + list_paths_released,
+                              repeat(categorical_features), repeat(numeric_features),
+                              repeat(chunk_size))
+            if jobs > 1:
+                with ProcessPoolExecutor(max_workers=jobs) as executor:
+                    list_outputs = list(executor.map(streaming_correlation_matrices,
+                                                     *args_streaming))
+            else:
+                list_outputs = list(map(streaming_correlation_matrices, *args_streaming))
+            matrices_orig = list_outputs[0][0]
+            list_matrices_rlsd = [matrices for matrices, _ in list_outputs[1:]]
+            warns_workers = [iw for _, warns_dataset in list_outputs for iw in warns_dataset]
+        elif jobs > 1:
+            orig_df = read_original(path_original_ds, path_original_meta)
+            matrices_orig, list_matrices_rlsd, warns_workers = \
+                parallel_correlation_matrices(orig_df, list_paths_released,
+                                              path_original_meta, categorical_features,
+                                              numeric_features, jobs)
+        else:
+            orig_df = read_original(path_original_ds, path_original_meta)
+            matrices_orig = correlation_matrices(orig_df, categorical_features,
+                                                 numeric_features)
+            list_matrices_rlsd = [correlation_matrices(read_released(path_released_file,
+                                                                     path_original_meta),
+                                                       categorical_features, numeric_features)
+                                  for path_released_file in list_paths_released]
+            warns_workers = []
+    warns.extend(warns_workers)
 
-        # calculate correlation ratio for
-        # continuous-categorical combinations of columns
-        if (len(categorical_features) > 0) and (len(numeric_features) > 0):
-            print("Correlation ratio...")
-            correlation_ratio_matrix_orig = correlation_ratio_matrix(orig_df,
-                                                                     categorical_features,
-                                                                     numeric_features)
-            correlation_ratio_matrix_rlsd = correlation_ratio_matrix(rlsd_df,
-                                                                     categorical_features,
-                                                                     numeric_features)
-    
-    # store in dictionary after converting numpy arrays
-    # to lists in order to allow .json serialisation
-    utility_collector = {"Cramers_V_Original": cramers_matrix_orig.tolist(),
-                         "Cramers_V_Released": cramers_matrix_rlsd.tolist(),
-                         "Theils_U_Original": theils_matrix_orig.tolist(),
-                         "Theils_U_Released": theils_matrix_rlsd.tolist(),
-                         "Correlations_Original": correlation_matrix_orig.tolist(),
-                         "Correlations_Released": correlation_matrix_rlsd.tolist(),
-                         "Correlation_Ratio_Original": correlation_ratio_matrix_orig.tolist(),
-                         "Correlation_Ratio_Released": correlation_ratio_matrix_rlsd.tolist()
-                         }
+    # the matrices of the released datasets are averaged (with a
+    # single released dataset, the mean is the matrix itself)
+    matrices_rlsd = {name: np.mean([matrices[name] for matrices in list_matrices_rlsd], axis=0)
+                     for name in matrices_orig}
+
+    # store in dictionary (the matrices are converted to lists in
+    # the .json format, see save_output)
+    utility_collector = {}
+    for name in matrices_orig:
+        utility_collector[f"{name}_Original"] = matrices_orig[name]
+        utility_collector[f"{name}_Released"] = matrices_rlsd[name]
+
+    # standard errors in sampled mode, the released datasets being
+    # independent, the standard error of their mean is
+    # sqrt(sum of the squared standard errors) / number of datasets
+    if standard_errors_orig is not None:
+        for name in matrices_orig:
+            utility_collector[f"{name}_Original_SE"] = standard_errors_orig[name]
+            utility_collector[f"{name}_Released_SE"] = \
+                np.sqrt(np.sum([errors[name] ** 2 for errors in list_standard_errors_rlsd],
+                               axis=0)) / len(list_standard_errors_rlsd)
 
     # print warnings
     if len(warns) > 0:
@@ -205,15 +1176,129 @@ def correlation_metrics(synth_method, path_original_ds,
         for iw in warns:
             print(iw.message)
 
-    # save as .json
-    with open(output_file_json, "w") as out_fio:
-        json.dump(utility_collector, out_fio)
+    # save as .json, or as .npz with only the summary scores in
+    # the .json file
+    path_output_prefix = os.path.splitext(output_file_json)[0]
+    features = (categorical_features, numeric_features)
+    save_output(path_output_prefix, utility_collector, output_format, features)
+    if output_format == "npz":
+        with open(output_file_json, "w") as out_fio:
+            json.dump(correlation_summary(matrices_orig, matrices_rlsd,
+                                          os.path.basename(path_output_prefix + ".npz")),
+                      out_fio)
+
+    if multi_release:
+        releases_collector = {os.path.basename(one_path): {f"{name}_Released": matrices[name]
+                                                           for name in matrices}
+                              for one_path, matrices in zip(list_paths_released, list_matrices_rlsd)}
+        if list_standard_errors_rlsd is not None:
+            for one_path, errors in zip(list_paths_released, list_standard_errors_rlsd):
+                releases_collector[os.path.basename(one_path)].update(
+                    {f"{name}_Released_SE": errors[name] for name in errors})
+        save_output(path_output_prefix + "_releases", releases_collector, output_format, features)
+
+        ddof = 1 if len(list_matrices_rlsd) > 1 else 0
+        aggregate_collector = {
+            "mean": {f"{name}_Released": matrices_rlsd[name]
+                     for name in matrices_rlsd},
+            "variance": {f"{name}_Released": np.var([matrices[name] for matrices in list_matrices_rlsd],
+                                                    axis=0, ddof=ddof)
+                         for name in matrices_rlsd}}
+        save_output(path_output_prefix + "_aggregate", aggregate_collector, output_format,
+                    features)
+
+
+def save_output(path_prefix, collector, output_format="json", features=None):
+    """
+    Saves a (possibly nested) dictionary of matrices to path_prefix.json,
+    as nested lists, or to path_prefix.npz (see matrix_store), with the
+    keys of nested dictionaries joined by "/" (e.g.
+    "synthetic_data_1.csv/Cramers_V_Released"). In the .npz file, the
+    names of the categorical and numeric columns given by features (a
+    tuple of two lists) are saved next to the matrices, see
+    load_correlation_matrices.
+    """
+    def flatten(collector, prefix=""):
+        for key, value in collector.items():
+            if isinstance(value, dict):
+                yield from flatten(value, f"{prefix}{key}/")
+            else:
+                yield f"{prefix}{key}", value
+
+    def to_lists(collector):
+        return {key: to_lists(value) if isinstance(value, dict) else value.tolist()
+                for key, value in collector.items()}
+
+    if output_format == "npz":
+        arrays = dict(flatten(collector))
+        if features is not None:
+            arrays["categorical_features"] = np.array(features[0], dtype=str)
+            arrays["numeric_features"] = np.array(features[1], dtype=str)
+        save_matrices(path_prefix + ".npz", arrays)
+    elif output_format == "json":
+        with open(path_prefix + ".json", "w") as out_fio:
+            json.dump(to_lists(collector), out_fio)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}, "
+                         f"should be 'json' or 'npz'")
+
+
+def correlation_summary(matrices_orig, matrices_rlsd, matrices_file=None):
+    """
+    Summary scores of the differences between the original and released
+    matrices: for each matrix, the Frobenius norm and the largest
+    absolute value of the difference (ignoring the entries that are NaN
+    in either matrix).
+    """
+    summary = {}
+    for name in matrices_orig:
+        diff = np.asarray(matrices_rlsd[name]) - np.asarray(matrices_orig[name])
+        summary[name] = {"frobenius_distance": float(np.sqrt(np.nansum(diff ** 2))),
+                         "max_abs_difference": float(np.nanmax(np.abs(diff)))
+                         if not np.isnan(diff).all() else None}
+    if matrices_file is not None:
+        summary["matrices_file"] = matrices_file
+    return summary
+
+
+def load_correlation_matrices(path_npz, mmap=True):
+    """
+    Loads the matrices saved by correlation_metrics in the "npz"
+    output format, as pandas DataFrames indexed by the names of the
+    columns of the dataset. With mmap=True (default), the DataFrames are
+    backed by read-only memory maps of the file (see
+    matrix_store.load_matrices).
+
+    Returns
+    -------
+    matrices : dict
+        The matrices, with the keys of the .json file of the "json"
+        output format: nested dictionaries for the
+        utility_correlations_releases and _aggregate files (e.g.
+        matrices["mean"]["Cramers_V_Released"]).
+    """
+    arrays = load_matrices(path_npz, mmap=mmap)
+    if "categorical_features" not in arrays or "numeric_features" not in arrays:
+        raise ValueError(f"{path_npz} does not contain the names of the columns, "
+                         f"it was not saved by correlation_metrics")
+    features = {"categorical": list(arrays.pop("categorical_features")),
+                "numeric": list(arrays.pop("numeric_features"))}
+    matrices = {}
+    for key, array in arrays.items():
+        *groups, name = key.split("/")
+        rows, cols = matrix_axes[name.split("_Original")[0].split("_Released")[0]]
+        nested = matrices
+        for group in groups:
+            nested = nested.setdefault(group, {})
+        nested[name] = pd.DataFrame(array, index=features[rows], columns=features[cols],
+                                    copy=False)
+    return matrices
 
 
-def main():
+def main(argv=None):
 
     # process command line arguments
-    args = handle_cmdline_args()
+    args = handle_cmdline_args(argv)
 
     # read run input parameters file
     with open(args.infile) as f:
@@ -232,11 +1317,19 @@ def main():
 
     # create output .json full path
     output_file_json = path_released_ds + f"/utility_correlations.json"
+    multi_release = synth_params['utility_parameters_correlations'].get("multi_release", False)
+    streaming = synth_params['utility_parameters_correlations'].get("streaming", False)
+    chunk_size = synth_params['utility_parameters_correlations'].get("chunk_size", None)
+    sample = synth_params['utility_parameters_correlations'].get("sample", None)
+    output_format = synth_params['utility_parameters_correlations'].get("output_format", "json")
 
     # calculate and save correlation-like metrics
     correlation_metrics(synth_method, path_original_ds,
                         path_original_meta, path_released_ds,
-                        output_file_json, random_seed)
+                        output_file_json, random_seed,
+                        multi_release=multi_release, jobs=args.jobs,
+                        streaming=streaming, chunk_size=chunk_size, sample=sample,
+                        output_format=output_format)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,256 @@
+import json
+import os
+import sys
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, \
+    confusion_matrix
+from sklearn.linear_model import LogisticRegression
+from sklearn.tree import DecisionTreeClassifier
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import classifiers
+from classifiers import confusion_counts, calculate_metrics, calculate_confusion_matrix, \
+    fill_missing, make_search, default_search, search_sample_size
+from data_loader import read_csv_typed
+
+
+def sklearn_metrics(y_pred, y_test):
+    """Metrics of calculate_metrics, computed by the scikit-learn scores"""
+    scores = {"precision": precision_score, "recall": recall_score, "f1": f1_score}
+    expected = {"accuracy": {"value": accuracy_score(y_pred, y_test) * 100.}}
+    for name, score in scores.items():
+        expected[name] = {average: score(y_pred, y_test, average=average,
+                                         zero_division=True) * 100.
+                          for average in ["macro", "weighted"]}
+    return expected
+
+
+def assert_metrics_equal(metrics, expected):
+    assert metrics.keys() == expected.keys()
+    for name in expected:
+        assert metrics[name] == pytest.approx(expected[name])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_calculate_metrics_matches_sklearn(seed):
+    rng = np.random.RandomState(seed)
+    # some labels are only predicted, some only in the test set
+    y_test = rng.choice(["a", "b", "c", "d"], 200, p=[0.5, 0.3, 0.2, 0.0])
+    y_pred = rng.choice(["a", "b", "c", "d", "e"], 200, p=[0.4, 0.2, 0.0, 0.2, 0.2])
+    conf_matrix = confusion_counts(y_pred, y_test)
+    np.testing.assert_array_equal(conf_matrix, confusion_matrix(y_pred, y_test))
+
+    assert_metrics_equal(calculate_metrics(y_pred, y_test), sklearn_metrics(y_pred, y_test))
+
+
+def test_calculate_metrics_integer_labels():
+    y_test = np.array([1, 2, 2, 3, 3, 3])
+    y_pred = np.array([1, 2, 3, 3, 3, 1])
+    assert_metrics_equal(calculate_metrics(y_pred, y_test), sklearn_metrics(y_pred, y_test))
+    output = calculate_confusion_matrix(y_pred, y_test, target_names=np.array([1, 2, 3]))
+    assert output["conf_matrix"] == confusion_matrix(y_pred, y_test).tolist()
+
+
+def test_fill_missing_categorical(tmp_path):
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({"region": rng.choice([1, 2, 3, 4, np.nan], 100),
+                       "edu": rng.choice(["PRIMARY", "SECONDARY", None], 100),
+                       "age": rng.choice([20, 30, 40, np.nan], 100),
+                       "income": rng.rand(100)})
+    path_csv = str(tmp_path / "dataset.csv")
+    df.to_csv(path_csv, index=False)
+
+    # as when the categorical columns were read as numbers/text
+    expected = pd.read_csv(path_csv)
+    expected = expected.fillna(expected.median(numeric_only=True))
+    filled = fill_missing(read_csv_typed(path_csv, {"region": "category", "edu": "category"}))
+    assert isinstance(filled["region"].dtype, pd.CategoricalDtype)
+    assert not filled["region"].isna().any()
+    for col in ["region", "age", "income"]:
+        np.testing.assert_array_equal(filled[col].astype(float), expected[col])
+    pd.testing.assert_series_equal(filled["edu"].astype(object), expected["edu"])
+
+
+def make_released(seed):
+    """Dataset of the classifier tests, job is the label"""
+    rng = np.random.RandomState(seed)
+    sex = rng.choice(["MALE", "FEMALE"], 200)
+    df = pd.DataFrame({"sex": sex,
+                       "edu": rng.choice(["PRIMARY", "SECONDARY", "HIGHER"], 200),
+                       "age": rng.randint(18, 70, 200),
+                       "income": rng.rand(200) * 1000 + (sex == "MALE") * 300})
+    df["job"] = np.where(df["income"] > 700, "A", rng.choice(["B", "C"], 200))
+    return df
+
+
+@pytest.fixture
+def datasets(write_datasets):
+    """Original dataset (with its metadata) and released datasets of
+    make_released, see write_datasets in conftest.py"""
+    columns = [{"name": "sex", "type": "Categorical"}, {"name": "edu", "type": "Categorical"},
+               {"name": "age", "type": "DiscreteNumerical"},
+               {"name": "income", "type": "ContinuousNumerical"},
+               {"name": "job", "type": "Categorical"}]
+    return write_datasets(columns, make_released)
+
+
+# one classifier in each mode
+test_classifiers = {LogisticRegression: {"mode": "main", "params_main": {"max_iter": 500}},
+                    DecisionTreeClassifier: {"mode": "range",
+                                             "params_range": {
+                                                 "classifier__max_depth": [2, 4, 8],
+                                                 "classifier__min_samples_leaf": [1, 5]}}}
+
+
+def assert_outputs_equal(output, expected):
+    """Same nested outputs (e.g. those of run_classifier_metrics),
+    up to rounding errors"""
+    if isinstance(expected, dict):
+        assert output.keys() == expected.keys()
+        for key in expected:
+            assert_outputs_equal(output[key], expected[key])
+    elif isinstance(expected, list):
+        assert len(output) == len(expected)
+        for one_output, one_expected in zip(output, expected):
+            assert_outputs_equal(one_output, one_expected)
+    elif isinstance(expected, float):
+        assert output == pytest.approx(expected)
+    else:
+        assert output == expected
+
+
+def run_classifier_metrics(datasets, tmp_path, name, synth_method="synthpop", **kwargs):
+    """Runs classifier_metrics on the datasets (see the datasets fixture)
+    with the outputs in tmp_path/name, returns the output files"""
+    path_original, path_meta, path_released = datasets
+    path_output = str(tmp_path / name)
+    os.makedirs(path_output)
+    for filename in os.listdir(path_released):
+        if filename.startswith("synthetic_data_"):
+            os.link(os.path.join(path_released, filename), os.path.join(path_output, filename))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        classifiers.classifier_metrics(synth_method, path_original, path_meta, path_output,
+                                       ["sex", "edu", "age", "income"], "job", 0.2,
+                                       test_classifiers, **{"use_cache": False, **kwargs})
+    outputs = {}
+    for filename in sorted(os.listdir(path_output)):
+        if filename.startswith("utility_"):
+            with open(os.path.join(path_output, filename)) as f:
+                outputs[filename] = json.load(f)
+    return outputs
+
+
+@pytest.mark.parametrize("multi_release, releases_in_flight", [(False, 2), (True, 1),
+                                                               (True, 2), (True, 3)])
+def test_parallel_matches_sequential(multi_release, releases_in_flight, datasets, tmp_path,
+                                    monkeypatch):
+    expected = run_classifier_metrics(datasets, tmp_path, "jobs_1", jobs=1,
+                                      multi_release=multi_release)
+    monkeypatch.setattr(classifiers, "releases_in_flight", releases_in_flight)
+    assert run_classifier_metrics(datasets, tmp_path, "jobs_2", jobs=2,
+                                  multi_release=multi_release) == expected
+
+
+def test_preprocess_once_matches_pipeline(datasets, tmp_path):
+    expected = run_classifier_metrics(datasets, tmp_path, "pipeline", preprocess_once=False)
+    assert_outputs_equal(run_classifier_metrics(datasets, tmp_path, "once",
+                                                preprocess_once=True), expected)
+
+
+@pytest.mark.parametrize("preprocess_once", [True, False])
+def test_sparse_onehot_matches_dense(preprocess_once, datasets, tmp_path, monkeypatch):
+    expected = run_classifier_metrics(datasets, tmp_path, "dense", sparse_onehot=False,
+                                      preprocess_once=preprocess_once)
+    # the encoded data is always sparse
+    monkeypatch.setattr(classifiers, "sparse_threshold", 1.)
+    assert_outputs_equal(run_classifier_metrics(datasets, tmp_path, "sparse",
+                                                sparse_onehot=True,
+                                                preprocess_once=preprocess_once),
+                         expected)
+
+
+def test_original_results_cache(datasets, tmp_path, monkeypatch):
+    monkeypatch.setattr(classifiers, "cache_dir", str(tmp_path / "cache"))
+    fits = []
+    fit_and_predict = classifiers.fit_and_predict
+
+    def counting_fit_and_predict(*args, **kwargs):
+        fits.append(args[0])
+        return fit_and_predict(*args, **kwargs)
+
+    monkeypatch.setattr(classifiers, "fit_and_predict", counting_fit_and_predict)
+    expected = run_classifier_metrics(datasets, tmp_path, "no_cache", use_cache=False)
+    assert len(fits) == 4
+
+    # the models trained on the original dataset are stored, then read
+    # from the cache instead of being fitted again, also by another
+    # synthesis method with the same column types
+    path_cache = tmp_path / "cache" / classifiers.original_results_cache_subdir
+    for name, synth_method, num_fits in [("miss", "synthpop", 4), ("hit", "synthpop", 2),
+                                         ("other_method", "ctgan", 2)]:
+        fits.clear()
+        assert_outputs_equal(run_classifier_metrics(datasets, tmp_path, name, synth_method,
+                                                    use_cache=True), expected)
+        assert len(fits) == num_fits
+        assert len(os.listdir(path_cache)) == len(test_classifiers)
+
+    # all the columns are discrete with sgf: the original models differ
+    fits.clear()
+    run_classifier_metrics(datasets, tmp_path, "sgf", "sgf", use_cache=True)
+    assert len(fits) == 4
+    assert len(os.listdir(path_cache)) == 2 * len(test_classifiers)
+    run_classifier_metrics(datasets, tmp_path, "evicted", use_cache=True, cache_max_size=0)
+    assert os.listdir(path_cache) == []
+
+
+def test_make_search():
+    rng = np.random.RandomState(0)
+    X = rng.rand(200, 3)
+    y = np.where(X[:, 0] + 0.3 * rng.rand(200) > 0.6, "a", "b")
+    param_grid = {"max_depth": [2, 4, 8], "min_samples_leaf": [1, 5]}
+
+    search = {**default_search, "strategy": "random", "n_iter": 3}
+    clf = make_search(DecisionTreeClassifier(), param_grid, search, random_seed=0).fit(X, y)
+    assert len(clf.cv_results_["params"]) == 3
+    assert len({tuple(params.items()) for params in clf.cv_results_["params"]}) == 3
+
+    # all the candidates are evaluated on the fewest rows, the best half
+    # of them on twice as many rows
+    search = {**default_search, "strategy": "halving", "factor": 2, "min_resources": 50}
+    clf = make_search(DecisionTreeClassifier(), param_grid, search, random_seed=0).fit(X, y)
+    assert clf.n_candidates_[:2] == [6, 3]
+    assert clf.n_resources_[:2] == [50, 100]
+    assert hasattr(clf, "best_estimator_")
+
+    # with a subsample, the best classifier is trained by fit_and_predict
+    search = {**default_search, "subsample": 0.5}
+    assert not make_search(DecisionTreeClassifier(), param_grid, search).refit
+    with pytest.raises(ValueError):
+        make_search(DecisionTreeClassifier(), param_grid, {**search, "strategy": "bayes"})
+
+
+@pytest.mark.parametrize("search", [{"strategy": "random", "n_iter": 3},
+                                    {"strategy": "halving", "factor": 2, "subsample": 0.5}])
+def test_search_strategies(search, datasets, tmp_path):
+    expected = run_classifier_metrics(datasets, tmp_path, "jobs_1", search=search)
+    assert set(expected["utility_o_o.json"]) == {"LogisticRegression", "DecisionTreeClassifier"}
+    assert run_classifier_metrics(datasets, tmp_path, "jobs_2", search=search,
+                                  jobs=2) == expected
+
+
+def test_search_sample_size():
+    assert search_sample_size(None, 100) is None
+    assert search_sample_size(0.25, 100) == 25
+    assert search_sample_size(30, 100) == 30
+    assert search_sample_size(30., 100) == 30
+    assert search_sample_size(300, 100) is None
+    # 1 is a fraction (all the rows), not a single row
+    assert search_sample_size(1, 100) is None
+    assert search_sample_size(1., 100) is None
+    for subsample in [0, -5, 0., 2.5]:
+        with pytest.raises(ValueError):
+            search_sample_size(subsample, 100)
@@ -0,0 +1,242 @@
+import json
+import os
+import sys
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from dython.nominal import cramers_v, theils_u, correlation_ratio
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import correlations
+from correlations import categorical_association_matrices, correlation_ratio_matrix
+
+
+def make_categorical(num_rows, seed):
+    """Categorical columns with text and integer levels, missing values,
+    a binary column, a constant column and a correlated pair"""
+    rng = np.random.RandomState(seed)
+    sex = rng.choice(["MALE", "FEMALE"], num_rows)
+    df = pd.DataFrame({"sex": sex,
+                       "edu": rng.choice(["PRIMARY", "SECONDARY", "HIGHER", None], num_rows),
+                       "region": rng.choice([0, 1, 2, 3, np.nan], num_rows),
+                       "job": np.where(sex == "MALE", rng.choice(["A", "B"], num_rows), "C"),
+                       "country": "UK",
+                       "id": np.arange(num_rows) % 37})
+    return df.astype("category")
+
+
+def dython_matrices(df):
+    """Cramer's V and Theil's U computed by dython, pair by pair"""
+    array = np.array(df)
+    num_cols = array.shape[1]
+    cramers = np.empty([num_cols, num_cols])
+    theils = np.empty([num_cols, num_cols])
+    for i1 in range(num_cols):
+        for i2 in range(num_cols):
+            cramers[i1, i2] = cramers_v(array[:, i1], array[:, i2])
+            theils[i1, i2] = theils_u(array[:, i1], array[:, i2])
+    return cramers, theils
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("max_cells", [2**22, 0])
+def test_categorical_association_matrices_match_dython(seed, max_cells, monkeypatch):
+    # max_cells=0 counts all the tables as sparse
+    monkeypatch.setattr(correlations, "max_dense_table_cells", max_cells)
+    df = make_categorical(300, seed)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        expected_v, expected_u = dython_matrices(df)
+        output_v, output_u = categorical_association_matrices(df)
+    np.testing.assert_allclose(output_v, expected_v, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(output_u, expected_u, rtol=1e-9, atol=1e-12)
+
+
+def test_categorical_codes_missing_values():
+    df = pd.DataFrame({"a": pd.Categorical([1, 0, None, 1]),
+                       "b": pd.Categorical(["x", None, "y", "x"])})
+    codes, num_levels = correlations.categorical_codes(df)
+    # missing values are merged with 0 (as in dython), or form a new level
+    np.testing.assert_array_equal(codes, [[0, 1, 1, 0], [0, 2, 1, 0]])
+    np.testing.assert_array_equal(num_levels, [2, 3])
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_correlation_ratio_matrix_matches_dython(seed):
+    rng = np.random.RandomState(seed)
+    df = make_categorical(300, seed)
+    categorical = list(df.columns)
+    df["income"] = rng.rand(300) * 1000 + (df["sex"] == "MALE") * 200
+    df["hours"] = np.where(rng.rand(300) < 0.1, np.nan, rng.randint(0, 60, 300))
+    df["level"] = 5.0
+    numeric = ["income", "hours", "level"]
+    expected = np.array([[correlation_ratio(np.array(df[col1]), np.array(df[col2]))
+                          for col2 in numeric] for col1 in categorical])
+    output = correlation_ratio_matrix(df, categorical, numeric)
+    np.testing.assert_allclose(output, expected, rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize("chunk_size", [37, 1000])
+@pytest.mark.parametrize("max_cells", [2**22, 10])
+def test_streaming_matches_in_memory(chunk_size, max_cells, tmp_path, monkeypatch):
+    # with max_cells=10, most contingency tables are sparse
+    monkeypatch.setattr(correlations, "max_dense_table_cells", max_cells)
+    rng = np.random.RandomState(0)
+    df = make_categorical(300, 0)
+    categorical = list(df.columns)
+    df["income"] = rng.rand(300) * 1000 + (df["sex"] == "MALE") * 200
+    df["hours"] = np.where(rng.rand(300) < 0.1, np.nan, rng.randint(0, 60, 300))
+    df["level"] = 5.0
+    numeric = ["income", "hours", "level"]
+    path_csv = str(tmp_path / "dataset.csv")
+    df.to_csv(path_csv, index=False)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        df_read = pd.read_csv(path_csv)
+        df_read[categorical] = df_read[categorical].astype("category")
+        expected = correlations.correlation_matrices(df_read, categorical, numeric)
+        output, _ = correlations.streaming_correlation_matrices(path_csv, categorical, numeric,
+                                                                chunk_size=chunk_size)
+    assert list(output) == list(expected)
+    for name in expected:
+        np.testing.assert_allclose(output[name], expected[name], rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize("chunk_size", [2, 1000])
+def test_streaming_categorical_only(chunk_size, tmp_path):
+    # missing values merged with 0 and with the text "0"
+    df = pd.DataFrame({"a": [0, 1, np.nan, 1, 0, 2],
+                       "b": ["x", "y", None, "0", "y", "x"],
+                       "c": ["x", "y", "y", "x", "z", "x"]})
+    path_csv = str(tmp_path / "dataset.csv")
+    df.to_csv(path_csv, index=False)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        expected = correlations.correlation_matrices(pd.read_csv(path_csv).astype("category"),
+                                                     ["a", "b", "c"], [])
+        output, _ = correlations.streaming_correlation_matrices(path_csv, ["a", "b", "c"], [],
+                                                                chunk_size=chunk_size)
+    assert list(output) == list(expected) == ["Cramers_V", "Theils_U"]
+    for name in expected:
+        np.testing.assert_allclose(output[name], expected[name], rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize("method", ["random", "reservoir"])
+def test_sample_rows(method, tmp_path):
+    df = make_categorical(300, 0)
+    df["row"] = np.arange(300)
+    path_csv = str(tmp_path / "dataset.csv")
+    df.to_csv(path_csv, index=False)
+    sample = {"size": 50, "method": method, "bootstrap": 5}
+    rng = np.random.default_rng(0)
+    df_sample = correlations.sample_rows(path_csv, None, sample, rng, chunk_size=40)
+    assert len(df_sample) == 50
+    assert df_sample["row"].is_unique and df_sample["row"].is_monotonic_increasing
+    pd.testing.assert_frame_equal(df_sample.reset_index(drop=True),
+                                  pd.read_csv(path_csv).iloc[df_sample["row"]].reset_index(drop=True))
+
+    matrices, standard_errors, _ = correlations.sampled_correlation_matrices(
+        path_csv, None, ["sex", "job"], ["row"], sample, 0, chunk_size=40)
+    assert list(standard_errors) == list(matrices)
+    for name in matrices:
+        assert standard_errors[name].shape == matrices[name].shape
+
+
+
+# column types of the datasets of make_released
+released_columns = [{"name": "sex", "type": "Categorical"},
+                    {"name": "edu", "type": "Categorical"},
+                    {"name": "job", "type": "Categorical"}, {"name": "id", "type": "Ordinal"},
+                    {"name": "income", "type": "ContinuousNumerical"},
+                    {"name": "hours", "type": "DiscreteNumerical"}]
+
+
+def make_released(seed):
+    """Categorical columns of make_categorical and numerical columns,
+    written by write_datasets (see conftest.py)"""
+    df = make_categorical(200, seed)[["sex", "edu", "job", "id"]]
+    rng = np.random.RandomState(seed)
+    df["income"] = rng.rand(200) * 1000 + (df["sex"] == "MALE") * 200
+    df["hours"] = rng.randint(0, 60, 200)
+    return df
+
+
+def test_npz_output_matches_json(write_datasets, tmp_path):
+    path_original, path_meta, path_released = write_datasets(released_columns, make_released)
+    for output_format in ["json", "npz"]:
+        os.makedirs(tmp_path / output_format)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            correlations.correlation_metrics(
+                "synthpop", path_original, path_meta, path_released,
+                str(tmp_path / output_format / "utility_correlations.json"),
+                multi_release=True, output_format=output_format)
+
+    for suffix in ["", "_releases", "_aggregate"]:
+        with open(tmp_path / "json" / f"utility_correlations{suffix}.json") as f:
+            expected = json.load(f)
+        loaded = correlations.load_correlation_matrices(
+            str(tmp_path / "npz" / f"utility_correlations{suffix}.npz"))
+        if suffix == "":
+            expected, loaded = {"": expected}, {"": loaded}
+        assert set(loaded) == set(expected)
+        for group in expected:
+            assert set(loaded[group]) == set(expected[group])
+            for name, matrix in expected[group].items():
+                np.testing.assert_array_equal(loaded[group][name].values, matrix)
+
+    loaded = correlations.load_correlation_matrices(
+        str(tmp_path / "npz" / "utility_correlations_releases.npz"))
+    matrix = loaded["synthetic_data_2.csv"]["Correlation_Ratio_Released"]
+    assert list(matrix.index) == ["sex", "edu", "job", "id"]
+    assert list(matrix.columns) == ["income", "hours"]
+    with open(tmp_path / "npz" / "utility_correlations.json") as f:
+        summary = json.load(f)
+    assert summary["matrices_file"] == "utility_correlations.npz"
+    assert set(summary["Cramers_V"]) == {"frobenius_distance", "max_abs_difference"}
+
+
+def test_grow():
+    array = np.ones((3, 2))
+    assert correlations.grow(array, 2, 2) is array
+    grown = correlations.grow(array, 4, 1)
+    assert grown.shape == (6, 2)
+    np.testing.assert_array_equal(grown[:3], array)
+    assert not grown[3:].any()
+    assert correlations.grow(grown, 20).shape == (20, 2)
+
+
+@pytest.mark.parametrize("mode", [{}, {"streaming": True, "chunk_size": 70},
+                                  {"sample": {"size": 100, "bootstrap": 3}}])
+@pytest.mark.parametrize("multi_release", [False, True])
+def test_parallel_matches_sequential(mode, multi_release, write_datasets, tmp_path):
+    path_original, path_meta, path_released = write_datasets(released_columns, make_released)
+    outputs = []
+    for jobs in [1, 2]:
+        path_output = tmp_path / f"jobs_{jobs}"
+        os.makedirs(path_output)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            correlations.correlation_metrics(
+                "synthpop", path_original, path_meta, path_released,
+                str(path_output / "utility_correlations.json"), jobs=jobs,
+                multi_release=multi_release, **mode)
+        outputs.append({})
+        for filename in sorted(os.listdir(path_output)):
+            with open(path_output / filename) as f:
+                outputs[-1][filename] = json.load(f)
+    assert len(outputs[0]) == (3 if multi_release else 1)
+    assert outputs[1] == outputs[0]
+
+
+@pytest.mark.parametrize("bootstrap", [0, 1])
+def test_sample_too_few_bootstrap_resamples(bootstrap, write_datasets, tmp_path):
+    path_original, path_meta, path_released = write_datasets(released_columns, make_released,
+                                                             num_releases=1)
+    with pytest.raises(ValueError, match="bootstrap"):
+        correlations.correlation_metrics(
+            "synthpop", path_original, path_meta, path_released,
+            str(tmp_path / "utility_correlations.json"), sample={"bootstrap": bootstrap})
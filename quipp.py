@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+"""
+Runs the QUiPP pipeline for a set of run inputs without make.
+
+    python quipp.py run [-j JOBS] [--force] [run-inputs/example.json ...]
+    python quipp.py report [-j JOBS] [run-inputs/example.json ...]
+    python quipp.py dashboard [--watch SECONDS]
+
+For each enabled run input (by default all of run-inputs/*.json), the
+synthesis is followed by the privacy and utility metric stages. These
+stages form a task graph which is scheduled on a pool of worker
+processes. Synthesis runs as a separate process (see synthesize.py),
+the metric stages run inside the workers, which keep the original
+datasets and metadata they have read in memory and so parse each of
+them once instead of once per stage.
+
+Like make, a stage is skipped if its output is newer than its inputs
+(the run input and the first synthetic dataset).
+
+The html reports of the classifier metrics are generated by the
+separate report command (see metrics/report/report.py), which renders
+the figures of all the reports on a pool of worker processes. The
+dashboard command builds a single dashboard comparing the metrics of
+all the runs (see metrics/report/dashboard.py).
+
+Should be run from within the QUIPP-pipeline root directory
+"""
+
+import argparse
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import traceback
+import warnings
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from glob import glob
+
+QUIPP_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# directories containing the metric scripts
+METRICS_DIRS = [os.path.join(QUIPP_ROOT, "metrics", "privacy-metrics"),
+                os.path.join(QUIPP_ROOT, "metrics", "utility-metrics"),
+                os.path.join(QUIPP_ROOT, "metrics", "report"),
+                os.path.join(QUIPP_ROOT, "metrics", "utilities")]
+
+# stages run after the synthesis: (stage name, module, output file)
+# these mirror the metric rules of the Makefile
+METRIC_STAGES = [("privacy", "disclosure_risk", "privacy_disclosure_risk.json"),
+                 ("classifiers", "classifiers", "utility_overall_diff.json"),
+                 ("correlations", "correlations", "utility_correlations.json")]
+
+# metric scripts given the number of cores of their task (--cores),
+# which their parallel parts (e.g. the parameter searches of the
+# classifiers) use instead of all the cores of the machine
+CORE_BUDGET_MODULES = ["classifiers"]
+
+# output of the synthesis used to decide if it is up to date
+SYNTHESIS_OUTPUT = "synthetic_data_1.csv"
+
+
+def handle_cmdline_args():
+    """Return an object with the command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description='Run the QUiPP pipeline (synthesis, privacy and utility '
+                    'metrics) for a set of run input json files.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_run = subparsers.add_parser(
+        'run', help='Run all the stages of the pipeline that are out of date')
+    parser_run.add_argument(
+        'run_inputs', nargs='*',
+        help='The run input json files (default: run-inputs/*.json)')
+    parser_run.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=1,
+        help='Number of worker processes to use (default: 1)')
+    parser_run.add_argument(
+        '--force', dest='force', action='store_true',
+        help='Run all the stages, even the ones that are up to date')
+
+    parser_report = subparsers.add_parser(
+        'report', help='Generate the html reports of the classifier metrics')
+    parser_report.add_argument(
+        'run_inputs', nargs='*',
+        help='The run input json files (default: all the runs with classifier metrics)')
+    parser_report.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=1,
+        help='Number of worker processes used to render the figures (default: 1)')
+
+    parser_dashboard = subparsers.add_parser(
+        'dashboard', help='Build the dashboard comparing the metrics of all the runs')
+    parser_dashboard.add_argument(
+        '--watch', dest='watch', type=float, default=None,
+        help='Keep updating the dashboard, checking for new outputs every WATCH seconds')
+
+    args = parser.parse_args()
+    return args
+
+
+def init_worker():
+    """Make the metric scripts importable in the worker processes"""
+    for one_dir in METRICS_DIRS:
+        if one_dir not in sys.path:
+            sys.path.append(one_dir)
+
+
+def run_synthesis(path_run_input, path_output):
+    """Run the synthesis described in path_run_input (as in the Makefile)"""
+    if not os.path.isdir(path_output):
+        os.makedirs(path_output)
+    shutil.copy(path_run_input, path_output)
+    subprocess.run([sys.executable, os.path.join(QUIPP_ROOT, "synthesize.py"),
+                    "-i", path_run_input, "-o", path_output], check=True)
+
+
+def run_metric(module_name, path_run_input, path_output, *options):
+    """
+    Run the main function of a metric script in the current process,
+    with the command line options given. The warning filters and the
+    environment variables changed by the script are restored
+    afterwards, so that they do not affect the next tasks of the worker.
+    """
+    module = importlib.import_module(module_name)
+    environ = dict(os.environ)
+    try:
+        with warnings.catch_warnings():
+            module.main(["-i", path_run_input, "-o", path_output, "-j", "1", *options])
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def run_task(func, *args):
+    """
+    Run one task in a worker process. The metric scripts exit with
+    sys.exit on invalid inputs, the SystemExit is turned into an
+    ordinary exception so that only this task fails (instead of the
+    whole pipeline, when it is raised again in the main process).
+    """
+    try:
+        return func(*args)
+    except SystemExit as e:
+        raise RuntimeError(f"exited with status: {e.code}") from None
+
+
+def is_up_to_date(path_target, paths_dependencies):
+    """True if path_target exists and is newer than all its dependencies"""
+    if not os.path.isfile(path_target):
+        return False
+    mtime_target = os.path.getmtime(path_target)
+    return all(os.path.isfile(one_path) and os.path.getmtime(one_path) <= mtime_target
+               for one_path in paths_dependencies)
+
+
+def build_tasks(paths_run_inputs, force=False, cores=None):
+    """
+    Build the task graph for a list of run input files. If cores is
+    given, the metric scripts of CORE_BUDGET_MODULES use at most this
+    many cores each.
+
+    Returns
+    -------
+    tasks : dict
+        Keys are task names ("<run input>:<stage>"), values are
+        dictionaries with the function to call ("func"), its arguments
+        ("args") and the names of the tasks it depends on ("deps").
+        Stages that are up to date are not included.
+    """
+    tasks = {}
+    for path_run_input in paths_run_inputs:
+        with open(path_run_input) as f:
+            synth_params = json.load(f)
+        if not synth_params["enabled"]:
+            continue
+
+        run_name = os.path.splitext(os.path.basename(path_run_input))[0]
+        path_output = os.path.join("synth-output", run_name)
+        path_synthesis_output = os.path.join(path_output, SYNTHESIS_OUTPUT)
+
+        synthesis_deps = []
+        if force or not is_up_to_date(path_synthesis_output, [path_run_input]):
+            tasks[f"{run_name}:synthesis"] = {"func": run_synthesis,
+                                              "args": (path_run_input, path_output),
+                                              "deps": []}
+            synthesis_deps = [f"{run_name}:synthesis"]
+
+        for stage_name, module_name, target in METRIC_STAGES:
+            path_target = os.path.join(path_output, target)
+            if (not force) and (not synthesis_deps) and \
+                    is_up_to_date(path_target, [path_run_input, path_synthesis_output]):
+                continue
+            options = ("--cores", str(cores)) \
+                if cores is not None and module_name in CORE_BUDGET_MODULES else ()
+            tasks[f"{run_name}:{stage_name}"] = {"func": run_metric,
+                                                 "args": (module_name, path_run_input,
+                                                          path_output, *options),
+                                                 "deps": synthesis_deps}
+    return tasks
+
+
+def run_tasks(tasks, jobs=1):
+    """
+    Run the tasks built by build_tasks on a pool of jobs worker
+    processes. A task is submitted as soon as all the tasks it depends on
+    have finished, tasks depending on a failed task are not run.
+
+    Returns
+    -------
+    failed : list
+        Names of the tasks that failed or were not run.
+    """
+    done = set()
+    failed = []
+    waiting = dict(tasks)
+    running = {}
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker) as executor:
+        while waiting or running:
+            # submit the tasks whose dependencies are done
+            for name, task in list(waiting.items()):
+                if any(dep in failed for dep in task["deps"]):
+                    print(f"[ERROR] {name}: not run, a task it depends on failed")
+                    failed.append(name)
+                    del waiting[name]
+                elif all(dep in done for dep in task["deps"]):
+                    print(f"[INFO] {name}: started")
+                    running[executor.submit(run_task, task["func"], *task["args"])] = name
+                    del waiting[name]
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception:
+                    print(f"[ERROR] {name}: failed")
+                    traceback.print_exc()
+                    failed.append(name)
+                else:
+                    print(f"[INFO] {name}: finished")
+                    done.add(name)
+    return failed
+
+
+def run_reports(paths_run_inputs, jobs=1):
+    """Generate the reports of the runs of paths_run_inputs (all the
+    runs with classifier metrics if empty)"""
+    init_worker()
+    report = importlib.import_module("report")
+    paths_output = [os.path.join("synth-output", os.path.splitext(os.path.basename(one_path))[0])
+                    for one_path in paths_run_inputs]
+    for filename in report.batch_report(report.report_paths(paths_output), jobs=jobs):
+        print(f"[INFO] Report written to {filename}")
+
+
+def main():
+    args = handle_cmdline_args()
+
+    if args.command == 'dashboard':
+        os.chdir(QUIPP_ROOT)
+        init_worker()
+        dashboard = importlib.import_module("dashboard")
+        dashboard.main([] if args.watch is None else ["--watch", str(args.watch)])
+        return
+
+    if args.run_inputs:
+        paths_run_inputs = [os.path.relpath(os.path.abspath(one_path), QUIPP_ROOT)
+                            for one_path in args.run_inputs]
+    os.chdir(QUIPP_ROOT)
+    if args.command == 'report':
+        run_reports(paths_run_inputs if args.run_inputs else [], jobs=args.jobs)
+        return
+    if not args.run_inputs:
+        paths_run_inputs = sorted(glob(os.path.join("run-inputs", "*.json")))
+
+    # the cores are shared by the tasks run at the same time
+    cores = max(1, (os.cpu_count() or 1) // args.jobs)
+    tasks = build_tasks(paths_run_inputs, force=args.force, cores=cores)
+    if not tasks:
+        print("[INFO] Everything is up to date")
+        return
+
+    failed = run_tasks(tasks, jobs=args.jobs)
+    if failed:
+        sys.exit(f"[ERROR] {len(failed)} task(s) failed or were not run: {', '.join(failed)}")
+
+
+if __name__ == '__main__':
+    main()
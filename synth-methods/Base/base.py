@@ -7,6 +7,10 @@ import pandas as pd
 import re
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir,
+                             "metrics", "utilities"))
+from data_loader import read_original, read_metadata, metadata_dtypes, default_memory_usage
+
 # --- Base class to be used in synth-methods 
 class SynthesizerBase:
 
@@ -16,10 +20,14 @@ class SynthesizerBase:
         self.metadata = None
         self.model = None
 
-    def read_data(self, csv_path, json_path, verbose=True):
+    def read_data(self, csv_path, json_path, verbose=True, float32=False):
         """Reads input data from .csv file and metadata from .json file.
         Stores the data and metadata within the class object if
         store_internally=True (default). User can define a synthesis name (synth_name)
+        The column dtypes are set from the metadata types: Categorical and
+        Ordinal columns are categoricals, DiscreteNumerical columns use the
+        smallest integer type that fits, DateTime columns are datetime64 and,
+        if float32=True, ContinuousNumerical columns are float32.
         Returns data (pandas dataframe) and metadata (dictionary)"""
 
         # --- CHECK csv and json files
@@ -28,14 +36,16 @@ class SynthesizerBase:
         if not os.path.isfile(json_path):
             sys.exit("File does not exist: %s" % json_path)
 
-        # Read csv from file
-        data = pd.read_csv(csv_path)
+        # Read csv from file (or from the typed dataset cache),
+        # with the dtypes given by the metadata, as a copy that the
+        # synthesis methods can modify
+        schema = {"integers": True, "dates": True, "float32": float32}
+        data = read_original(csv_path, json_path, copy=True, **schema)
         # Extract csv filename only, remove extension and use as dataset_name
         self.dataset_name = re.split(".csv", os.path.basename(csv_path), flags=re.IGNORECASE)[0]
 
         # Read json from file
-        with open(json_path) as metadata_json:
-            metadata = json.load(metadata_json)
+        metadata = read_metadata(json_path)
 
         # >>> CHECK JSON file
         if not ('columns' in metadata):
@@ -53,6 +63,12 @@ class SynthesizerBase:
                                                                                                   name_metadata))
         # <<<
 
+        if verbose:
+            memory = data.memory_usage(deep=True, index=False).sum()
+            memory_default = default_memory_usage(data, metadata_dtypes(metadata, **schema))
+            print(f"[INFO] Memory used by the input data: {memory / 2**20:.1f} MB "
+                  f"({memory_default / 2**20:.1f} MB without the dtypes from the metadata)")
+
         return data, metadata
 
     def fit_synthesizer(self):
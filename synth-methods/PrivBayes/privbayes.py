@@ -12,6 +12,7 @@ from DataSynthesizer.lib.utils import read_json_file, display_bayesian_network
 
 sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, "Base"))
 from base import SynthesizerBase
+from data_loader import read_original
 
 
 class SynthesizerPrivBayes(SynthesizerBase):
@@ -88,9 +89,12 @@ class SynthesizerPrivBayes(SynthesizerBase):
 
         # for integer columns, make sure the ones classified as categorical by the .json file are
         # included in the int_dict used by PrivBayes
-        df = pd.read_csv(csv_path)
+        # (categorical columns are integer if their categories are)
+        df = read_original(csv_path, metadata_json_path)
         integer_types = ['int_', 'intp', 'int8', 'int16', 'int32', 'int64']
         integer_columns = list(df.select_dtypes(include=integer_types).columns)
+        integer_columns += [col for col in df.select_dtypes(include='category').columns
+                            if pd.api.types.is_integer_dtype(df[col].cat.categories)]
         int_dict = {col['name']: 'Integer' for col in self.metadata['columns']
                     if (col['type'] == 'DiscreteNumerical') or (col['type'] in ['Ordinal', 'Categorical'] and
                                                                 col['name'] in integer_columns)}
@@ -0,0 +1,126 @@
+import json
+import os
+import sys
+import warnings
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+from quipp import build_tasks, run_metric, run_tasks, CORE_BUDGET_MODULES, METRIC_STAGES, \
+    SYNTHESIS_OUTPUT
+
+
+def write_file(path, contents):
+    with open(path, "w") as f:
+        f.write(contents)
+
+
+def append_after(path_dependency, path, contents):
+    """Fails if the task it depends on has not written its output"""
+    if not os.path.isfile(path_dependency):
+        raise RuntimeError(f"{path_dependency} does not exist")
+    write_file(path, contents)
+
+
+def exit_task():
+    sys.exit("invalid parameters")
+
+
+@pytest.fixture
+def run_inputs(tmp_path, monkeypatch):
+    """Run inputs example (enabled) and disabled, with the cwd set to tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("run-inputs")
+    paths = []
+    for name, enabled in [("example", True), ("disabled", False)]:
+        paths.append(os.path.join("run-inputs", f"{name}.json"))
+        with open(paths[-1], "w") as f:
+            json.dump({"enabled": enabled}, f)
+    return paths
+
+
+def set_mtime(path, mtime):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    if not os.path.isfile(path):
+        write_file(path, "")
+    os.utime(path, (mtime, mtime))
+
+
+def test_build_tasks(run_inputs):
+    metric_tasks = [f"example:{stage_name}" for stage_name, _, _ in METRIC_STAGES]
+
+    # nothing has been run: the metrics depend on the synthesis
+    tasks = build_tasks(run_inputs)
+    assert sorted(tasks) == sorted(["example:synthesis"] + metric_tasks)
+    for name in metric_tasks:
+        assert tasks[name]["deps"] == ["example:synthesis"]
+
+    # everything is up to date
+    path_output = os.path.join("synth-output", "example")
+    set_mtime(run_inputs[0], 100)
+    set_mtime(os.path.join(path_output, SYNTHESIS_OUTPUT), 200)
+    for _, _, target in METRIC_STAGES:
+        set_mtime(os.path.join(path_output, target), 300)
+    assert build_tasks(run_inputs) == {}
+    assert sorted(build_tasks(run_inputs, force=True)) == sorted(tasks)
+
+    # only the metric older than the synthetic data is run again
+    stage_name, _, target = METRIC_STAGES[0]
+    set_mtime(os.path.join(path_output, target), 150)
+    tasks = build_tasks(run_inputs)
+    assert list(tasks) == [f"example:{stage_name}"]
+    assert tasks[f"example:{stage_name}"]["deps"] == []
+
+    # a modified run input runs the synthesis and all the metrics again
+    set_mtime(run_inputs[0], 400)
+    assert sorted(build_tasks(run_inputs)) == sorted(["example:synthesis"] + metric_tasks)
+
+
+def test_build_tasks_cores(run_inputs):
+    tasks = build_tasks(run_inputs, cores=3)
+    for stage_name, module_name, _ in METRIC_STAGES:
+        args = tasks[f"example:{stage_name}"]["args"]
+        if module_name in CORE_BUDGET_MODULES:
+            assert args[3:] == ("--cores", "3")
+        else:
+            assert len(args) == 3
+    # without a budget the scripts use all the cores
+    assert all(len(task["args"]) == 3 for name, task in build_tasks(run_inputs).items()
+               if name != "example:synthesis")
+
+
+def test_run_metric_restores_warnings(tmp_path, monkeypatch):
+    """A metric script silencing the warnings does not affect the next tasks"""
+    write_file(str(tmp_path / "silent_metric.py"),
+               "import os\n"
+               "import warnings\n"
+               "calls = []\n"
+               "def main(argv):\n"
+               "    calls.append(argv)\n"
+               "    warnings.simplefilter('ignore')\n"
+               "    os.environ['PYTHONWARNINGS'] = 'ignore'\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delenv("PYTHONWARNINGS", raising=False)
+    filters = list(warnings.filters)
+
+    run_metric("silent_metric", "run.json", "output", "--cores", "2")
+    import silent_metric
+    assert silent_metric.calls == [["-i", "run.json", "-o", "output", "-j", "1",
+                                    "--cores", "2"]]
+    assert warnings.filters == filters
+    assert "PYTHONWARNINGS" not in os.environ
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_tasks(tmp_path, jobs):
+    path_a, path_b, path_c = [str(tmp_path / name) for name in ["a", "b", "c"]]
+    tasks = {"b": {"func": append_after, "args": (path_a, path_b, "b"), "deps": ["a"]},
+             "a": {"func": write_file, "args": (path_a, "a"), "deps": []},
+             "exit": {"func": exit_task, "args": (), "deps": []},
+             "after_exit": {"func": write_file, "args": (path_c, "c"), "deps": ["exit"]}}
+    failed = run_tasks(tasks, jobs=jobs)
+    # the task calling sys.exit fails alone, the tasks depending on it
+    # are not run, the others run after their dependencies
+    assert sorted(failed) == ["after_exit", "exit"]
+    assert os.path.isfile(path_a) and os.path.isfile(path_b)
+    assert not os.path.isfile(path_c)